@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""crtsh: Serve a synthetic certificate corpus the way crt.sh does.
+
+A stand-in for the two crt.sh endpoints used by admiral.certs.tasks, so
+that the certificate ingest path can be exercised and measured without the
+network:
+
+    /?Identity=[%.]<domain>[&exclude=expired]&output=json  summary records
+    /?d=<id>                                               a PEM certificate
+
+Each log entry is issued twice, like a real CA: as a precertificate with
+the poison extension, and as a certificate with a list of SCTs.  Subjects
+have SANs, and some certificates have already expired.  Point admiral at
+it by setting admiral_crtsh_url to the URL printed on startup.
+
+Usage:
+  crtsh [options]
+  crtsh (-h | --help)
+
+Options:
+  -d --domains=<count>     Number of domains in the corpus [default: 10]
+  -c --certs=<count>       Number of certificates per domain [default: 100]
+  -H --host=<address>      Address to listen on [default: 127.0.0.1]
+  -p --port=<port>         Port to listen on [default: 8000]
+  --seed=<seed>            Random seed for the corpus [default: 0]
+"""
+
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import random
+import socket
+from socketserver import ThreadingMixIn
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID, ObjectIdentifier
+
+# the extension holding the SCTs of a certificate, RFC 6962 section 3.3
+SCT_LIST_OID = ObjectIdentifier("1.3.6.1.4.1.11129.2.4.2")
+# certificates are valid for this long
+VALIDITY = timedelta(days=90)
+# and were issued up to this long ago, so some have expired
+MAX_AGE = timedelta(days=180)
+
+
+def der_octet_string(data):
+    """DER encode bytes as an OCTET STRING."""
+    length = len(data)
+    if length < 0x80:
+        encoded_length = bytes([length])
+    else:
+        octets = length.to_bytes((length.bit_length() + 7) // 8, "big")
+        encoded_length = bytes([0x80 | len(octets)]) + octets
+    return b"\x04" + encoded_length + data
+
+
+def sct_list_extension(timestamps, rng):
+    """Create an SCT list extension with an SCT logged at each timestamp.
+
+    The log IDs and signatures are random bytes, nothing verifies them.
+    """
+    scts = b""
+    for timestamp in timestamps:
+        signature = bytes(rng.getrandbits(8) for _ in range(71))
+        sct = (
+            b"\x00"  # v1
+            + bytes(rng.getrandbits(8) for _ in range(32))  # log id
+            + int(timestamp.timestamp() * 1000).to_bytes(8, "big")
+            + b"\x00\x00"  # no extensions
+            + b"\x04\x03"  # sha256, ecdsa
+            + len(signature).to_bytes(2, "big")
+            + signature
+        )
+        scts += len(sct).to_bytes(2, "big") + sct
+    sct_list = len(scts).to_bytes(2, "big") + scts
+    return x509.UnrecognizedExtension(SCT_LIST_OID, der_octet_string(sct_list))
+
+
+class Corpus(object):
+    """A synthetic set of CT log entries."""
+
+    def __init__(self, domains=10, certs=100, seed=0):
+        """Generate certs certificates (and precertificates) per domain."""
+        rng = random.Random(seed)
+        backend = default_backend()
+        # a single key pair for everything, key generation dominates otherwise
+        self.key = ec.generate_private_key(ec.SECP256R1(), backend)
+        self.issuer = x509.Name(
+            [
+                x509.NameAttribute(NameOID.COUNTRY_NAME, "US"),
+                x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Admiral Benchmark CA"),
+                x509.NameAttribute(NameOID.COMMON_NAME, "Admiral Benchmark CA 1"),
+            ]
+        )
+        self.domains = [f"agency{i}.gov" for i in range(domains)]
+        self.now = datetime.utcnow().replace(microsecond=0)
+        # log id: (summary record, PEM)
+        self.entries = {}
+        log_id = 1000
+        for domain in self.domains:
+            for i in range(certs):
+                name = domain if i % 10 == 0 else f"host{i}.{domain}"
+                sans = [name, f"www.{name}"]
+                serial = rng.getrandbits(120)
+                not_before = self.now - timedelta(
+                    seconds=rng.randrange(int(MAX_AGE.total_seconds()))
+                )
+                for precert in (True, False):
+                    pem = self.issue(sans, serial, not_before, precert, rng)
+                    self.entries[log_id] = (
+                        self.summary(log_id, sans, serial, not_before),
+                        pem,
+                    )
+                    log_id += 1
+
+    def issue(self, sans, serial, not_before, precert, rng):
+        """Issue a PEM encoded certificate or precertificate."""
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, sans[0])]))
+            .issuer_name(self.issuer)
+            .public_key(self.key.public_key())
+            .serial_number(serial)
+            .not_valid_before(not_before)
+            .not_valid_after(not_before + VALIDITY)
+            .add_extension(
+                x509.SubjectAlternativeName([x509.DNSName(san) for san in sans]),
+                critical=False,
+            )
+        )
+        if precert:
+            builder = builder.add_extension(x509.PrecertPoison(), critical=True)
+        else:
+            logged = [not_before + timedelta(seconds=rng.randrange(60)) for _ in "ab"]
+            builder = builder.add_extension(
+                sct_list_extension(logged, rng), critical=False
+            )
+        cert = builder.sign(self.key, hashes.SHA256(), default_backend())
+        return cert.public_bytes(serialization.Encoding.PEM).decode()
+
+    def summary(self, log_id, sans, serial, not_before):
+        """Create the crt.sh summary record of a log entry."""
+        return {
+            "issuer_ca_id": 1,
+            "issuer_name": self.issuer.rfc4514_string(),
+            "common_name": sans[0],
+            "name_value": "\n".join(sans),
+            "id": log_id,
+            "min_cert_id": log_id,
+            "entry_timestamp": not_before.isoformat(),
+            "min_entry_timestamp": not_before.isoformat(),
+            "not_before": not_before.isoformat(),
+            "not_after": (not_before + VALIDITY).isoformat(),
+            "serial_number": f"{serial:x}",
+        }
+
+    def search(self, identity, exclude_expired=False):
+        """Return the summary records matching a crt.sh Identity search."""
+        if identity.startswith("%."):
+            suffix = identity[1:]
+
+            def matches(name):
+                return name.endswith(suffix)
+
+        else:
+
+            def matches(name):
+                return name == identity
+
+        now = self.now.isoformat()
+        return [
+            summary
+            for summary, _ in self.entries.values()
+            if any(matches(name) for name in summary["name_value"].split("\n"))
+            and not (exclude_expired and summary["not_after"] < now)
+        ]
+
+    @property
+    def size(self):
+        """The number of log entries."""
+        return len(self.entries)
+
+
+class CrtshHandler(BaseHTTPRequestHandler):
+    """Answer crt.sh queries from the server's corpus."""
+
+    def do_GET(self):
+        """Handle a summary or certificate request."""
+        corpus = self.server.corpus
+        query = parse_qs(urlsplit(self.path).query, keep_blank_values=True)
+        if "d" in query:
+            try:
+                _, pem = corpus.entries[int(query["d"][0])]
+            except (KeyError, ValueError):
+                self.send_error(404)
+                return
+            self.reply(pem.encode(), "application/x-pem-file")
+        elif "Identity" in query:
+            records = corpus.search(query["Identity"][0], "exclude" in query)
+            self.reply(json.dumps(records).encode(), "application/json")
+        else:
+            self.send_error(400)
+
+    def reply(self, body, content_type):
+        """Send a successful response."""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Don't log each request, it would dominate a benchmark."""
+
+
+class CrtshServer(ThreadingMixIn, HTTPServer):
+    """A threaded HTTP server for a corpus."""
+
+    daemon_threads = True
+
+    def __init__(self, corpus, port=0, host="127.0.0.1"):
+        """Listen on localhost, on any free port by default."""
+        super(CrtshServer, self).__init__((host, port), CrtshHandler)
+        self.corpus = corpus
+
+    @property
+    def url(self):
+        """The base URL to use for admiral_crtsh_url."""
+        host, port = self.server_address[:2]
+        if host == "0.0.0.0":
+            host = socket.gethostname()
+        return f"http://{host}:{port}/"
+
+
+def start_server(corpus, port=0):
+    """Serve a corpus on localhost in a background thread.
+
+    Returns the server, call shutdown() to stop it.
+    """
+    server = CrtshServer(corpus, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    """Start of program."""
+    from docopt import docopt
+
+    args = docopt(__doc__)
+    corpus = Corpus(int(args["--domains"]), int(args["--certs"]), int(args["--seed"]))
+    server = CrtshServer(corpus, int(args["--port"]), args["--host"])
+    print(f"Serving {corpus.size} log entries for {', '.join(corpus.domains)}")
+    print(f"admiral_crtsh_url: {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""import-time: Measure the cold import time of admiral modules.
+
+Each module is imported in a fresh interpreter several times, and the median
+wall clock import time is reported along with any heavy dependencies that
+the import pulled in.  Workers restart often, so this should stay small.
+
+Usage:
+  import-time [options] [<module>...]
+  import-time (-h | --help)
+
+Options:
+  -n --runs=<count>        Number of imports to time per module [default: 5]
+  -t --top=<count>         Also list the slowest imports of each module
+                           as reported by python -X importtime [default: 0]
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = [
+    "admiral.celery",
+    "admiral.certs.tasks",
+    "admiral.port_scan.tasks",
+    "admiral.tester.tasks",
+    "admiral.model",
+    "admiral.util",
+]
+
+# dependencies that should only be loaded by the processes that use them
+HEAVY_MODULES = ["cryptography", "mongoengine", "pymongo", "xmljson", "requests"]
+
+TIMER = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"elapsed": elapsed, "heavy": heavy}}))
+"""
+
+
+def time_import(module):
+    """Import a module in a new interpreter.
+
+    Returns (seconds, heavy):
+        seconds: the time taken to import the module
+        heavy: a list of heavy dependencies that were loaded
+    """
+    completed = subprocess.run(
+        [sys.executable, "-c", TIMER.format(module=module, heavy=HEAVY_MODULES)],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    result = json.loads(completed.stdout.decode().splitlines()[-1])
+    return result["elapsed"], result["heavy"]
+
+
+def slowest_imports(module, count):
+    """List the slowest imports, including their children, of a module."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    timings = []
+    for line in completed.stderr.decode().splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        timings.append((int(cumulative), name.strip()))
+    return sorted(timings, reverse=True)[:count]
+
+
+def main():
+    """Start of program."""
+    from docopt import docopt
+
+    args = docopt(__doc__)
+    runs = int(args["--runs"])
+    top = int(args["--top"])
+
+    print(f"{'module':30} {'median':>9} {'min':>9}  heavy dependencies")
+    for module in args["<module>"] or DEFAULT_MODULES:
+        samples = []
+        for _ in range(runs):
+            elapsed, heavy = time_import(module)
+            samples.append(elapsed)
+        print(
+            f"{module:30} {statistics.median(samples) * 1000:>7.1f}ms "
+            f"{min(samples) * 1000:>7.1f}ms  {', '.join(heavy) or '-'}"
+        )
+        for cumulative, name in slowest_imports(module, top):
+            print(f"    {cumulative / 1000:>7.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
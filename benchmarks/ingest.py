@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""ingest: Measure certificate ingest throughput against a local crt.sh.
+
+A synthetic corpus is served by a local crt.sh stand-in (see crtsh.py) and
+loaded with load_certs from examples/load_certs.py, running the tasks
+eagerly.  Each corpus size is loaded in a new process, and the throughput,
+the peak memory of that process, and the serialized size of the task
+results (the bytes that would pass through the Redis result backend) are
+reported.
+
+Usage:
+  ingest [options]
+  ingest (-h | --help)
+
+Options:
+  -s --sizes=<list>        Comma separated numbers of certificates per
+                           domain to benchmark [default: 10,50,200]
+  -d --domains=<count>     Number of domains in each corpus [default: 5]
+  -m --mongo=<uri>         Mongo database to load into; it is emptied
+                           first [default: mongomock://localhost/benchmark]
+"""
+
+from contextlib import redirect_stderr, redirect_stdout
+import importlib.util
+import multiprocessing
+import os
+import resource
+import time
+
+from celery import Celery, signals
+from kombu.utils.json import dumps
+from mongoengine import connect, context_managers
+
+from crtsh import Corpus, start_server
+
+LOAD_CERTS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "examples", "load_certs.py"
+)
+
+
+def import_load_certs():
+    """Import the load_certs example as a module."""
+    spec = importlib.util.spec_from_file_location("load_certs", LOAD_CERTS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ResultBytes(object):
+    """Total the serialized size of task results."""
+
+    def __init__(self):
+        """Start counting results."""
+        self.total = 0
+        signals.task_postrun.connect(self.count, weak=False)
+
+    def count(self, retval=None, **kwargs):
+        """Add the size of a task result."""
+        self.total += len(dumps(retval))
+
+
+def empty_database():
+    """Drop the collections that load_certs writes to."""
+    from admiral.model import Cert, CertAggregate, Domain
+
+    Cert.drop_collection()
+    with context_managers.switch_collection(Cert, "precerts"):
+        Cert.drop_collection()
+    Domain.drop_collection()
+    CertAggregate.drop_collection()
+
+
+def peak_rss():
+    """Return the peak resident set size of this process (MiB)."""
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark(load_certs, result_bytes, domains, certs):
+    """Load a new corpus and measure it.
+
+    Returns a dict of measurements.
+    """
+    from admiral.model import Domain
+
+    corpus = Corpus(domains, certs)
+    server = start_server(corpus)
+    app = Celery("admiral-benchmark", set_as_current=True)
+    app.conf.update(
+        task_always_eager=True,
+        task_eager_propagates=True,
+        admiral_crtsh_url=server.url,
+    )
+    try:
+        empty_database()
+        for domain in corpus.domains:
+            Domain(domain=domain).save()
+        result_bytes.total = 0
+        start = time.perf_counter()
+        # load_certs reports each domain and shows progress bars (on
+        # stderr), that would hide our table
+        with open(os.devnull, "w") as devnull:
+            with redirect_stdout(devnull), redirect_stderr(devnull):
+                loaded = load_certs.load_certs(Domain.objects)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {
+        "entries": corpus.size,
+        "loaded": loaded,
+        "elapsed": elapsed,
+        "rate": loaded / elapsed,
+        "rss": peak_rss(),
+        "result_bytes": result_bytes.total,
+    }
+
+
+def run_benchmark(mongo, domains, certs):
+    """Connect to the database and benchmark one corpus size.
+
+    This runs in a new process for each size, as the peak resident set size
+    of a process never goes down.
+    """
+    connect(host=mongo)
+    return benchmark(import_load_certs(), ResultBytes(), domains, certs)
+
+
+def main():
+    """Start of program."""
+    from docopt import docopt
+
+    args = docopt(__doc__)
+    sizes = [int(size) for size in args["--sizes"].split(",")]
+    domains = int(args["--domains"])
+
+    print(
+        f"{'entries':>8} {'loaded':>8} {'seconds':>8} {'certs/s':>8} "
+        f"{'peak RSS':>10} {'result bytes':>13}"
+    )
+    context = multiprocessing.get_context("fork")
+    for certs in sizes:
+        with context.Pool(1) as pool:
+            m = pool.apply(run_benchmark, (args["--mongo"], domains, certs))
+        print(
+            f"{m['entries']:>8} {m['loaded']:>8} {m['elapsed']:>8.2f} "
+            f"{m['rate']:>8.1f} {m['rss']:>7.1f}MiB {m['result_bytes']:>13}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""cert-summary: Summarize the certificates of domains and agencies.
+
+Summaries are read from the certificate aggregates, which load-certs keeps
+up to date as it imports certificates.  Use rebuild to recompute them from
+the certs and precerts collections, after importing certificates some
+other way.
+
+Usage:
+  cert-summary [options] domain <domain>...
+  cert-summary [options] agency <agency>...
+  cert-summary rebuild
+  cert-summary (-h | --help)
+  cert-summary --version
+
+Options:
+  -d --days=<days>         Count certificates expiring this many days from
+                           now as expiring soon [default: 30]
+"""
+
+from datetime import timedelta
+import pprint
+
+from admiral.model import CertAggregate
+from admiral.util import connect_from_config
+
+# Globals
+PP = pprint.PrettyPrinter(indent=4)
+
+
+def main():
+    """Start of program."""
+    from docopt import docopt
+
+    args = docopt(__doc__, version="v0.0.1")
+
+    # create database connection
+    connect_from_config()
+
+    if args["rebuild"]:
+        print("Rebuilding certificate aggregates")
+        counted = CertAggregate.rebuild()
+        print(f"{counted} certificates were counted.")
+        return
+
+    soon = timedelta(days=int(args["--days"]))
+    if args["domain"]:
+        aggregates = [(d, CertAggregate.for_domain(d)) for d in args["<domain>"]]
+    else:
+        aggregates = [(a, CertAggregate.for_agency(a)) for a in args["<agency>"]]
+    for key, aggregate in aggregates:
+        if aggregate is None:
+            print(f"{key}: no certificates")
+        else:
+            print(f"{key}:")
+            PP.pprint(aggregate.summary(soon=soon))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,38 +3,140 @@
 
 Be careful, this can easily give you a bad day.
 
+Copies collections between the databases of two connections in the
+configuration, all collections at once.  Documents are streamed as raw
+BSON in _id order and written in large unordered batches, without being
+decoded.  An interrupted copy resumes from the last _id in the destination.
+Indexes other than _id are dropped from the destination while copying and
+rebuilt from the source's index definitions afterwards.
+
 Usage:
-  doc-copy <from_connection> <to_connection>
+  doc-copy [options] <from_connection> <to_connection> [<collection>...]
   doc-copy --list-connections
   doc-copy (-h | --help)
   doc-copy --version
 
  Options:
     -l --list-connections   List the available connections.
+    -b --batch-size=<count> Documents read and written at a time
+                            [default: 5000]
 """
+
+from concurrent.futures import ThreadPoolExecutor
 import sys
 
-from admiral.util import load_config, connect_from_config
+from admiral.util import load_config
 
-from mongoengine import context_managers
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from bson.raw_bson import RawBSONDocument
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 from tqdm import tqdm
 
-from models import Domain
-
-
-def copy_all(model, from_alias, to_alias):
-    print(f"Querying all {model} from {from_alias}")
-    with context_managers.switch_db(model, from_alias) as model:
-        all = model.objects.all()
-        print(f"Saving all {model} into {to_alias}")
-        for x in tqdm(all, total=all.count(), desc="Copy", unit="docs"):
-            with context_managers.switch_db(model, to_alias) as model:
-                # MongoEngine tracks changes, we need to force the save
-                # or we'll get nothing.
-                x.save(force_insert=True)
+DEFAULT_COLLECTIONS = ["certs", "precerts", "domains"]
+DUPLICATE_KEY_ERROR = 11000
+
+
+def insert_batch(collection, batch):
+    """Insert a batch of documents, ignoring ones that already exist."""
+    try:
+        collection.insert_many(batch, ordered=False, bypass_document_validation=True)
+    except BulkWriteError as e:
+        errors = e.details["writeErrors"]
+        if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+
+
+def resume_point(source, destination, batch_size):
+    """Find the _id to resume copying from.
+
+    Batches are copied in _id order, one at a time, so only the last batch
+    can be incomplete.  Copying resumes at the start of that batch.
+
+    Returns an _id, or None to copy from the beginning.
+    """
+    last = destination.find_one(sort=[("_id", -1)], projection=["_id"])
+    if last is None:
+        return None
+    window = list(
+        source.find(
+            {"_id": {"$lte": last["_id"]}},
+            sort=[("_id", -1)],
+            projection=["_id"],
+            limit=batch_size,
+        )
+    )
+    return window[-1]["_id"] if window else None
+
+
+def copy_indexes(source, destination):
+    """Create the source's indexes on the destination."""
+    # decode the index definitions, unlike the documents
+    source = source.with_options(codec_options=DEFAULT_CODEC_OPTIONS)
+    for name, info in source.index_information().items():
+        if name == "_id_":
+            continue
+        keys = info.pop("key")
+        for option in ("v", "ns"):
+            info.pop(option, None)
+        destination.create_index(keys, name=name, **info)
+
+
+def copy_collection(name, from_db, to_db, batch_size, position=0):
+    """Copy a collection, resuming if it was partially copied.
+
+    Returns the number of documents written.
+    """
+    source = from_db[name]
+    destination = to_db[name]
+    start = resume_point(source, destination, batch_size)
+    if start is None:
+        query = {}
+        done = 0
+        # indexes other than _id slow down inserts, they are rebuilt below
+        destination.drop_indexes()
+    else:
+        query = {"_id": {"$gte": start}}
+        done = destination.count_documents({"_id": {"$lt": start}})
+
+    copied = 0
+    with tqdm(
+        total=source.estimated_document_count(),
+        initial=done,
+        desc=f"{name:>10}",
+        unit="docs",
+        position=position,
+    ) as pbar:
+        with source.find(
+            query, sort=[("_id", 1)], batch_size=batch_size, no_cursor_timeout=True
+        ) as cursor:
+            batch = []
+            for document in cursor:
+                batch.append(document)
+                if len(batch) == batch_size:
+                    insert_batch(destination, batch)
+                    copied += len(batch)
+                    pbar.update(len(batch))
+                    batch = []
+            if batch:
+                insert_batch(destination, batch)
+                copied += len(batch)
+                pbar.update(len(batch))
+
+    copy_indexes(source, destination)
+    return copied
+
+
+def connect(alias, config):
+    """Return the default database of a connection in the configuration."""
+    uri = config["connections"][alias]["uri"]
+    # documents are copied without being decoded
+    client = MongoClient(uri, document_class=RawBSONDocument)
+    return client.get_default_database()
 
 
 def print_connections():
+    """Print the names of the connections in the configuration."""
     config = load_config()
     print("Connections in configuration: ")
     for i in list(config["connections"].keys()):
@@ -42,29 +144,31 @@ def print_connections():
 
 
 def main():
+    """Start of program."""
     from docopt import docopt
 
-    args = docopt(__doc__, version="v0.0.1")
+    args = docopt(__doc__, version="v0.0.2")
 
     if args["--list-connections"]:
         print_connections()
         sys.exit(0)
 
-    from_alias = args["<from_connection>"]
-    to_alias = args["<to_connection>"]
-
-    # connect to databases
-    connect_from_config()
-
-    # # Copy all documents from certs collection
-    # copy_all(Cert, from_alias, to_alias)
-    #
-    # # Copy all documents from precerts collection
-    # with context_managers.switch_collection(Cert, "precerts"):
-    #     copy_all(Cert, from_alias, to_alias)
-    #
-
-    copy_all(Domain, from_alias, to_alias)
+    config = load_config()
+    from_db = connect(args["<from_connection>"], config)
+    to_db = connect(args["<to_connection>"], config)
+    collections = args["<collection>"] or DEFAULT_COLLECTIONS
+    batch_size = int(args["--batch-size"])
+
+    with ThreadPoolExecutor(max_workers=len(collections)) as executor:
+        futures = {
+            name: executor.submit(
+                copy_collection, name, from_db, to_db, batch_size, position
+            )
+            for position, name in enumerate(collections)
+        }
+    print("\n" * len(collections))
+    for name, future in futures.items():
+        print(f"{future.result()} documents copied to {name}")
 
 
 if __name__ == "__main__":
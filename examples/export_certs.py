@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""export-certs: Export certificates to files for offline analysis.
+
+Certificates are streamed from the database in log_id order into files of
+--chunk-size certificates each, named for the log ids they hold.  PEMs are
+left out unless --pem is given.  Use --resume to export only certificates
+with a log id after the last one exported to the same directory.  This
+misses certificates loaded since then with lower log ids, which --since can
+catch.
+
+The parquet and arrow formats require pyarrow:
+  pip install admiral[export]
+
+Usage:
+  export-certs [options] <directory> [<collection>...]
+  export-certs (-h | --help)
+  export-certs --version
+
+Options:
+  -f --format=<format>     Output format: parquet, arrow, or ndjson
+                           [default: parquet]
+  -n --chunk-size=<count>  Certificates in each file [default: 100000]
+  -i --since-id=<log_id>   Only export certificates after this log id
+  -t --since=<date>        Only export certificates logged since this date
+  -r --resume              Continue from the last log id in <directory>
+  -p --pem                 Include the PEM of each certificate
+"""
+
+import sys
+
+import dateutil.parser as parser
+
+from admiral.export import (
+    COLLECTIONS,
+    FIELDS,
+    PEM_FIELD,
+    WRITERS,
+    export_collection,
+    last_exported,
+)
+from admiral.util import connect_from_config
+
+
+def main():
+    """Start of program."""
+    from docopt import docopt
+
+    args = docopt(__doc__, version="v0.0.1")
+
+    if args["--format"] not in WRITERS:
+        print(f"Unknown format: {args['--format']}", file=sys.stderr)
+        sys.exit(1)
+    fields = FIELDS + (PEM_FIELD,) if args["--pem"] else FIELDS
+    writer = WRITERS[args["--format"]](fields)
+    since = parser.parse(args["--since"]) if args["--since"] else None
+    directory = args["<directory>"]
+
+    # create database connection
+    connect_from_config()
+
+    for collection in args["<collection>"] or COLLECTIONS:
+        since_id = args["--since-id"] and int(args["--since-id"])
+        if args["--resume"]:
+            since_id = last_exported(directory, collection) or since_id
+        paths = export_collection(
+            collection,
+            directory,
+            writer,
+            since_id=since_id,
+            since=since,
+            chunk_size=int(args["--chunk-size"]),
+        )
+        print(f"{collection}: {len(paths)} files written")
+        if paths:
+            print(f"{collection}: last file {paths[-1]}")
+
+
+if __name__ == "__main__":
+    main()
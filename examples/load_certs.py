@@ -24,7 +24,7 @@ import dateutil.parser as parser
 from mongoengine import context_managers
 from tqdm import tqdm
 
-from admiral.model import Cert, Domain
+from admiral.model import Cert, CertAggregate, Domain
 from admiral.util import connect_from_config
 
 # Globals
@@ -118,6 +118,7 @@ def group_update_domain(domain, max_expired_date, verbose=False):
     tasks_to_results = zip(job.tasks, results.join())
 
     # create x509 certificates from the results
+    saved = []
     for task, pem in tasks_to_results:
         cert, is_precert = Cert.from_pem(pem)
         cert.log_id = task.get("args")[0]  # get log_id from task
@@ -128,6 +129,13 @@ def group_update_domain(domain, max_expired_date, verbose=False):
         else:
             # this is not a precert, save to the cert collection
             cert.save()
+        saved.append((cert, is_precert))
+
+    # count the new certificates in the domain and agency aggregates
+    agencies = {}
+    if domain.agency is not None and domain.agency.id:
+        agencies[domain.domain] = domain.agency.id
+    CertAggregate.add_certs(saved, agencies)
     return len(job.tasks)
 
 
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""scan-hosts: A tool to discover and port scan networks.
+
+This tool will discover live hosts, port scan them via celery tasks, and
+store the changes since the previous scan in a mongo database.
+
+Usage:
+  scan-hosts [options] <target>...
+  scan-hosts (-h | --help)
+  scan-hosts --version
+
+Options:
+  -s --shards=<count>      Port range shards per host [default: 8]
+  -v --verbose             Print more detailed output
+"""
+
+import pprint
+
+from admiral.celery import configure_app
+from admiral.model import Host, ScanRun
+from admiral.port_scan.tasks import scan_live_hosts, up_scan_group
+from admiral.util import connect_from_config
+
+# Globals
+PP = pprint.PrettyPrinter(indent=4)
+
+
+def scan_hosts(targets, shards, verbose=False):
+    """Discover and port scan targets, and store the results.
+
+    Hosts we have seen before are scanned using what we learned about them.
+    Discovery and the port scan are stored as separate scan runs, so hosts
+    learn how they answer discovery as well as which ports are open.
+
+    Returns the discovery and port scan ScanRuns.
+    """
+    profiles = Host.profiles_for(targets)
+    discovery_run = ScanRun(kind="discovery", targets=targets)
+    discovery_run.save()
+    discovered = up_scan_group(targets, profiles=profiles).apply_async().get()
+    live = {address: host for hosts in discovered for address, host in hosts.items()}
+    # known hosts that were not found by discovery are down
+    down = [address for address in profiles if address not in live]
+    changes = discovery_run.save_results(live.values(), down=down)
+
+    port_run = ScanRun(kind="port", targets=targets)
+    port_run.save()
+    # only the live hosts are port scanned, the rest would bloat the message
+    live_profiles = {
+        address: profiles[address] for address in live if profiles.get(address)
+    }
+    workflow = scan_live_hosts.s(discovered, shards=shards, profiles=live_profiles)
+    records = workflow.apply_async().get()
+    changes.extend(port_run.save_results(records))
+    if verbose:
+        for change in changes:
+            PP.pprint(change.to_mongo().to_dict())
+    return discovery_run, port_run
+
+
+def main():
+    """Start of program."""
+    from docopt import docopt
+
+    args = docopt(__doc__, version="v0.0.1")
+
+    # create database connection
+    connect_from_config()
+
+    # configure celery
+    configure_app()
+
+    discovery_run, port_run = scan_hosts(
+        args["<target>"], int(args["--shards"]), args["--verbose"]
+    )
+    print(
+        f"{discovery_run.host_count} hosts up, {port_run.host_count} hosts scanned, "
+        f"{discovery_run.change_count + port_run.change_count} changes recorded."
+    )
+
+
+if __name__ == "__main__":
+    main()
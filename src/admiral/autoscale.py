@@ -0,0 +1,194 @@
+"""Worker pool autoscaling driven by queue depth and queue wait time.
+
+Celery's default autoscaler sizes the pool by the number of tasks the
+worker has already reserved, which is limited by the prefetch count.  It
+cannot see work piling up in the broker, so a worker with a low prefetch
+count (as used for long tasks) never grows.  This autoscaler also looks at
+the number of messages waiting in the worker's queues, and at how long
+recently received tasks waited before being received.
+
+Enable it in a worker's celery configuration:
+
+    worker_autoscaler: admiral.autoscale:QueueAutoscaler
+    admiral_autoscale: [16, 2]        # maximum and minimum pool size
+    admiral_autoscale_target_wait: 30  # acceptable queue wait (seconds)
+
+A worker that limits concurrent scans with admiral_scan_slots never grows
+past the number of slots, as extra processes would only wait for a slot.
+
+Queue depth is read from the broker on a background thread, so the
+worker's event loop never waits for the broker.
+"""
+
+import math
+import threading
+import time
+
+from celery.utils.log import get_logger
+from celery.worker.autoscale import Autoscaler
+from kombu.exceptions import ChannelError
+
+from .metrics import SENT_HEADER
+
+logger = get_logger(__name__)
+
+# default queue wait (seconds) above which the pool is grown
+DEFAULT_TARGET_WAIT = 30
+# the most the pool may be multiplied by in one scaling decision
+MAX_GROWTH = 2
+# seconds between queue depth reads
+DEPTH_INTERVAL = 5
+# weight of the newest observation in the queue wait moving average
+WAIT_SMOOTHING = 0.2
+
+
+def desired_concurrency(
+    queued,
+    reserved,
+    wait,
+    processes,
+    min_concurrency,
+    max_concurrency,
+    target_wait=DEFAULT_TARGET_WAIT,
+):
+    """Determine the pool size needed for the observed demand.
+
+    Arguments:
+    queued -- the number of messages waiting in the worker's queues
+    reserved -- the number of tasks received by the worker but not finished
+    wait -- the recent queue wait time of tasks (seconds)
+    processes -- the current pool size
+    min_concurrency -- the smallest allowed pool size
+    max_concurrency -- the largest allowed pool size
+    target_wait -- the queue wait time above which the pool is grown
+
+    With nothing queued this is Celery's policy: one process per reserved
+    task.  With messages queued the pool is never shrunk, and is grown in
+    proportion to how far the wait is above target.
+    """
+    desired = reserved
+    if queued:
+        desired = max(desired, processes, 1)
+        if wait > target_wait:
+            growth = min(wait / target_wait, MAX_GROWTH)
+            desired = max(desired, processes + 1, math.ceil(processes * growth))
+    return max(min_concurrency, min(max_concurrency, desired))
+
+
+class DepthMonitor(threading.Thread):
+    """A thread that periodically reads an autoscaler's queue depth."""
+
+    def __init__(self, autoscaler, interval=DEPTH_INTERVAL):
+        """Create a monitor updating autoscaler every interval seconds."""
+        super(DepthMonitor, self).__init__(name="admiral-autoscale", daemon=True)
+        self.autoscaler = autoscaler
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        """Update the queue depth until stopped."""
+        while True:
+            self.autoscaler.update_queued()
+            if self.stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        """Stop the thread."""
+        self.stopped.set()
+
+
+class QueueAutoscaler(Autoscaler):
+    """Autoscaler that grows the pool when work waits in the broker."""
+
+    def __init__(self, *args, **kwargs):
+        """Create an autoscaler, reading its settings from the app."""
+        super(QueueAutoscaler, self).__init__(*args, **kwargs)
+        self.target_wait = self.app.conf.get(
+            "admiral_autoscale_target_wait", DEFAULT_TARGET_WAIT
+        )
+        slots = self.app.conf.get("admiral_scan_slots")
+        if slots and self.max_concurrency > slots:
+            logger.warning(
+                f"Autoscaler maximum {self.max_concurrency} limited to "
+                f"{slots} scan slots"
+            )
+            self.max_concurrency = slots
+            self.min_concurrency = min(self.min_concurrency, slots)
+        self.wait = 0.0
+        self._queued = 0
+        self._monitor = None
+        self._connection = None
+
+    @property
+    def app(self):
+        """The worker's app."""
+        return self.worker.app
+
+    def maybe_scale(self, req=None):
+        """Note the queue wait of a received task, then scale the pool."""
+        sent = req.request_dict.get(SENT_HEADER) if req is not None else None
+        if sent is not None and not req.eta:
+            wait = max(0.0, time.time() - sent)
+            self.wait += WAIT_SMOOTHING * (wait - self.wait)
+        super(QueueAutoscaler, self).maybe_scale(req)
+
+    @property
+    def queued(self):
+        """The number of messages waiting in the worker's queues.
+
+        This is the depth last read by the DepthMonitor, which is started
+        the first time it is needed.
+        """
+        if self._monitor is None:
+            self._monitor = DepthMonitor(self)
+            self._monitor.start()
+        return self._queued
+
+    def update_queued(self):
+        """Read the queue depth from the broker."""
+        self._queued = self.queue_depth()
+        if not self._queued:
+            # nothing is waiting, so no task will report a long wait
+            self.wait = 0.0
+
+    def queue_depth(self):
+        """Ask the broker how many messages are waiting in our queues."""
+        try:
+            if self._connection is None:
+                self._connection = self.app.connection_for_read()
+            channel = self._connection.default_channel
+            depth = 0
+            for name in self.app.amqp.queues.consume_from:
+                try:
+                    depth += channel.queue_declare(
+                        queue=name, passive=True
+                    ).message_count
+                except ChannelError:
+                    # an empty redis queue does not exist
+                    pass
+            return depth
+        except Exception as exc:
+            logger.warning(f"Autoscaler could not read queue depth: {exc!r}")
+            if self._connection is not None:
+                self._connection.release()
+                self._connection = None
+            return 0
+
+    @property
+    def qty(self):
+        """The pool size needed for the observed demand."""
+        return desired_concurrency(
+            self.queued,
+            super(QueueAutoscaler, self).qty,
+            self.wait,
+            self.processes,
+            self.min_concurrency,
+            self.max_concurrency,
+            self.target_wait,
+        )
+
+    def info(self):
+        """Return autoscaler info, including the observed demand."""
+        info = super(QueueAutoscaler, self).info()
+        info.update(queued=self._queued, wait=round(self.wait, 3))
+        return info
@@ -14,10 +14,11 @@ Options:
   -i --interactive               Create app and enter IPython
 """
 
+from collections.abc import Mapping
+from functools import lru_cache
 import os
 
-from celery import Celery
-import yaml
+from celery import Celery, signals
 
 CONFIG_FILE_ENV_KEY = "ADMIRAL_CONFIG_FILE"
 CONFIG_SECTION_ENV_KEY = "ADMIRAL_CONFIG_SECTION"
@@ -36,8 +37,43 @@ class CustomCelery(Celery):
         return super(CustomCelery, self).gen_task_name(name, module)
 
 
+class LazyConfig(Mapping):
+    """A read-only mapping that is loaded the first time it is used.
+
+    Celery only reads its configuration source when the configuration is
+    first needed, so wrapping the source in a LazyConfig defers reading and
+    parsing the configuration file until then.
+    """
+
+    def __init__(self, load):
+        """Create a mapping whose contents are returned by load()."""
+        self._load = load
+        self._data = None
+
+    @property
+    def data(self):
+        """The loaded mapping."""
+        if self._data is None:
+            self._data = self._load()
+        return self._data
+
+    def __getitem__(self, key):
+        """Get an item from the loaded mapping."""
+        return self.data[key]
+
+    def __iter__(self):
+        """Iterate over the loaded mapping."""
+        return iter(self.data)
+
+    def __len__(self):
+        """Return the length of the loaded mapping."""
+        return len(self.data)
+
+
 def load_config(filename):
     """Load a configuration from a file."""
+    import yaml
+
     print("Reading configuration from %s" % filename)
     with open(filename, "r") as stream:
         config = yaml.load(stream, Loader=yaml.FullLoader)
@@ -70,14 +106,11 @@ def determine_input(description, cli_arg, env_key, default):
     return default
 
 
-def configure_app(config_file=None, config_sction=None):
-    """Create, configure, and return the Celery app.
+@lru_cache(maxsize=None)
+def get_active_config(config_file=None, config_section=None):
+    """Load and return the configuration section for this process.
 
-    We want to handle running as a stand-alone application and also being
-    invoked from the celery command.  If the called_via_celery_cmd is set to
-    True then we just read our configs, setup the app, and return the app
-    instance so it can be pointed to by the `celery` attribute.  This is what
-    celery expects.  Otherwise, we do our own magic.
+    The configuration file is only read once per file and section.
     """
     # get a configration filename
     yml_filename = determine_input(
@@ -89,32 +122,69 @@ def configure_app(config_file=None, config_sction=None):
 
     # get the name of a configuration section for this worker
     config_section = determine_input(
-        "Config section", config_sction, CONFIG_SECTION_ENV_KEY, DEFAULT_CONFIG_SECTION
+        "Config section", config_section, CONFIG_SECTION_ENV_KEY, DEFAULT_CONFIG_SECTION
     )
 
     # get the configuration for this worker
-    active_config = entire_config[config_section]
+    return entire_config[config_section]
+
+
+@lru_cache(maxsize=None)
+def create_app(config_file=None, config_section=None):
+    """Create and return the Celery app, without making it the current app.
+
+    Creating the app is cheap: the configuration file is not read until the
+    app's configuration is first used, and the task modules listed for
+    auto-discovery are only imported when a worker starts (or the app is
+    otherwise finalized).  Apps are cached, so calling this again with the
+    same arguments returns the same app.
+    """
+
+    def active_config():
+        """Load the configuration for this app."""
+        return get_active_config(config_file, config_section)
+
+    def autodiscover_packages():
+        """List the packages to search for tasks."""
+        packages = active_config().get("autodiscover_tasks", [])
+        print("Auto discovering tasks from", packages)
+        return packages
 
-    # create the app instance
-    app = CustomCelery("admiral")
+    # create the app instance; a worker makes it current when it starts, so
+    # importing this module doesn't change the app of the importing process
+    app = CustomCelery("admiral", set_as_current=False)
 
     # apply the configuration
     # See: http://docs.celeryproject.org/en/latest/userguide/configuration.html
-    celery_config = active_config.get("celery", {})
-    app.conf.update(celery_config)
+    app.config_from_object(LazyConfig(lambda: active_config().get("celery", {})))
 
+    # register any tasks that are listed for auto-discovery in the config
+    app.autodiscover_tasks(autodiscover_packages)
+
+    return app
+
+
+def configure_app(config_file=None, config_section=None):
+    """Create, configure, and return the Celery app as the current app.
+
+    We want to handle running as a stand-alone application and also being
+    invoked from the celery command.  Stand-alone programs call this, so
+    that the shared tasks they use are sent with this app.  See create_app.
+    """
+    app = create_app(config_file, config_section)
+    app.set_current()
+    return app
+
+
+@signals.worker_init.connect
+def print_config(sender=None, **kwargs):
+    """Print the worker's configuration when it starts."""
+    app = sender.app
     # print out the changes applied to the default celery config
     print("-" * 40)
     print(app.conf.humanize())
     print("-" * 40)
 
-    # register any tasks that are listed for auto-discovery in the config
-    autodiscover_tasks = active_config.get("autodiscover_tasks", [])
-    print("Auto discovering tasks from", autodiscover_tasks)
-    app.autodiscover_tasks(autodiscover_tasks)
-
-    return app
-
 
 def main():
     """Start of program when invoked as a stand-alone."""
@@ -128,24 +198,18 @@ def main():
         celery.start(argv=["celery", "-A", "admiral", "shell"])
     else:
         worker_name = os.environ.get(WORKER_NAME_ENV_KEY, "unnamed")
-        celery.start(
-            argv=[
-                "celery",
-                "-A",
-                "admiral",
-                "worker",
-                "-l",
-                "info",
-                "-n",
-                f"{worker_name}@%h",
-            ]
-        )
+        argv = ["celery", "-A", "admiral", "worker", "-l", "info"]
+        argv += ["-n", f"{worker_name}@%h"]
+        # autoscaling can only be enabled on the command line
+        autoscale = celery.conf.get("admiral_autoscale")
+        if autoscale:
+            argv.append("--autoscale=%d,%d" % tuple(autoscale))
+        celery.start(argv=argv)
+
 
+# the celery command line looks for the app in this attribute
+celery = create_app()
 
 if __name__ == "__main__":
     # running as a stand-alone application
     main()
-else:  # __name__ == 'admiral.celery':
-    # this module was loaded via the celery command line
-    # setup the app and return it in the attribute below
-    celery = configure_app()
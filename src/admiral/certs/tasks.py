@@ -3,12 +3,19 @@
 import requests
 import json
 import re
+import time
 
-from celery import shared_task
+from celery import current_app, shared_task
 from celery.utils.log import get_task_logger
 
+from .. import metrics
+from ..idempotent import IdempotentTask
+
 logger = get_task_logger(__name__)
 
+# the CT log search service, can be changed with admiral_crtsh_url
+DEFAULT_CRTSH_URL = "https://crt.sh/"
+
 # regexr.com/3e8n2
 DOMAIN_NAME_RE = re.compile(
     r"^((?:([a-z0-9]\.|[a-z0-9][a-z0-9\-]{0,61}[a-z0-9])\.)+)"
@@ -16,7 +23,30 @@ DOMAIN_NAME_RE = re.compile(
 )
 
 
+def crtsh_url():
+    """Return the base URL of the CT log search service."""
+    return current_app.conf.get("admiral_crtsh_url", DEFAULT_CRTSH_URL)
+
+
+def fetch(url):
+    """Fetch a URL from the CT log, recording its timing and size.
+
+    The response body has been read when this returns.
+    """
+    start = time.perf_counter()
+    req = requests.get(url, headers={"User-Agent": "cyhy/2.0.0"}, stream=True)
+    # with stream=True, elapsed stops when the response headers are parsed
+    metrics.observe("admiral_http_ttfb_seconds", req.elapsed.total_seconds())
+    content = req.content
+    metrics.observe("admiral_http_request_seconds", time.perf_counter() - start)
+    status = str(req.status_code)
+    metrics.increment("admiral_http_requests_total", status=status)
+    metrics.increment("admiral_http_response_bytes_total", len(content), status=status)
+    return req
+
+
 @shared_task(
+    base=IdempotentTask,
     autoretry_for=(Exception, requests.HTTPError, requests.exceptions.HTTPError),
     retry_backoff=True,
     retry_jitter=True,
@@ -40,11 +70,11 @@ def summary_by_domain(domain, subdomains=True, expired=False):
 
     logger.info(f"Fetching certs from CT log for: {wildcard_param}{domain}")
     url = (
-        f"https://crt.sh/?Identity={wildcard_param}{domain}{expired_param}"
+        f"{crtsh_url()}?Identity={wildcard_param}{domain}{expired_param}"
         f"&output=json"
     )
 
-    req = requests.get(url, headers={"User-Agent": "cyhy/2.0.0"})
+    req = fetch(url)
 
     if req.ok:
         data = json.loads(req.content)
@@ -57,6 +87,7 @@ def summary_by_domain(domain, subdomains=True, expired=False):
 
 
 @shared_task(
+    base=IdempotentTask,
     autoretry_for=(Exception, requests.HTTPError, requests.exceptions.HTTPError),
     retry_backoff=True,
     retry_jitter=True,
@@ -66,8 +97,8 @@ def cert_by_id(id):
     """Fetch a certificate by log ID."""
     logger.info(f"Fetching cert data from CT log for id: {id}.")
 
-    url = f"https://crt.sh/?d={id}"
-    req = requests.get(url, headers={"User-Agent": "cyhy/2.0.0"})
+    url = f"{crtsh_url()}?d={id}"
+    req = fetch(url)
 
     if req.ok:
         return req.content.decode()
@@ -0,0 +1,254 @@
+"""Stream certificates to files for offline analysis.
+
+The certs and precerts collections are read with cursors that project away
+the PEMs (unless asked for) and are written to files of a fixed number of
+certificates.  Each file is written a batch of rows at a time (a Parquet row
+group or an Arrow record batch), so memory stays flat however large the
+collections and files are.
+Certificates are read in log_id order and each file is named for the range
+of log ids it holds:
+
+    certs-000001234567-000001334566.parquet
+
+so an export can be continued after the last file written, or from any
+log_id or logged time.  Continuing after the last file only writes
+certificates with greater log ids; a certificate loaded later with a lower
+log id (certificates are loaded domain by domain) is not written.
+
+Files can be written as:
+
+- parquet: compressed columnar files (requires pyarrow)
+- arrow: uncompressed Arrow IPC files, which can be memory-mapped
+  (requires pyarrow)
+- ndjson: gzipped newline delimited JSON, with dates in ISO 8601
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import gzip
+import itertools
+import json
+import os
+import re
+
+from .model import Cert
+
+COLLECTIONS = ("certs", "precerts")
+# columns of each file, in order; the document _id is exported as log_id
+FIELDS = (
+    "log_id",
+    "serial",
+    "issuer",
+    "not_before",
+    "not_after",
+    "sct_or_not_before",
+    "sct_exists",
+    "subjects",
+    "trimmed_subjects",
+)
+PEM_FIELD = "pem"
+# the number of certificates in each file
+DEFAULT_CHUNK_SIZE = 100000
+# the number of documents fetched from mongo at a time
+DEFAULT_BATCH_SIZE = 5000
+# the number of rows converted and written to a file at a time
+DEFAULT_WRITE_BATCH_SIZE = 10000
+FILENAME_FORMAT = "{collection}-{first:012d}-{last:012d}{extension}"
+FILENAME_RE = re.compile(r"^(?P<collection>\w+)-(?P<first>\d+)-(?P<last>\d+)\.")
+
+
+def query_for(since_id=None, since=None):
+    """Return the query for certificates after a log_id or logged time."""
+    query = {}
+    if since_id is not None:
+        query["_id"] = {"$gt": since_id}
+    if since is not None:
+        query["sct_or_not_before"] = {"$gte": since}
+    return query
+
+
+def iter_rows(collection, query=None, fields=FIELDS, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield the certificates of a collection as dicts, in log_id order.
+
+    Only fields are read from the database.
+    """
+    projection = {field: 1 for field in fields if field != "log_id"}
+    cursor = Cert._get_db()[collection].find(
+        query or {}, projection=projection, sort=[("_id", 1)], batch_size=batch_size
+    )
+    with cursor:
+        for document in cursor:
+            document["log_id"] = document.pop("_id")
+            yield {field: document.get(field) for field in fields}
+
+
+def chunked(rows, size):
+    """Yield lists of up to size rows."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class NDJSONWriter(object):
+    """Writes rows as gzipped newline delimited JSON."""
+
+    extension = ".ndjson.gz"
+
+    def __init__(self, fields=FIELDS):
+        """Create a writer of rows with fields."""
+        self.fields = fields
+
+    @contextmanager
+    def open(self, path):
+        """Open a file at path, yielding a function that writes rows to it."""
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+
+            def write(rows):
+                for row in rows:
+                    f.write(json.dumps(row, default=_json_default))
+                    f.write("\n")
+
+            yield write
+
+
+class ArrowWriter(object):
+    """Writes rows as an uncompressed Arrow IPC file."""
+
+    extension = ".arrow"
+
+    def __init__(self, fields=FIELDS):
+        """Create a writer of rows with fields."""
+        # imported here so that pyarrow is only needed for columnar exports
+        import pyarrow
+
+        self.pa = pyarrow
+        types = {
+            "log_id": pyarrow.int64(),
+            "not_before": pyarrow.timestamp("ms"),
+            "not_after": pyarrow.timestamp("ms"),
+            "sct_or_not_before": pyarrow.timestamp("ms"),
+            "sct_exists": pyarrow.bool_(),
+            "subjects": pyarrow.list_(pyarrow.string()),
+            "trimmed_subjects": pyarrow.list_(pyarrow.string()),
+        }
+        self.fields = fields
+        self.schema = pyarrow.schema(
+            [(field, types.get(field, pyarrow.string())) for field in fields]
+        )
+
+    def table(self, rows):
+        """Return an Arrow table of rows."""
+        columns = [
+            self.pa.array([row[field.name] for row in rows], type=field.type)
+            for field in self.schema
+        ]
+        return self.pa.Table.from_arrays(columns, schema=self.schema)
+
+    @contextmanager
+    def open(self, path):
+        """Open a file at path, yielding a function that writes rows to it.
+
+        Each call writes the rows as a record batch.
+        """
+        with self.pa.OSFile(path, "wb") as sink:
+            with self.pa.ipc.new_file(sink, self.schema) as writer:
+                yield lambda rows: writer.write_table(self.table(rows))
+
+
+class ParquetWriter(ArrowWriter):
+    """Writes rows as a compressed Parquet file."""
+
+    extension = ".parquet"
+    compression = "zstd"
+
+    @contextmanager
+    def open(self, path):
+        """Open a file at path, yielding a function that writes rows to it.
+
+        Each call writes the rows as a row group.
+        """
+        import pyarrow.parquet
+
+        writer = pyarrow.parquet.ParquetWriter(
+            path, self.schema, compression=self.compression
+        )
+        try:
+            yield lambda rows: writer.write_table(self.table(rows))
+        finally:
+            writer.close()
+
+
+WRITERS = {"parquet": ParquetWriter, "arrow": ArrowWriter, "ndjson": NDJSONWriter}
+
+
+def last_exported(directory, collection):
+    """Return the last log_id exported from a collection to directory, or None."""
+    if not os.path.isdir(directory):
+        return None
+    last = None
+    for name in os.listdir(directory):
+        if name.endswith(".tmp"):
+            continue
+        match = FILENAME_RE.match(name)
+        if match and match.group("collection") == collection:
+            last = max(last or 0, int(match.group("last")))
+    return last
+
+
+def export_collection(
+    collection,
+    directory,
+    writer,
+    since_id=None,
+    since=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    batch_size=DEFAULT_WRITE_BATCH_SIZE,
+):
+    """Export the certificates of a collection to files in directory.
+
+    Arguments:
+    collection -- the collection to export: certs or precerts
+    directory -- the directory to write files to
+    writer -- a writer from WRITERS, its fields are the fields exported
+    since_id -- only export certificates with a greater log_id
+    since -- only export certificates logged at or after this time
+    chunk_size -- the number of certificates in each file
+    batch_size -- the number of certificates written to a file at a time
+
+    Returns a list of the paths written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rows = iter_rows(collection, query_for(since_id, since), writer.fields)
+    paths = []
+    while True:
+        batches = chunked(itertools.islice(rows, chunk_size), batch_size)
+        batch = next(batches, None)
+        if batch is None:
+            return paths
+        first = batch[0]["log_id"]
+        # the name depends on the last log id, so it is given when complete;
+        # an interrupted write never leaves a file that looks complete
+        partial = os.path.join(
+            directory, f"{collection}-{first:012d}{writer.extension}.tmp"
+        )
+        with writer.open(partial) as write:
+            for batch in itertools.chain([batch], batches):
+                write(batch)
+                last = batch[-1]["log_id"]
+        name = FILENAME_FORMAT.format(
+            collection=collection, first=first, last=last, extension=writer.extension
+        )
+        path = os.path.join(directory, name)
+        os.replace(partial, path)
+        paths.append(path)
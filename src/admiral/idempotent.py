@@ -0,0 +1,168 @@
+"""A Celery task base class that avoids running the same work twice.
+
+Overlapping loaders, retries racing their original, and redelivered
+messages (task_acks_late with task_reject_on_worker_lost) can all cause a
+task to run more than once with the same arguments.  For rate limited CT
+log fetches and hours long scans that is wasted capacity.
+
+Tasks using IdempotentTask as their base are protected in two ways, both
+keyed on a hash of the task name and arguments and kept in the Redis
+result backend:
+
+- Submission: apply_async() records the task id of the first submission.
+  A duplicate submitted while the key lives gets the AsyncResult of the
+  first submission instead of a new task.  Submissions that are part of a
+  group, chord, or chain, or that have callbacks (link or link_error), are
+  not deduplicated, as the canvas needs its own ids and the callbacks would
+  never run.
+- Execution: a worker holds a lock while running the task.  A duplicate
+  that starts while the lock is held is sent again to run later, without
+  counting as a retry, and a duplicate that starts after an earlier run
+  succeeded returns that run's result.
+
+Arguments are bound to the task's signature before hashing, so delay(ip)
+and delay(ip, profile=None) are the same submission.
+
+    @shared_task(base=IdempotentTask, lock_ttl=600)
+    def cert_by_id(id):
+        ...
+"""
+
+from datetime import timedelta
+import hashlib
+import inspect
+import json
+
+from celery import Task, states
+from celery.exceptions import Ignore
+from celery.backends.redis import RedisBackend
+from celery.utils import uuid
+from celery.utils.log import get_task_logger
+
+logger = get_task_logger(__name__)
+
+SUBMIT_PREFIX = "admiral:submit:"
+LOCK_PREFIX = "admiral:lock:"
+
+
+class IdempotentTask(Task):
+    """A task that is not run again while a run with the same arguments is
+    pending, running, or recently succeeded."""
+
+    # seconds a submission is remembered, defaults to result_expires
+    idempotency_ttl = None
+    # seconds an execution lock is held at most, should exceed the runtime
+    lock_ttl = 600
+    # seconds to wait before running again a task whose lock is held
+    lock_retry_countdown = 30
+
+    _redis = None
+
+    @property
+    def redis(self):
+        """The Redis client of the result backend, or None."""
+        if self._redis is None and isinstance(self.app.backend, RedisBackend):
+            self._redis = self.app.backend.client
+        return self._redis
+
+    def idempotency_key(self, args=None, kwargs=None):
+        """Return a hash of the task name and arguments.
+
+        Arguments are bound to the task's signature, with defaults applied,
+        so the same call gets the same key however it is spelled.
+        """
+        args, kwargs = list(args or ()), kwargs or {}
+        try:
+            bound = inspect.signature(self.run).bind(*args, **kwargs)
+        except TypeError:
+            # the task will report the bad arguments when it runs
+            arguments = [args, kwargs]
+        else:
+            bound.apply_defaults()
+            arguments = bound.arguments
+        identity = json.dumps([self.name, arguments], sort_keys=True, default=str)
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def execution_lock_ttl(self):
+        """Return the seconds an execution lock is held at most."""
+        return self.lock_ttl
+
+    def submission_ttl(self):
+        """Return the seconds a submission is remembered."""
+        ttl = self.idempotency_ttl or self.app.conf.result_expires
+        if isinstance(ttl, timedelta):
+            ttl = ttl.total_seconds()
+        return int(ttl)
+
+    def apply_async(self, args=None, kwargs=None, task_id=None, **options):
+        """Submit the task, unless the same submission is already known.
+
+        Returns the AsyncResult of the new task, or of the earlier task if
+        this is a duplicate.
+        """
+        # the earlier task would not run the callbacks of this submission
+        canvas = any(
+            options.get(option)
+            for option in ("chord", "group_id", "chain", "link", "link_error")
+        )
+        # a task retrying itself is resubmitted with its own id
+        retrying = task_id is not None and task_id == self.request.id
+        if self.redis is None or self.app.conf.task_always_eager or canvas or retrying:
+            return super(IdempotentTask, self).apply_async(
+                args, kwargs, task_id, **options
+            )
+        key = SUBMIT_PREFIX + self.idempotency_key(args, kwargs)
+        task_id = task_id or uuid()
+        ttl = self.submission_ttl()
+        while not self.redis.set(key, task_id, nx=True, ex=ttl):
+            existing = self.redis.get(key)
+            if existing is None:
+                # expired since we tried to set it
+                continue
+            result = self.AsyncResult(existing.decode())
+            if result.state not in states.PROPAGATE_STATES:
+                logger.info(f"Attaching duplicate {self.name} to {result.id}")
+                return result
+            # the earlier run failed, so this submission replaces it
+            self.redis.set(key, task_id, ex=ttl)
+            break
+        return super(IdempotentTask, self).apply_async(args, kwargs, task_id, **options)
+
+    def run_later(self, args, kwargs):
+        """Send this task again with the same id, and stop this run.
+
+        Unlike retry() this leaves the retry count alone, as waiting for a
+        duplicate is not a failure, however long the duplicate runs.
+        """
+        logger.info(f"Duplicate {self.name} {self.request.id} is locked, waiting")
+        self.signature_from_request(
+            self.request, args, kwargs, countdown=self.lock_retry_countdown
+        ).apply_async()
+        raise Ignore()
+
+    def __call__(self, *args, **kwargs):
+        """Run the task while holding its execution lock."""
+        request = self.request
+        if self.redis is None or request.id is None or request.is_eager:
+            # not running in a worker, or there is nothing to lock with
+            return super(IdempotentTask, self).__call__(*args, **kwargs)
+        key = self.idempotency_key(args, kwargs)
+        lock = LOCK_PREFIX + key
+        if not self.redis.set(lock, request.id, nx=True, ex=self.execution_lock_ttl()):
+            holder = self.redis.get(lock)
+            # a redelivered message already holds the lock
+            if holder is None or holder.decode() != request.id:
+                self.run_later(args, kwargs)
+        try:
+            earlier = self.redis.get(SUBMIT_PREFIX + key)
+            if earlier is not None and earlier.decode() != request.id:
+                result = self.AsyncResult(earlier.decode())
+                if result.state == states.SUCCESS:
+                    logger.info(f"Returning result of duplicate {result.id}")
+                    return result.result
+            return super(IdempotentTask, self).__call__(*args, **kwargs)
+        finally:
+            # only release the lock if it has not expired and been taken
+            holder = self.redis.get(lock)
+            if holder is not None and holder.decode() == request.id:
+                self.redis.delete(lock)
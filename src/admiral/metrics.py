@@ -0,0 +1,358 @@
+"""Performance metrics for admiral tasks.
+
+Metrics are collected in each worker process from Celery signals and from
+the helpers that do a task's slow work (HTTP requests to the CT log and
+nmap runs).  They are labeled with the task name and the queue the task
+was delivered from:
+
+    admiral_task_queue_wait_seconds   time from publishing to starting a task
+    admiral_task_runtime_seconds      time spent running a task
+    admiral_tasks_total               tasks run, by final state (incl. RETRY)
+    admiral_http_ttfb_seconds         time until response headers arrive
+    admiral_http_request_seconds      time until the whole response is read
+    admiral_http_response_bytes_total response body bytes, by status
+    admiral_http_requests_total       requests made, by status
+    admiral_nmap_runtime_seconds      time an nmap process ran
+
+Each process periodically writes its metrics to the directory named by the
+admiral_metrics_dir setting, as Prometheus text (for the node exporter
+textfile collector) and as JSON:
+
+    admiral_metrics_dir: /var/lib/admiral/metrics
+    admiral_metrics_interval: 15  # seconds
+"""
+
+from contextlib import contextmanager
+import glob
+import json
+import os
+import socket
+import threading
+import time
+
+from celery import current_task, signals
+
+# histogram bucket upper bounds (seconds), from HTTP requests to long scans
+BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+    900,
+    3600,
+    float("inf"),
+)
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+
+# name: (type, help)
+METRICS = {
+    "admiral_task_queue_wait_seconds": (
+        HISTOGRAM,
+        "Time from publishing a task to starting it.",
+    ),
+    "admiral_task_runtime_seconds": (HISTOGRAM, "Time spent running a task."),
+    "admiral_tasks_total": (COUNTER, "Tasks run, by final state."),
+    "admiral_http_ttfb_seconds": (
+        HISTOGRAM,
+        "Time from sending an HTTP request to receiving the response headers.",
+    ),
+    "admiral_http_request_seconds": (
+        HISTOGRAM,
+        "Time from sending an HTTP request to reading the whole response.",
+    ),
+    "admiral_http_response_bytes_total": (COUNTER, "HTTP response body bytes."),
+    "admiral_http_requests_total": (COUNTER, "HTTP requests made, by status."),
+    "admiral_nmap_runtime_seconds": (HISTOGRAM, "Time an nmap process ran."),
+}
+
+# message header holding the time a task was published
+SENT_HEADER = "admiral_sent"
+# default seconds between metrics files writes
+DEFAULT_INTERVAL = 15
+# metrics files not updated for this many intervals belong to dead processes
+STALE_INTERVALS = 10
+
+
+class Histogram(object):
+    """Counts of observations in cumulative buckets."""
+
+    def __init__(self, buckets=BUCKETS):
+        """Create an empty histogram."""
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Add an observation."""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        """Return the histogram as a JSON friendly dict."""
+        return {
+            "buckets": [
+                ["+Inf" if bound == float("inf") else bound, count]
+                for bound, count in zip(self.buckets, self.counts)
+            ],
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+class Registry(object):
+    """A thread-safe collection of labeled metrics."""
+
+    def __init__(self):
+        """Create an empty registry."""
+        self.lock = threading.Lock()
+        # name: {sorted label tuple: counter value or Histogram}
+        self.series = {name: {} for name in METRICS}
+
+    def observe(self, name, value, labels):
+        """Add an observation to a histogram."""
+        assert METRICS[name][0] == HISTOGRAM, f"{name} is not a histogram"
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series[name]
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def increment(self, name, amount, labels):
+        """Add an amount to a counter."""
+        assert METRICS[name][0] == COUNTER, f"{name} is not a counter"
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series[name]
+            series[key] = series.get(key, 0) + amount
+
+    def get(self, name, **labels):
+        """Return the value of a counter or histogram series, or None."""
+        with self.lock:
+            return self.series[name].get(tuple(sorted(labels.items())))
+
+    def snapshot(self):
+        """Return all metrics as a JSON friendly dict."""
+        metrics = {}
+        with self.lock:
+            for name, series in self.series.items():
+                metrics[name] = [
+                    {
+                        "labels": dict(key),
+                        "value": None if isinstance(value, Histogram) else value,
+                        "histogram": (
+                            value.to_dict() if isinstance(value, Histogram) else None
+                        ),
+                    }
+                    for key, value in series.items()
+                ]
+        return metrics
+
+    def render(self, extra_labels=None):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in METRICS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in self.series[name].items():
+                    labels = dict(extra_labels or {}, **dict(key))
+                    if kind == COUNTER:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+                        continue
+                    for bound, count in zip(value.buckets, value.counts):
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        bucket_labels = format_labels(dict(labels, le=le))
+                        lines.append(f"{name}_bucket{bucket_labels} {count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    """Format a dict of labels for the Prometheus text format."""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in sorted(labels.items())
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+# the metrics of this process
+REGISTRY = Registry()
+
+
+def labels_for(task):
+    """Return the task and queue labels for a task."""
+    if task is None:
+        return {"task": "none", "queue": "none"}
+    delivery_info = task.request.delivery_info or {}
+    return {
+        "task": task.name,
+        "queue": delivery_info.get("routing_key") or "none",
+    }
+
+
+def task_labels():
+    """Return the task and queue labels for the currently running task."""
+    return labels_for(current_task._get_current_object())
+
+
+def observe(name, value, **labels):
+    """Add an observation to a histogram, labeled with the current task."""
+    REGISTRY.observe(name, value, dict(task_labels(), **labels))
+
+
+def increment(name, amount=1, **labels):
+    """Add to a counter, labeled with the current task."""
+    REGISTRY.increment(name, amount, dict(task_labels(), **labels))
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the time spent in a with block."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def write_metrics(directory, registry=REGISTRY):
+    """Write the metrics of this process to files in a directory.
+
+    Files belonging to processes that have stopped updating them are
+    removed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    process = f"{socket.gethostname()}-{os.getpid()}"
+    base = os.path.join(directory, f"admiral-{process}")
+    contents = {
+        ".prom": registry.render({"process": process}),
+        ".json": json.dumps(
+            {"process": process, "time": time.time(), "metrics": registry.snapshot()}
+        ),
+    }
+    for extension, content in contents.items():
+        # write then rename so that readers never see a partial file
+        with open(base + extension + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(base + extension + ".tmp", base + extension)
+
+
+def purge_stale(directory, max_age):
+    """Remove metrics files not written to for max_age seconds."""
+    cutoff = time.time() - max_age
+    for filename in glob.glob(os.path.join(directory, "admiral-*")):
+        try:
+            if os.stat(filename).st_mtime < cutoff:
+                os.remove(filename)
+        except FileNotFoundError:
+            # another process purged it first
+            pass
+
+
+class Exporter(threading.Thread):
+    """A thread that periodically writes this process's metrics."""
+
+    def __init__(self, directory, interval=DEFAULT_INTERVAL):
+        """Create an exporter writing to directory every interval seconds."""
+        super(Exporter, self).__init__(name="admiral-metrics", daemon=True)
+        self.directory = directory
+        self.interval = interval
+        self.pid = os.getpid()
+        self.stopped = threading.Event()
+
+    def run(self):
+        """Write metrics until stopped."""
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        """Write metrics now."""
+        write_metrics(self.directory)
+        purge_stale(self.directory, self.interval * STALE_INTERVALS)
+
+    def stop(self):
+        """Stop the thread after writing metrics a final time."""
+        self.stopped.set()
+        self.export()
+
+
+_exporter = None
+
+
+def ensure_exporter(app):
+    """Start an exporter in this process if one is configured."""
+    global _exporter
+    if _exporter is not None and _exporter.pid == os.getpid():
+        return
+    directory = app.conf.get("admiral_metrics_dir")
+    if not directory:
+        return
+    # a forked pool process inherits the parent's exporter, but not its thread
+    _exporter = Exporter(
+        directory, app.conf.get("admiral_metrics_interval", DEFAULT_INTERVAL)
+    )
+    _exporter.start()
+
+
+@signals.before_task_publish.connect
+def stamp_sent_time(headers=None, **kwargs):
+    """Record the time a task is published in its message headers."""
+    if headers is not None:
+        headers.setdefault(SENT_HEADER, time.time())
+
+
+_started = {}
+
+
+@signals.task_prerun.connect
+def task_started(task_id=None, task=None, **kwargs):
+    """Record the queue wait time of a task and start timing it."""
+    ensure_exporter(task.app)
+    _started[task_id] = time.perf_counter()
+    sent = task.request.get(SENT_HEADER)
+    # tasks with an eta (including retries) are meant to wait
+    if sent is not None and not task.request.eta:
+        REGISTRY.observe(
+            "admiral_task_queue_wait_seconds",
+            max(0.0, time.time() - sent),
+            labels_for(task),
+        )
+
+
+@signals.task_postrun.connect
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    """Record the runtime and final state of a task."""
+    labels = labels_for(task)
+    start = _started.pop(task_id, None)
+    if start is not None:
+        REGISTRY.observe(
+            "admiral_task_runtime_seconds", time.perf_counter() - start, labels
+        )
+    REGISTRY.increment("admiral_tasks_total", 1, dict(labels, state=state or "none"))
+
+
+@signals.worker_process_shutdown.connect
+@signals.worker_shutdown.connect
+def stop_exporter(**kwargs):
+    """Write the final metrics of this process."""
+    if _exporter is not None and _exporter.pid == os.getpid():
+        _exporter.stop()
@@ -1,4 +1,15 @@
+from .aggregate import CertAggregate
 from .cert import Cert
 from .domain import Domain, Agency
+from .scan import Host, HostChange, ScanRun, Service
 
-__all__ = ["Cert", "Domain", "Agency"]
+__all__ = [
+    "Cert",
+    "CertAggregate",
+    "Domain",
+    "Agency",
+    "Host",
+    "HostChange",
+    "ScanRun",
+    "Service",
+]
@@ -0,0 +1,253 @@
+"""Mongo document models for certificate aggregates.
+
+A CertAggregate holds running totals of the certificates of a trimmed
+domain, or of all the domains of an agency, so that dashboard questions
+(how many valid certificates, how many expire soon, which issuers) are
+answered by reading a single document instead of aggregating the certs and
+precerts collections.  Aggregates are updated with $inc as certificates are
+inserted, and can be rebuilt from scratch with rebuild().
+
+Certificates are counted by the day they expire and by issuer.  Only days
+from today onward are kept: expired certificates are only counted in the
+totals, and past days are removed from an aggregate when it is next
+updated, so an aggregate doesn't grow with every day ever recorded.
+Precertificates are only counted, as they are usually duplicated by a
+certificate.
+"""
+
+from datetime import datetime, timedelta
+
+from mongoengine import Document
+from mongoengine.context_managers import switch_collection
+from mongoengine.fields import DateTimeField, DictField, IntField, StringField
+from pymongo import UpdateOne
+
+from .cert import Cert
+from .domain import Domain
+
+DOMAIN_SCOPE = "domain"
+AGENCY_SCOPE = "agency"
+# the maximum number of domains looked up in a single query
+LOOKUP_BATCH_SIZE = 1000
+# the number of certificates read at a time when rebuilding
+REBUILD_BATCH_SIZE = 5000
+# appended to the collection name for the scratch collection of a rebuild
+REBUILD_SUFFIX = "_rebuild"
+# the format of the keys of the expiring buckets
+DAY_FORMAT = "%Y-%m-%d"
+
+
+def escape_key(key):
+    """Escape a string for use as a Mongo field name."""
+    return key.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def unescape_key(key):
+    """Reverse escape_key()."""
+    return key.replace("%24", "$").replace("%2E", ".").replace("%25", "%")
+
+
+def agencies_for(domains):
+    """Look up the agencies of domains.
+
+    Returns a dict mapping domain names to agency ids, for the domains that
+    have an agency.
+    """
+    domains = list(domains)
+    agencies = {}
+    for start in range(0, len(domains), LOOKUP_BATCH_SIZE):
+        batch = domains[start : start + LOOKUP_BATCH_SIZE]
+        for domain in Domain.objects(domain__in=batch).only("domain", "agency"):
+            if domain.agency is not None and domain.agency.id:
+                agencies[domain.domain] = domain.agency.id
+    return agencies
+
+
+class CertAggregate(Document):
+    """Certificate totals for a trimmed domain or an agency."""
+
+    # "<scope>:<key>"
+    id = StringField(primary_key=True)
+    scope = StringField(required=True, choices=(DOMAIN_SCOPE, AGENCY_SCOPE))
+    key = StringField(required=True)
+    certs = IntField(default=0)
+    precerts = IntField(default=0)
+    # day a certificate expires (DAY_FORMAT): number of certificates, for
+    # days from the last update onward
+    expiring = DictField()
+    # escaped issuer: number of certificates
+    issuers = DictField()
+    updated = DateTimeField()
+
+    meta = {"collection": "cert_aggregates", "indexes": ["scope"]}
+
+    @staticmethod
+    def make_id(scope, key):
+        """Return the id of the aggregate of a scope and key."""
+        return f"{scope}:{key}"
+
+    @classmethod
+    def past_days(cls, ids, today):
+        """Find the past days in the expiring buckets of aggregates.
+
+        Returns a dict mapping aggregate ids to $unset documents of their
+        days before today.
+        """
+        ids = list(ids)
+        unset = {}
+        for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+            batch = ids[start : start + LOOKUP_BATCH_SIZE]
+            documents = cls._get_collection().find(
+                {"_id": {"$in": batch}}, projection={"expiring": 1}
+            )
+            for document in documents:
+                days = [day for day in document.get("expiring", {}) if day < today]
+                if days:
+                    unset[document["_id"]] = {"expiring." + day: "" for day in days}
+        return unset
+
+    @classmethod
+    def add_certs(cls, certs, agencies=None, now=None):
+        """Add newly inserted certificates to their aggregates.
+
+        Each certificate is added to the aggregate of each of its trimmed
+        subjects, and of each agency owning one of them, with a single
+        unordered bulk write of upserts.
+
+        Arguments:
+        certs -- a sequence of (Cert, is_precert) pairs
+        agencies -- a dict mapping domains to agency ids; domains that are
+            missing are looked up
+        now -- the time of the update, days before it are not kept
+
+        Returns the number of aggregates written.
+        """
+        now = now or datetime.utcnow()
+        today = now.strftime(DAY_FORMAT)
+        certs = list(certs)
+        agencies = dict(agencies or {})
+        domains = {d for cert, _ in certs for d in cert.trimmed_subjects}
+        unknown = domains.difference(agencies)
+        if unknown:
+            agencies.update(agencies_for(unknown))
+
+        # aggregate id: {field: increment}
+        increments = {}
+        for cert, is_precert in certs:
+            keys = {(DOMAIN_SCOPE, d) for d in cert.trimmed_subjects}
+            keys.update(
+                (AGENCY_SCOPE, agencies[d])
+                for d in cert.trimmed_subjects
+                if d in agencies
+            )
+            if is_precert:
+                fields = ["precerts"]
+            else:
+                fields = ["certs", "issuers." + escape_key(cert.issuer)]
+                day = cert.not_after.strftime(DAY_FORMAT)
+                if day >= today:
+                    fields.append("expiring." + day)
+            for key in keys:
+                counts = increments.setdefault(key, {})
+                for field in fields:
+                    counts[field] = counts.get(field, 0) + 1
+
+        ids = {key: cls.make_id(*key) for key in increments}
+        past = cls.past_days(ids.values(), today)
+        writes = []
+        for (scope, key), counts in increments.items():
+            update = {
+                "$inc": counts,
+                "$set": {"updated": now},
+                "$setOnInsert": {"scope": scope, "key": key},
+            }
+            if ids[scope, key] in past:
+                update["$unset"] = past[ids[scope, key]]
+            writes.append(UpdateOne({"_id": ids[scope, key]}, update, upsert=True))
+        if writes:
+            cls._get_collection().bulk_write(writes, ordered=False)
+        return len(writes)
+
+    @classmethod
+    def rebuild(cls, now=None):
+        """Recompute all aggregates from the certs and precerts collections.
+
+        The aggregates are built in a scratch collection that then replaces
+        the aggregates in one rename, so readers see the old aggregates
+        until the new ones are complete.  Certificates inserted meanwhile
+        may not be counted.
+
+        Arguments:
+        now -- the time of the rebuild, days before it are not kept
+
+        Returns the number of certificates and precertificates counted.
+        """
+        name = cls._get_collection_name()
+        scratch = name + REBUILD_SUFFIX
+        cls._get_db()[scratch].drop()
+        with switch_collection(cls, scratch):
+            cls.ensure_indexes()
+            counted = cls._count_all(now or datetime.utcnow())
+        cls._get_db()[scratch].rename(name, dropTarget=True)
+        return counted
+
+    @classmethod
+    def _count_all(cls, now):
+        """Add all the certificates and precertificates to the aggregates."""
+        agencies = {
+            domain.domain: domain.agency.id
+            for domain in Domain.objects.only("domain", "agency")
+            if domain.agency is not None and domain.agency.id
+        }
+        counted = 0
+        for collection, is_precert in (("certs", False), ("precerts", True)):
+            cursor = Cert._get_db()[collection].find(
+                {},
+                projection=dict.fromkeys(
+                    ("not_after", "issuer", "trimmed_subjects"), 1
+                ),
+            )
+            batch = []
+            for document in cursor.batch_size(REBUILD_BATCH_SIZE):
+                batch.append((Cert._from_son(document), is_precert))
+                if len(batch) == REBUILD_BATCH_SIZE:
+                    cls.add_certs(batch, agencies, now)
+                    counted += len(batch)
+                    batch = []
+            cls.add_certs(batch, agencies, now)
+            counted += len(batch)
+        return counted
+
+    @classmethod
+    def for_domain(cls, domain):
+        """Return the aggregate of a trimmed domain, or None."""
+        return cls.objects(id=cls.make_id(DOMAIN_SCOPE, domain)).first()
+
+    @classmethod
+    def for_agency(cls, agency_id):
+        """Return the aggregate of an agency, or None."""
+        return cls.objects(id=cls.make_id(AGENCY_SCOPE, agency_id)).first()
+
+    def count_expiring(self, start, end):
+        """Count the certificates expiring on days from start until end."""
+        first = start.strftime(DAY_FORMAT)
+        last = end.strftime(DAY_FORMAT)
+        return sum(count for day, count in self.expiring.items() if first <= day < last)
+
+    def summary(self, now=None, soon=timedelta(days=30)):
+        """Summarize the certificates of this aggregate.
+
+        Returns a dict with the total number of certificates and
+        precertificates, the number of certificates that are still valid
+        and that expire within soon, and the number of certificates from
+        each issuer.
+        """
+        now = now or datetime.utcnow()
+        today = now.strftime(DAY_FORMAT)
+        return {
+            "certs": self.certs,
+            "precerts": self.precerts,
+            "valid": sum(c for day, c in self.expiring.items() if day >= today),
+            "expiring_soon": self.count_expiring(now, now + soon),
+            "issuers": {unescape_key(i): c for i, c in self.issuers.items()},
+        }
@@ -1,7 +1,9 @@
 """Mongo document models for Certificate documents."""
+
 from datetime import datetime
+import heapq
 
-from mongoengine import Document
+from mongoengine import Document, QuerySet
 from mongoengine.fields import (
     BooleanField,
     DateTimeField,
@@ -14,6 +16,13 @@ from cryptography.hazmat.backends import default_backend
 
 from admiral.util import trim_domains
 
+from .domain import Domain
+
+# the number of certificates in a page of results
+DEFAULT_PAGE_SIZE = 1000
+# the fewest certificates fetched at a time by each domain's cursor of a page
+MIN_CURSOR_BATCH_SIZE = 10
+
 
 def get_sans_set(xcert):
     """Extract the set of subjects from the SAN extension.
@@ -79,6 +88,119 @@ def is_poisioned(xcert):
         return False
 
 
+class CertQuerySet(QuerySet):
+    """Time windowed certificate queries for domains and agencies.
+
+    Restrict a query to domains first, so that the compound indexes on
+    trimmed subjects and dates are used, e.g.:
+
+        Cert.objects.for_agency("DHS").expiring(start, end)
+        Cert.objects.for_domains("cisa.gov").issued_since(last_report)
+    """
+
+    def for_domains(self, *domains):
+        """Restrict to certificates for any of the trimmed domains."""
+        return self.filter(_trimmed_subjects__in=[d.lower() for d in domains])
+
+    def for_agency(self, agency_id):
+        """Restrict to certificates for the domains of an agency."""
+        domains = Domain.objects(agency__id=agency_id).scalar("domain")
+        return self.for_domains(*domains)
+
+    def expiring(self, start, end):
+        """Restrict to certificates that expire from start until end."""
+        return self.filter(not_after__gte=start, not_after__lt=end)
+
+    def issued_since(self, since, until=None):
+        """Restrict to certificates logged (or issued) since a time.
+
+        The earliest SCT is used as the time a certificate was logged, or
+        not_before if it has none.
+        """
+        queryset = self.filter(sct_or_not_before__gte=since)
+        if until is not None:
+            queryset = queryset.filter(sct_or_not_before__lt=until)
+        return queryset
+
+    def domains(self):
+        """Return the trimmed domains the query is restricted to, or None."""
+        subjects = self._query.get("trimmed_subjects")
+        if isinstance(subjects, str):
+            return [subjects]
+        if isinstance(subjects, dict) and set(subjects) == {"$in"}:
+            return list(subjects["$in"])
+        return None
+
+    def page_queries(self, after=None, size=DEFAULT_PAGE_SIZE, field="not_after"):
+        """Return the queries for a page, one for each domain.
+
+        A query for a single trimmed domain reads the compound index on
+        (trimmed subject, field, log id) in order, so no sort is done in
+        memory.  Without domains a single query is returned.
+
+        Each query fetches an equal share of the page at a time, so merging
+        them reads about one page (plus a batch per domain) from the server
+        rather than a page per domain.
+        """
+        domains = self.domains()
+        if domains is None:
+            queries = [self._query]
+        else:
+            queries = [
+                dict(self._query, trimmed_subjects=d) for d in sorted(set(domains))
+            ]
+        if after is not None:
+            value, log_id = after
+            # a range on field keeps the index order, the ties on value that
+            # were already returned are filtered out
+            keyset = [
+                {field: {"$gte": value}},
+                {"$nor": [{field: value, "_id": {"$lte": log_id}}]},
+            ]
+            queries = [{"$and": [query] + keyset} for query in queries]
+        batch_size = min(size, max(MIN_CURSOR_BATCH_SIZE, -(-size // len(queries))))
+        # without the cache each certificate is only read when it is merged
+        return [
+            self._document.objects(__raw__=query)
+            .no_cache()
+            .order_by(field, "log_id")
+            .limit(size)
+            .batch_size(batch_size)
+            for query in queries
+        ]
+
+    def page(self, after=None, size=DEFAULT_PAGE_SIZE, field="not_after"):
+        """Return a page of certificates ordered by a date field.
+
+        Pages are found by keyset pagination, each page is a range query on
+        the index instead of a skip over all the earlier pages.  The pages of
+        each domain are read separately and merged.
+
+        Arguments:
+        after -- the cursor returned with the previous page, None for the first
+        size -- the maximum number of certificates in the page
+        field -- the date field to order by: not_after or sct_or_not_before
+
+        Returns (certs, cursor):
+            certs: a list of up to size certificates
+            cursor: pass as after to get the next page, None after the last
+        """
+
+        def key(cert):
+            return cert[field], cert.log_id
+
+        certs = []
+        merged = heapq.merge(*self.page_queries(after, size, field), key=key)
+        for cert in merged:
+            # a certificate for several domains is found by each of them
+            if certs and certs[-1].log_id == cert.log_id:
+                continue
+            certs.append(cert)
+            if len(certs) == size:
+                return certs, key(cert)
+        return certs, None
+
+
 class Cert(Document):
     """Certificate mongo document model."""
 
@@ -100,9 +222,13 @@ class Cert(Document):
         "collection": "certs",
         "indexes": [
             "+_subjects",
-            "+_trimmed_subjects",
+            # these also serve queries on _trimmed_subjects alone
+            # log id orders certificates with the same date when paging
+            ("+_trimmed_subjects", "+not_after", "+_id"),
+            ("+_trimmed_subjects", "+sct_or_not_before", "+_id"),
             {"fields": ("+issuer", "+serial"), "unique": True},
         ],
+        "queryset_class": CertQuerySet,
     }
 
     @property
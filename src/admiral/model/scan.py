@@ -0,0 +1,408 @@
+"""Mongo document models for port scan results.
+
+Host documents hold the most recent known state of each host.  Each scan is
+recorded as a ScanRun, and only the differences from a host's previous state
+are stored, as HostChange documents.  A host that looks the same as it did
+last time costs a read, but no writes.
+"""
+from datetime import datetime
+import ipaddress
+
+from mongoengine import Document, EmbeddedDocument
+from mongoengine.fields import (
+    DateTimeField,
+    DictField,
+    EmbeddedDocumentField,
+    IntField,
+    ListField,
+    ObjectIdField,
+    StringField,
+)
+from pymongo import ReplaceOne
+
+from admiral.util.profile import TIMEOUT_LIMIT, UNRESPONSIVE_MISSES
+
+# port states that are recorded as services
+OPEN_STATES = ("open",)
+# service fields that are compared between scans
+SERVICE_FIELDS = ("name", "product", "version", "extrainfo")
+# the maximum number of hosts looked up in a single query
+LOOKUP_BATCH_SIZE = 1000
+# the number of open ports remembered as discovery probes
+MAX_PROBE_PORTS = 10
+# significant digits kept for round trip times, so jitter doesn't cause writes
+RTT_DIGITS = 2
+
+HOST_UP = "host_up"
+HOST_DOWN = "host_down"
+PORT_OPENED = "port_opened"
+PORT_CLOSED = "port_closed"
+SERVICE_CHANGED = "service_changed"
+CHANGE_TYPES = (HOST_UP, HOST_DOWN, PORT_OPENED, PORT_CLOSED, SERVICE_CHANGED)
+
+
+class Service(EmbeddedDocument):
+    """Embedded document in a host representing an open port."""
+
+    port = IntField(required=True)
+    protocol = StringField(required=True)
+    name = StringField()
+    product = StringField()
+    version = StringField()
+    extrainfo = StringField()
+
+    @property
+    def key(self):
+        """The (protocol, port) pair identifying this service on a host."""
+        return (self.protocol, self.port)
+
+    def summary(self):
+        """Return the compared fields of this service as a dict."""
+        return {field: getattr(self, field) for field in SERVICE_FIELDS}
+
+    @classmethod
+    def from_record(cls, record):
+        """Create a Service from a compact port record.
+
+        See admiral.port_scan.parser for the record format.
+        """
+        return cls(
+            port=record["port"],
+            protocol=record["protocol"],
+            name=record.get("service"),
+            product=record.get("product"),
+            version=record.get("version"),
+            extrainfo=record.get("extrainfo"),
+        )
+
+
+def address_key(address):
+    """Return a key for an IP address string that sorts in address order.
+
+    IPv4 and IPv6 addresses are kept apart by a version prefix, so the
+    addresses of a network are a contiguous range of keys.
+    """
+    ip = ipaddress.ip_address(address)
+    return f"{ip.version}:{ip.packed.hex()}"
+
+
+def collapse_targets(targets):
+    """Yield the networks covering IP address or CIDR block strings.
+
+    Overlapping and adjacent networks are merged.
+    """
+    networks = {}
+    for target in targets:
+        network = ipaddress.ip_network(target, strict=False)
+        networks.setdefault(network.version, []).append(network)
+    for version in sorted(networks):
+        yield from ipaddress.collapse_addresses(networks[version])
+
+
+def round_rtt(value):
+    """Round a round trip time to a few significant digits."""
+    if not value:
+        return value
+    digits = len(str(int(value))) - RTT_DIGITS
+    return int(round(value, -digits)) if digits > 0 else int(value)
+
+
+class ScanProfile(EmbeddedDocument):
+    """Embedded document in a host holding what earlier scans learned about it.
+
+    See admiral.port_scan.timing for how a profile shapes a scan.
+    """
+
+    srtt = IntField()
+    rttvar = IntField()
+    ping_reason = StringField()
+    probe_ports = ListField(IntField())
+    misses = IntField(default=0)
+    timeouts = IntField(default=0)
+
+    def learn(self, record, kind):
+        """Update the profile from a compact host record.
+
+        Arguments:
+        record -- a compact host record for a host that responded
+        kind -- the kind of scan that produced the record
+        """
+        times = record.get("times") or {}
+        if times.get("srtt"):
+            self.srtt = round_rtt(times["srtt"])
+            self.rttvar = round_rtt(times.get("rttvar"))
+        self.misses = 0
+        # port scans skip discovery, so only discovery knows what answers
+        if kind == "discovery" and record.get("reason"):
+            self.ping_reason = record["reason"]
+        if kind == "port" and "ports" in record:
+            self.probe_ports = sorted(
+                port["port"]
+                for port in record["ports"]
+                if port["protocol"] == "tcp" and port.get("state") in OPEN_STATES
+            )[:MAX_PROBE_PORTS]
+            if record.get("timedout"):
+                self.timeouts = min(self.timeouts + 1, TIMEOUT_LIMIT)
+            else:
+                self.timeouts = 0
+
+    def missed(self):
+        """Record a scan that the host did not respond to."""
+        # counting stops once the host is considered unresponsive
+        self.misses = min(self.misses + 1, UNRESPONSIVE_MISSES)
+
+    def to_profile(self):
+        """Return this profile as a dict for the scan tasks."""
+        return self.to_mongo().to_dict()
+
+
+def profile_of(host):
+    """Return a host's scan profile as a dict, or None if it has none."""
+    if host is None or host.profile is None:
+        return None
+    return host.profile.to_profile()
+
+
+def diff_services(old, new):
+    """Compare two lists of services.
+
+    Arguments:
+    old -- the services from the previous scan
+    new -- the services from the current scan
+
+    Returns a list of (change, service_key, before, after) tuples.
+    """
+    old_services = {service.key: service for service in old}
+    new_services = {service.key: service for service in new}
+    changes = []
+    for key in sorted(old_services.keys() | new_services.keys()):
+        before = old_services.get(key)
+        after = new_services.get(key)
+        if before is None:
+            changes.append((PORT_OPENED, key, None, after.summary()))
+        elif after is None:
+            changes.append((PORT_CLOSED, key, before.summary(), None))
+        elif before.summary() != after.summary():
+            changes.append((SERVICE_CHANGED, key, before.summary(), after.summary()))
+    return changes
+
+
+class ScanRun(Document):
+    """A single discovery or port scan of a set of targets."""
+
+    kind = StringField(required=True, choices=("discovery", "port"))
+    targets = ListField(StringField())
+    started = DateTimeField(required=True, default=datetime.utcnow)
+    finished = DateTimeField()
+    host_count = IntField(default=0)
+    change_count = IntField(default=0)
+
+    meta = {"collection": "scan_runs", "indexes": ["-started"]}
+
+    def save_results(self, records, down=()):
+        """Store the results of this scan.
+
+        Hosts are loaded in batches, compared to their previous state, and
+        only hosts that changed (including their hostnames, OS, or scan
+        profile) are written back with a single unordered bulk write.  The changes themselves are
+        inserted as HostChange documents.  This scan run is saved with its
+        totals.
+
+        Arguments:
+        records -- compact host records, see admiral.port_scan.parser
+        down -- addresses that were scanned but did not respond
+
+        Returns the list of HostChange documents that were stored.
+        """
+        if self.id is None:
+            self.save()
+        now = datetime.utcnow()
+        records = {r["address"]: r for r in records if r and r.get("address")}
+        addresses = list(records.keys()) + [a for a in down if a not in records]
+
+        host_writes = []
+        changes = []
+        for start in range(0, len(addresses), LOOKUP_BATCH_SIZE):
+            batch = addresses[start : start + LOOKUP_BATCH_SIZE]
+            known = {host.ip: host for host in Host.objects(ip__in=batch)}
+            for address in batch:
+                host = known.get(address)
+                before = host.to_mongo().to_dict() if host is not None else None
+                if address in records:
+                    host, host_changes = Host.update_from_record(
+                        host, records[address], self, now
+                    )
+                elif host is not None:
+                    host_changes = host.mark_down()
+                else:
+                    continue
+                host.clean()
+                if not host_changes and host.to_mongo().to_dict() == before:
+                    continue
+                if host_changes:
+                    host.last_changed = now
+                host.last_scan = self.id
+                host.validate()
+                host_writes.append(
+                    ReplaceOne({"_id": host.ip}, host.to_mongo(), upsert=True)
+                )
+                changes.extend(
+                    HostChange.from_diff(host.ip, self, now, *change)
+                    for change in host_changes
+                )
+
+        if host_writes:
+            Host._get_collection().bulk_write(host_writes, ordered=False)
+        if changes:
+            HostChange._get_collection().insert_many(
+                [change.to_mongo() for change in changes], ordered=False
+            )
+
+        self.host_count += len(records)
+        self.change_count += len(changes)
+        self.finished = now
+        self.save()
+        return changes
+
+
+class Host(Document):
+    """Host mongo document model.  Holds the latest known state of a host."""
+
+    ip = StringField(primary_key=True)
+    # see address_key, set when the host is saved
+    ip_key = StringField()
+    state = StringField()
+    hostnames = ListField(StringField())
+    os = StringField()
+    services = ListField(EmbeddedDocumentField(Service))
+    first_seen = DateTimeField()
+    last_changed = DateTimeField()
+    last_scan = ObjectIdField()
+    profile = EmbeddedDocumentField(ScanProfile)
+
+    meta = {"collection": "hosts", "indexes": ["+ip_key"]}
+
+    def clean(self):
+        """Derive the address key from the address."""
+        self.ip_key = address_key(self.ip)
+
+    @classmethod
+    def known_in(cls, targets, *fields):
+        """Yield the known hosts within targets.
+
+        Each network is a range query on the address key, so this costs
+        one query per network however large it is.  Hosts stored before
+        the address key existed are found once a scan has rewritten them.
+
+        Arguments:
+        targets -- a collection of IP address or CIDR block strings
+        fields -- only load these fields, all fields if none are given
+        """
+        for network in collapse_targets(targets):
+            hosts = cls.objects(
+                ip_key__gte=address_key(network.network_address),
+                ip_key__lte=address_key(network.broadcast_address),
+            )
+            yield from hosts.only("ip", *fields) if fields else hosts
+
+    @classmethod
+    def profiles_for(cls, targets):
+        """Collect the scan profiles of known hosts within targets.
+
+        Arguments:
+        targets -- a collection of IP address or CIDR block strings
+
+        Returns a dict mapping the address of each known host to its profile
+        dict, or None if it has no profile.
+        """
+        hosts = cls.known_in(targets, "profile")
+        return {host.ip: profile_of(host) for host in hosts}
+
+    def mark_down(self):
+        """Record a scan that this host did not respond to.
+
+        Returns a list of (change, service_key, before, after) tuples.
+        """
+        changes = []
+        if self.state == "up":
+            changes.append((HOST_DOWN, None, None, None))
+        self.state = "down"
+        if self.profile is None:
+            self.profile = ScanProfile()
+        self.profile.missed()
+        return changes
+
+    @classmethod
+    def update_from_record(cls, host, record, scan_run, now):
+        """Apply a compact host record to a host.
+
+        Arguments:
+        host -- the existing Host, or None if it has never been seen
+        record -- a compact host record from the current scan
+        scan_run -- the ScanRun producing the record
+        now -- the time of the scan
+
+        Returns (host, changes):
+            host: the updated Host
+            changes: a list of (change, service_key, before, after) tuples
+        """
+        changes = []
+        if host is None:
+            host = cls(ip=record["address"], first_seen=now)
+        state = record.get("state", "up")
+        if state == "up" and host.state != "up":
+            changes.append((HOST_UP, None, None, None))
+        elif state != "up" and host.state == "up":
+            changes.append((HOST_DOWN, None, None, None))
+        host.state = state
+        if record.get("hostnames"):
+            host.hostnames = record["hostnames"]
+        if record.get("os"):
+            host.os = record["os"][0]["name"]
+        if state == "up":
+            if host.profile is None:
+                host.profile = ScanProfile()
+            host.profile.learn(record, scan_run.kind)
+        # discovery scans do not report ports, so they can't change services
+        if scan_run.kind == "port" and "ports" in record:
+            services = [
+                Service.from_record(port)
+                for port in record["ports"]
+                if port.get("state") in OPEN_STATES
+            ]
+            changes.extend(diff_services(host.services, services))
+            host.services = services
+        return host, changes
+
+
+class HostChange(Document):
+    """A change in a host's state observed by a scan."""
+
+    ip = StringField(required=True)
+    scan_run = ObjectIdField(required=True)
+    timestamp = DateTimeField(required=True)
+    change = StringField(required=True, choices=CHANGE_TYPES)
+    protocol = StringField()
+    port = IntField()
+    before = DictField()
+    after = DictField()
+
+    meta = {
+        "collection": "host_changes",
+        "indexes": [("+ip", "-timestamp"), "+scan_run"],
+    }
+
+    @classmethod
+    def from_diff(cls, ip, scan_run, timestamp, change, key, before, after):
+        """Create a HostChange from a diff tuple."""
+        protocol, port = key if key else (None, None)
+        return cls(
+            ip=ip,
+            scan_run=scan_run.id,
+            timestamp=timestamp,
+            change=change,
+            protocol=protocol,
+            port=port,
+            before=before,
+            after=after,
+        )
@@ -0,0 +1,248 @@
+"""Offload large task results from the result backend to a side store.
+
+Results whose serialized size is above a threshold are written to a side
+store, and only a small reference is kept in Redis.  The reference is
+resolved when the result is read from the backend, so callers of
+AsyncResult.get() see the original value.  This keeps Redis memory flat no
+matter how large the results (summary lists, PEMs, scan records) grow.
+
+Enable it by prefixing the result backend URL with the backend class and
+naming a store:
+
+    result_backend: admiral.offload:OffloadRedisBackend+redis://redis:6379/0
+    admiral_offload_url: mongodb://mongo:27017/certs  # or file:///path
+    admiral_offload_threshold: 65536                  # bytes
+
+The mongodb store keeps payloads in GridFS, where TTL indexes remove them
+once their results expire (result_expires).  Forgetting a result also
+removes its payload.  The file store is only useful when every worker and
+client share a filesystem, such as in tests.
+"""
+
+from datetime import datetime, timedelta
+import os
+import time
+import uuid
+from urllib.parse import urlparse
+
+from celery import states
+from celery.backends.redis import RedisBackend
+from celery.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# key marking a result that was offloaded
+REFERENCE_KEY = "__admiral_offload__"
+# default serialized size above which results are offloaded (bytes)
+DEFAULT_THRESHOLD = 64 * 1024
+# GridFS bucket holding offloaded payloads
+GRIDFS_COLLECTION = "offload"
+
+
+class FileStore(object):
+    """A side store keeping each payload in a file of a local directory."""
+
+    def __init__(self, path):
+        """Create a store in the directory path."""
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _filename(self, key):
+        # keys are generated by us, but never trust a path component
+        return os.path.join(self.path, os.path.basename(key))
+
+    def put(self, key, data):
+        """Store bytes under key."""
+        temp_name = self._filename(key) + ".tmp"
+        with open(temp_name, "wb") as f:
+            f.write(data)
+        os.replace(temp_name, self._filename(key))
+
+    def get(self, key):
+        """Return the bytes stored under key."""
+        with open(self._filename(key), "rb") as f:
+            return f.read()
+
+    def delete(self, key):
+        """Remove the payload stored under key, if it exists."""
+        try:
+            os.remove(self._filename(key))
+        except FileNotFoundError:
+            pass
+
+    def purge(self, max_age):
+        """Remove payloads older than max_age seconds."""
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                self.delete(entry.name)
+
+
+class GridFSStore(object):
+    """A side store keeping payloads in a Mongo GridFS bucket.
+
+    When payloads expire, TTL indexes remove them without anyone having to
+    run a cleanup.  GridFS only dates the files collection, so each chunk is
+    dated as well, or the chunks would outlive their files.  The TTL is part
+    of the index name, so when it changes the old index is replaced instead
+    of conflicting with the new one.
+    """
+
+    def __init__(self, url, collection=GRIDFS_COLLECTION, expires=None):
+        """Create a store in the default database of the Mongo url.
+
+        Arguments:
+        url -- a mongodb:// URL
+        collection -- the name of the GridFS bucket
+        expires -- seconds until a payload is removed, None to keep them
+        """
+        # imported here so that only processes using this store load pymongo
+        import gridfs
+        from pymongo import MongoClient
+
+        database = MongoClient(url).get_default_database()
+        self.fs = gridfs.GridFS(database, collection=collection)
+        self.files = database[f"{collection}.files"]
+        self.chunks = database[f"{collection}.chunks"]
+        self.expires = expires
+        for documents in (self.files, self.chunks):
+            self._index_expiry(documents)
+
+    def _index_expiry(self, documents):
+        """Create the TTL index of documents, dropping any for another TTL."""
+        name = f"expires_{int(self.expires)}" if self.expires else None
+        indexes = documents.index_information()
+        for index in indexes:
+            if index.startswith("expires") and index != name:
+                documents.drop_index(index)
+        if name and name not in indexes:
+            documents.create_index(
+                "uploadDate", name=name, expireAfterSeconds=int(self.expires)
+            )
+
+    def put(self, key, data):
+        """Store bytes under key."""
+        self.fs.put(data, _id=key)
+        if self.expires:
+            upload_date = self.files.find_one({"_id": key}, ["uploadDate"])
+            self.chunks.update_many(
+                {"files_id": key}, {"$set": {"uploadDate": upload_date["uploadDate"]}}
+            )
+
+    def get(self, key):
+        """Return the bytes stored under key."""
+        return self.fs.get(key).read()
+
+    def delete(self, key):
+        """Remove the payload stored under key, if it exists."""
+        self.fs.delete(key)
+
+    def purge(self, max_age):
+        """Remove payloads older than max_age seconds."""
+        cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+        for grid_out in self.fs.find({"uploadDate": {"$lt": cutoff}}):
+            self.fs.delete(grid_out._id)
+
+
+def store_from_url(url, expires=None):
+    """Create a side store from a URL.
+
+    Supported schemes are file:// and mongodb://.  Only the mongodb store
+    removes expired payloads by itself, see GridFSStore.
+    """
+    scheme = urlparse(url).scheme
+    if scheme == "file":
+        return FileStore(urlparse(url).path)
+    if scheme in ("mongodb", "mongodb+srv"):
+        return GridFSStore(url, expires=expires)
+    raise ValueError(f"unsupported offload store: {url}")
+
+
+def is_reference(value):
+    """Determine if a result value is an offload reference."""
+    return isinstance(value, dict) and REFERENCE_KEY in value
+
+
+class OffloadMixin(object):
+    """Result backend mixin that offloads large results to a side store.
+
+    Mix into a key/value result backend class ahead of the backend.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Read the offload settings from the app configuration."""
+        super(OffloadMixin, self).__init__(*args, **kwargs)
+        conf = self.app.conf
+        self.offload_url = conf.get("admiral_offload_url")
+        self.offload_threshold = conf.get(
+            "admiral_offload_threshold", DEFAULT_THRESHOLD
+        )
+        self._offload_store = None
+
+    @property
+    def offload_store(self):
+        """The side store, created when it is first needed."""
+        if self._offload_store is None:
+            self._offload_store = store_from_url(self.offload_url, self.expires)
+        return self._offload_store
+
+    def offload(self, result, state):
+        """Replace a large successful result with a reference."""
+        if not self.offload_url or state != states.SUCCESS or is_reference(result):
+            return result
+        payload = self.encode(result)
+        if len(payload) <= self.offload_threshold:
+            return result
+        if isinstance(payload, str):
+            payload = payload.encode()
+        key = uuid.uuid4().hex
+        self.offload_store.put(key, payload)
+        logger.debug(f"Offloaded {len(payload)} byte result to {key}")
+        return {REFERENCE_KEY: key, "size": len(payload)}
+
+    def resolve(self, result):
+        """Replace a reference with the result it refers to."""
+        if not is_reference(result):
+            return result
+        return self.decode(self.offload_store.get(result[REFERENCE_KEY]))
+
+    def encode_result(self, result, state):
+        """Prepare a result for storage, offloading it if it is large.
+
+        This is also used for chord member results, which are queued in
+        Redis until the chord callback runs.
+        """
+        result = super(OffloadMixin, self).encode_result(result, state)
+        return self.offload(result, state)
+
+    def meta_from_decoded(self, meta):
+        """Resolve an offloaded result read from the backend."""
+        meta = super(OffloadMixin, self).meta_from_decoded(meta)
+        meta["result"] = self.resolve(meta.get("result"))
+        return meta
+
+    def _unpack_chord_result(self, *args, **kwargs):
+        """Resolve an offloaded chord member result for the callback."""
+        return self.resolve(
+            super(OffloadMixin, self)._unpack_chord_result(*args, **kwargs)
+        )
+
+    def _forget(self, task_id):
+        """Remove a result, and its payload if it was offloaded."""
+        if self.offload_url:
+            stored = self.get(self.get_key_for_task(task_id))
+            if stored is not None:
+                result = self.decode(stored).get("result")
+                if is_reference(result):
+                    self.offload_store.delete(result[REFERENCE_KEY])
+        super(OffloadMixin, self)._forget(task_id)
+
+    def cleanup(self):
+        """Remove offloaded payloads whose results have expired."""
+        super(OffloadMixin, self).cleanup()
+        if self.offload_url and self.expires:
+            self.offload_store.purge(self.expires)
+
+
+class OffloadRedisBackend(OffloadMixin, RedisBackend):
+    """Redis result backend that offloads large results to a side store."""
@@ -0,0 +1,177 @@
+"""Incremental nmap XML output parser.
+
+nmap's XML output is parsed as it is produced, and each host is reduced to a
+compact record containing only the fields we use.  Elements are discarded as
+soon as they have been converted, so memory use does not grow with the size
+of the scan.
+
+A host record looks like:
+
+    {
+        "address": "192.0.2.1",
+        "state": "up",
+        "reason": "syn-ack",
+        "hostnames": ["www.example.gov"],
+        "times": {"srtt": 4000, "rttvar": 5000, "to": 100000},
+        "ports": [
+            {
+                "port": 443,
+                "protocol": "tcp",
+                "state": "open",
+                "reason": "syn-ack",
+                "service": "https",
+                "product": "nginx",
+                "version": "1.15.8",
+            }
+        ],
+        "os": [{"name": "Linux 4.15", "accuracy": 100}],
+        "timedout": True,
+    }
+
+Optional keys are omitted when nmap does not report them.
+"""
+
+from xml.etree.ElementTree import XMLPullParser
+
+# the maximum number of bytes read from the source at a time
+READ_SIZE = 64 * 1024
+# service attributes that are copied into port records
+SERVICE_ATTRIBUTES = ("product", "version", "extrainfo", "ostype", "tunnel")
+# the number of OS matches kept for a host
+MAX_OS_MATCHES = 3
+
+
+def _int(value):
+    """Convert an attribute to an int, passing None through."""
+    return None if value is None else int(value)
+
+
+def parse_port(element):
+    """Create a compact port record from a <port> element."""
+    port = {"port": int(element.get("portid")), "protocol": element.get("protocol")}
+    state = element.find("state")
+    if state is not None:
+        port["state"] = state.get("state")
+        port["reason"] = state.get("reason")
+    service = element.find("service")
+    if service is not None:
+        port["service"] = service.get("name")
+        for attribute in SERVICE_ATTRIBUTES:
+            if service.get(attribute) is not None:
+                port[attribute] = service.get(attribute)
+        cpes = [cpe.text for cpe in service.findall("cpe")]
+        if cpes:
+            port["cpe"] = cpes
+    return port
+
+
+def parse_host(element):
+    """Create a compact host record from a <host> element."""
+    host = {"address": None}
+    for address in element.findall("address"):
+        if address.get("addrtype") in ("ipv4", "ipv6"):
+            host["address"] = address.get("addr")
+            break
+    status = element.find("status")
+    if status is not None:
+        host["state"] = status.get("state")
+        host["reason"] = status.get("reason")
+    if element.get("timedout") == "true":
+        host["timedout"] = True
+    host["hostnames"] = [
+        hostname.get("name") for hostname in element.iterfind("hostnames/hostname")
+    ]
+    times = element.find("times")
+    if times is not None:
+        host["times"] = {key: _int(times.get(key)) for key in ("srtt", "rttvar", "to")}
+    ports = element.find("ports")
+    if ports is not None:
+        host["ports"] = [parse_port(port) for port in ports.findall("port")]
+    os_matches = element.findall("os/osmatch")
+    if os_matches:
+        host["os"] = [
+            {"name": match.get("name"), "accuracy": _int(match.get("accuracy"))}
+            for match in os_matches[:MAX_OS_MATCHES]
+        ]
+    return host
+
+
+def parse_runstats(element):
+    """Create a compact summary record from a <runstats> element."""
+    summary = {}
+    finished = element.find("finished")
+    if finished is not None:
+        summary["exit"] = finished.get("exit")
+        summary["elapsed"] = float(finished.get("elapsed", 0))
+    hosts = element.find("hosts")
+    if hosts is not None:
+        summary.update(
+            {key: _int(hosts.get(key)) for key in ("up", "down", "total")}
+        )
+    return summary
+
+
+def parse_progress(element):
+    """Create a compact progress record from a <taskprogress> element.
+
+    These are produced by nmap's `--stats-every` option.
+    """
+    return {
+        "task": element.get("task"),
+        "percent": float(element.get("percent", 0)),
+        "remaining": _int(element.get("remaining")),
+        "etc": _int(element.get("etc")),
+    }
+
+
+def iter_records(source):
+    """Parse nmap XML output incrementally.
+
+    Data is handed to the parser as soon as it can be read from source, so
+    records are produced while nmap is still running.
+
+    Arguments:
+    source -- a binary file object, such as a subprocess pipe
+
+    Yields (kind, record) tuples as they are completed in the output, where
+    kind is "host", "progress", or "runstats".
+    """
+    parser = XMLPullParser(events=("start", "end"))
+    # read1 returns whatever is available instead of waiting for a full chunk
+    read = getattr(source, "read1", source.read)
+    root = None
+    depth = 0
+    while True:
+        data = read(READ_SIZE)
+        if data:
+            parser.feed(data)
+        else:
+            # raises a ParseError if the document is incomplete
+            parser.close()
+        for event, element in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = element
+                depth += 1
+                continue
+            depth -= 1
+            # only direct children of <nmaprun> are complete records
+            if depth != 1:
+                continue
+            if element.tag == "host":
+                yield "host", parse_host(element)
+            elif element.tag == "taskprogress":
+                yield "progress", parse_progress(element)
+            elif element.tag == "runstats":
+                yield "runstats", parse_runstats(element)
+            # drop everything that has been seen so far
+            root.clear()
+        if not data:
+            break
+
+
+def iter_hosts(source):
+    """Parse nmap XML output incrementally, yielding only host records."""
+    for kind, record in iter_records(source):
+        if kind == "host":
+            yield record
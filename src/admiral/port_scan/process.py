@@ -0,0 +1,191 @@
+"""Streaming external process management for scan tasks.
+
+Scans can run for hours, so their output is consumed while they run rather
+than collected at the end.  A watchdog kills a scan that runs too long, and
+scan slots limit how many scans run at once on a worker host.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import fcntl
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from celery.utils.log import get_task_logger
+
+logger = get_task_logger(__name__)
+
+# the number of stderr lines kept for error reporting
+STDERR_LINES = 100
+# seconds to wait after a SIGTERM before sending a SIGKILL
+KILL_GRACE_SECONDS = 10
+# seconds between attempts to acquire a scan slot
+SLOT_POLL_SECONDS = 1.0
+
+
+class ScanTimeout(subprocess.TimeoutExpired):
+    """Raised when a process was killed for running too long."""
+
+
+class SlotTimeout(Exception):
+    """Raised when a scan slot could not be acquired in time."""
+
+
+class ScanProcess(object):
+    """A running external command whose output is read as it is produced.
+
+    Use as a context manager.  Read the command's output from the stdout
+    attribute inside the context.  Leaving the context waits for the
+    command to exit and raises an exception if it failed or was killed.  If
+    the context is left because of an exception, such as a task time limit,
+    the command is killed first.
+
+    stderr is drained on a background thread so that the command can never
+    block on a full pipe.
+    """
+
+    def __init__(self, command, timeout=None, kill_grace=KILL_GRACE_SECONDS):
+        """Prepare to run a command.
+
+        Arguments:
+        command -- a shell command line
+        timeout -- seconds the command may run before it is killed
+        kill_grace -- seconds allowed for a clean exit after a SIGTERM
+        """
+        self.command = command
+        self.timeout = timeout
+        self.kill_grace = kill_grace
+        self.timed_out = False
+        self.process = None
+        self._stderr = deque(maxlen=STDERR_LINES)
+        self._reader = None
+        self._watchdog = None
+
+    def __enter__(self):
+        """Start the command."""
+        logger.info(f"Executing command: {self.command}")
+        # a new session lets us signal the whole process group (sh, sudo, nmap)
+        self.process = subprocess.Popen(
+            self.command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=True,
+            start_new_session=True,
+        )
+        self._reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._reader.start()
+        if self.timeout:
+            self._watchdog = threading.Timer(self.timeout, self._expire)
+            self._watchdog.daemon = True
+            self._watchdog.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Wait for the command to exit, killing it if we are bailing out."""
+        if exc_type is not None:
+            self.kill()
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+        self.process.stdout.close()
+        self.process.wait()
+        self._reader.join()
+        if exc_type is None:
+            self.check_returncode()
+        return False
+
+    @property
+    def stdout(self):
+        """The command's standard output pipe."""
+        return self.process.stdout
+
+    @property
+    def stderr(self):
+        """The most recent lines the command wrote to stderr."""
+        return "\n".join(self._stderr)
+
+    @property
+    def returncode(self):
+        """The command's exit status, or None if it is still running."""
+        return self.process.returncode
+
+    def _read_stderr(self):
+        """Collect stderr lines until the command closes it."""
+        for line in self.process.stderr:
+            self._stderr.append(line.decode(errors="replace").rstrip())
+        self.process.stderr.close()
+
+    def _expire(self):
+        """Kill the command when its time is up."""
+        logger.warning(f"Killing command after {self.timeout}s: {self.command}")
+        self.timed_out = True
+        self.kill()
+
+    def _signal(self, signum):
+        """Send a signal to the command's process group."""
+        try:
+            os.killpg(self.process.pid, signum)
+        except (ProcessLookupError, PermissionError):
+            # the group is gone, or only has members we can't signal
+            pass
+
+    def kill(self):
+        """Terminate the command, forcefully if it does not exit in time."""
+        if self.process.poll() is not None:
+            return
+        self._signal(signal.SIGTERM)
+        try:
+            self.process.wait(self.kill_grace)
+        except subprocess.TimeoutExpired:
+            self._signal(signal.SIGKILL)
+
+    def check_returncode(self):
+        """Raise an exception if the command was killed or failed."""
+        if self.timed_out:
+            raise ScanTimeout(self.command, self.timeout, stderr=self.stderr)
+        if self.returncode:
+            logger.error(self.stderr)
+            raise subprocess.CalledProcessError(
+                self.returncode, self.command, stderr=self.stderr
+            )
+
+
+@contextmanager
+def scan_slot(slots, lock_dir, timeout=None):
+    """Limit the number of concurrent scans on this host.
+
+    Slots are claimed with file locks so that the limit is shared by all the
+    processes of a worker.  The lock is released automatically if the
+    process dies.
+
+    Arguments:
+    slots -- the number of concurrent scans allowed, None or 0 for no limit
+    lock_dir -- a directory to hold the slot lock files
+    timeout -- seconds to wait for a free slot before giving up
+
+    Yields the number of the acquired slot.
+    """
+    if not slots:
+        yield None
+        return
+    os.makedirs(lock_dir, exist_ok=True)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        for slot in range(slots):
+            lock_file = open(os.path.join(lock_dir, f"slot-{slot}.lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            try:
+                yield slot
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+            return
+        if deadline is not None and time.monotonic() > deadline:
+            raise SlotTimeout(f"no scan slot free after {timeout}s")
+        time.sleep(SLOT_POLL_SECONDS)
@@ -1,89 +1,467 @@
 """Port scanning Celery tasks."""
 
-import sys
 import ipaddress
-import subprocess
-from xml.etree.ElementTree import fromstring
+import os
+import re
+import tempfile
+from xml.etree.ElementTree import ParseError
 
-from celery import shared_task
+from celery import Task, chain, chord, current_app, group, shared_task
 from celery.utils.log import get_task_logger
-from xmljson import badgerfish as bf
+
+from .. import metrics
+from ..idempotent import IdempotentTask
+from .parser import iter_records
+from .process import ScanProcess, ScanTimeout, scan_slot
+from .timing import (discovery_class, discovery_options, port_scan_options,
+                     shared_profile)
 
 logger = get_task_logger(__name__)
 
-QUICK_PORTS = [443, 80, 1720, 22, 49152, 21, 53, 61001, 3479, 25, 62078, 3389,
-               8080, 8008, 8081, 9100, 8010, 4000, 1248, 248, 175, 8087, 9010,
-               9004, 8111, 4502, 10800, 7776, 2770, 9886]
+# maximum number of addresses handed to a single nmap discovery invocation
+MAX_BATCH_ADDRESSES = 4096
+# refuse to expand anything larger than this into batches (a /12 in IPv4)
+MAX_TARGET_ADDRESSES = 2 ** 20
+
+# nmap port specifications accepted from callers, e.g. '22,80,1024-2048'
+PORTS_RE = re.compile(r'^\d+(-\d+)?(,\d+(-\d+)?)*$')
+
+# default number of port range shards a host's port scan is split into
+DEFAULT_PORT_SHARDS = 8
+
+# custom task state used to publish nmap's progress
+PROGRESS_STATE = 'PROGRESS'
+# default number of scans that may run at once on a worker host
+DEFAULT_SCAN_SLOTS = 4
+# default directory for the scan slot lock files
+DEFAULT_SCAN_LOCK_DIR = os.path.join(
+    tempfile.gettempdir(), 'admiral-scan-slots')
+# default seconds a scan may run before it is killed (host timeout + margin)
+DEFAULT_SCAN_TIMEOUT = 150 * 60
+# default seconds a scan waits for a free slot; it must be finite, as the
+# execution lock of a scan task has to outlast the wait (see ScanTask)
+DEFAULT_SCAN_SLOT_TIMEOUT = 30 * 60
+
+# seconds an execution lock outlasts the scan timeout
+SCAN_LOCK_MARGIN = 5 * 60
+
+# options of the tasks that run nmap, use with a base of NmapTask
+SCAN_TASK_OPTIONS = {
+    'autoretry_for': (Exception,),
+    'retry_backoff': True,
+    'retry_jitter': True,
+    'retry_kwargs': {'max_retries': 3},
+    'bind': True,
+}
+
+
+def scan_settings(app):
+    """Read the scan process settings from the app configuration.
+
+    Returns a dict of keyword arguments for scan_slot and ScanProcess.
+    """
+    conf = app.conf
+    slot_timeout = conf.get('admiral_scan_slot_timeout')
+    if slot_timeout is None:
+        slot_timeout = DEFAULT_SCAN_SLOT_TIMEOUT
+    return {
+        'slots': conf.get('admiral_scan_slots', DEFAULT_SCAN_SLOTS),
+        'lock_dir': conf.get('admiral_scan_lock_dir', DEFAULT_SCAN_LOCK_DIR),
+        'slot_timeout': slot_timeout,
+        'timeout': conf.get('admiral_scan_timeout', DEFAULT_SCAN_TIMEOUT),
+    }
+
+
+class NmapTask(Task):
+    """A task that runs nmap, retried on failure except for timeouts.
+
+    A scan killed by the watchdog would only hit the same timeout again.
+    autoretry_for calls retry() with the exception, so the timeout is
+    raised from there; this works with every Celery version, unlike the
+    dont_autoretry_for option.
+    """
+
+    def retry(self, *args, exc=None, **kwargs):
+        """Retry the task, unless exc is a scan timeout."""
+        if isinstance(exc, ScanTimeout):
+            raise exc
+        return super().retry(*args, exc=exc, **kwargs)
+
+
+class ScanTask(NmapTask, IdempotentTask):
+    """An idempotent scan task whose lock outlasts the scan.
+
+    The lock is held for the worker's scan timeout, plus the time allowed
+    to wait for a scan slot, so a duplicate can never start while the scan
+    is still running.
+    """
+
+    def execution_lock_ttl(self):
+        """Return the seconds an execution lock is held at most."""
+        settings = scan_settings(self.app)
+        timeout = settings['timeout'] or DEFAULT_SCAN_TIMEOUT
+        return int(timeout + settings['slot_timeout'] + SCAN_LOCK_MARGIN)
+
+
+def scan_it(command, task=None):
+    """Execute an nmap command, parsing its XML output as it is produced.
+
+    The command must write XML to stdout (`-oX -`).  The command waits for
+    a free scan slot on this worker before it starts.  If a task is passed,
+    nmap's `--stats-every` progress is published as the task's PROGRESS
+    state.
+
+    Yields compact host records, see admiral.port_scan.parser.
+    """
+    settings = scan_settings(task.app if task is not None else current_app)
+    with scan_slot(settings['slots'], settings['lock_dir'],
+                   settings['slot_timeout']):
+        process = ScanProcess(command, settings['timeout'])
+        try:
+            with metrics.timer('admiral_nmap_runtime_seconds'), process:
+                host_count = 0
+                for kind, record in iter_records(process.stdout):
+                    if kind == 'host':
+                        host_count += 1
+                        yield record
+                    elif kind == 'progress':
+                        logger.info(f'Scan progress: {record}')
+                        publish_progress(task, dict(record, hosts=host_count))
+        except ParseError:
+            # a killed or failed nmap leaves truncated output, report that
+            process.check_returncode()
+            raise
+
+
+def publish_progress(task, meta):
+    """Publish scan progress as a custom task state."""
+    if task is None or task.request.id is None:
+        # not running as a worker task, there is nowhere to publish to
+        return
+    task.update_state(state=PROGRESS_STATE, meta=meta)
+
+
+def parse_targets(targets):
+    """Validate scan targets and group them by IP version.
+
+    Arguments:
+    targets -- a collection of IP address or CIDR block strings
 
+    Returns a dict mapping IP version (4 or 6) to a list of collapsed networks.
+    """
+    networks = {4: [], 6: []}
+    for target in targets:
+        network = ipaddress.ip_network(target, strict=False)
+        if network.num_addresses > MAX_TARGET_ADDRESSES:
+            raise ValueError(f'target network is too large to scan: {target}')
+        networks[network.version].append(network)
+    return {version: list(ipaddress.collapse_addresses(nets))
+            for version, nets in networks.items() if nets}
+
+
+def batch_targets(targets, max_addresses=MAX_BATCH_ADDRESSES):
+    """Split scan targets into batches suitable for a single nmap invocation.
 
-def run_it(command):
-    """External command execution helper.
+    Networks larger than max_addresses are split into subnets, and smaller
+    networks are packed together.  A batch never mixes IP versions.
 
-    Returns the completed process.
+    Arguments:
+    targets -- a collection of IP address or CIDR block strings
+    max_addresses -- the maximum number of addresses in a batch
+
+    Returns a list of batches, each a list of CIDR block strings.
     """
-    logger.info(f'Executing command: {command}')
+    # subnets are split on a power of two boundary
+    prefix_bits = max(max_addresses.bit_length() - 1, 0)
+    batches = []
+    for networks in parse_targets(targets).values():
+        batch, size = [], 0
+        for network in networks:
+            if network.num_addresses > max_addresses:
+                subnets = network.subnets(
+                    new_prefix=network.max_prefixlen - prefix_bits)
+            else:
+                subnets = [network]
+            for subnet in subnets:
+                if batch and size + subnet.num_addresses > max_addresses:
+                    batches.append(batch)
+                    batch, size = [], 0
+                batch.append(str(subnet))
+                size += subnet.num_addresses
+        if batch:
+            batches.append(batch)
+    return batches
+
 
-    try:
-        if sys.version_info >= (3, 7):
-            # TODO: Cannot use capture_output until we are using python 3.7
-            # (which currently breaks celery)
-            completed_process = subprocess.run(
-                command, capture_output=True, shell=True, check=True)
-        else:
-            # python 3.6 version
-            completed_process = subprocess.run(
-                command, stderr=subprocess.PIPE, stdout=subprocess.PIPE,
-                shell=True, check=True)
-    except subprocess.CalledProcessError as err:
-        # TODO: Log stderr since it is empty when reconstituted on the far side
-        # Perhaps this will work in python 3.7
-        logger.error(err.stderr.decode())
-        raise err
+def up_scan_command(targets, version, profile=None, exclude=()):
+    """Build an nmap host discovery command line for targets.
 
-    return completed_process
+    Arguments:
+    targets -- a list of ipaddress address or network objects
+    version -- the IP version of the targets
+    profile -- a host profile to adapt timing and probes to, see timing
+    exclude -- a list of ipaddress network objects to skip
+    """
+    # nnap requires a `-6` option if the target is IPv6
+    # TODO: ICMP Timestamp and Address Mask pings are only valid for IPv4.
+    v6_flag = '-6 ' if version == 6 else ''
+    target_list = ' '.join(str(i) for i in targets)
+    exclude_flag = f'--exclude {",".join(str(i) for i in exclude)} ' \
+        if exclude else ''
+    return f'sudo nmap {v6_flag}{target_list} {exclude_flag}' \
+           f'--stats-every 60 -oX - -n -sn {discovery_options(profile)}'
 
 
-@shared_task(autoretry_for=(Exception,),
-             retry_backoff=True,
-             retry_jitter=True,
-             retry_kwargs={'max_retries': 3})
-def up_scan(ip):
+@shared_task(base=ScanTask, **SCAN_TASK_OPTIONS)
+def up_scan(self, ip, profile=None):
     """Run a quick scan to determin if IP is up.
 
-    Returns nmap output in JSON format.
+    Arguments:
+    ip -- the IP address to scan
+    profile -- a host profile to adapt timing and probes to, see timing
+
+    Returns a compact host record, or None if the host did not respond.
     """
     # validate input
     valid_ip = ipaddress.ip_address(ip)
+    nmap_command = up_scan_command([valid_ip], valid_ip.version, profile)
+    up_host = None
+    for host in scan_it(nmap_command, self):
+        if host['state'] == 'up':
+            up_host = host
+    return up_host
+
+
+@shared_task(base=NmapTask, **SCAN_TASK_OPTIONS)
+def up_scan_batch(self, targets, profile=None, exclude=()):
+    """Run a quick scan to determine which hosts in a batch of targets are up.
+
+    A single nmap process is started for each IP version present in targets.
+    Use batch_targets() or up_scan_group() to size batches.
+
+    Arguments:
+    targets -- a list of IP address or CIDR block strings
+    profile -- a host profile shared by all the targets, see timing
+    exclude -- a list of IP address or CIDR block strings to skip
+
+    Returns a dict mapping the address of each host that is up to its
+    compact host record.
+    """
+    hosts = {}
+    excluded = parse_targets(exclude)
+    for version, networks in parse_targets(targets).items():
+        nmap_command = up_scan_command(
+            networks, version, profile, excluded.get(version, ()))
+        for host in scan_it(nmap_command, self):
+            if host['state'] == 'up':
+                hosts[host['address']] = host
+    return hosts
+
+
+def up_scan_group(targets, max_addresses=MAX_BATCH_ADDRESSES, profiles=None):
+    """Create a group of batched discovery scans covering targets.
+
+    Hosts with a profile are batched with the other hosts of their
+    discovery class, see timing.discovery_class, and excluded from the
+    default batches.  So a network is covered by a handful of batches
+    however many of its hosts have profiles.
+
+    Arguments:
+    targets -- a collection of IP address or CIDR block strings
+    max_addresses -- the maximum number of addresses scanned by one task
+    profiles -- a dict mapping addresses to host profiles, see timing
+
+    Returns a celery group of up_scan_batch signatures.
+    """
+    networks = [network for nets in parse_targets(targets).values()
+                for network in nets]
+    classes = {}
+    for address, profile in (profiles or {}).items():
+        ip = ipaddress.ip_address(address)
+        if any(ip in network for network in networks):
+            host_class = discovery_class(profile)
+            if host_class is not None:
+                classes.setdefault(host_class, {})[address] = profile
+
+    signatures = []
+    known = []
+    for class_profiles in classes.values():
+        profile, addresses = shared_profile(class_profiles)
+        signatures.extend(up_scan_batch.s(batch, profile)
+                          for batch in batch_targets(addresses, max_addresses))
+        known.extend(addresses)
+    for batch in batch_targets(targets, max_addresses):
+        batch_networks = [ipaddress.ip_network(i) for i in batch]
+        exclude = [address for address in known
+                   if any(ipaddress.ip_address(address) in network
+                          for network in batch_networks)]
+        signatures.append(up_scan_batch.s(batch, exclude=exclude))
+    return group(signatures)
+
+
+def port_ranges(shards, first=1, last=65535):
+    """Split a port range into contiguous shards of near equal size.
+
+    Returns a list of nmap port range strings, e.g. ['1-32768', '32769-65535'].
+    """
+    count = last - first + 1
+    shards = max(1, min(shards, count))
+    ranges = []
+    start = first
+    for shard in range(shards):
+        end = start + count // shards - 1 + (1 if shard < count % shards else 0)
+        ranges.append(f'{start}-{end}')
+        start = end + 1
+    return ranges
+
+
+def port_scan_command(ip, ports='1-65535', os_detect=True, profile=None):
+    """Build an nmap service scan command line.
+
+    Arguments:
+    ip -- an ipaddress address object
+    ports -- an nmap port specification
+    os_detect -- run OS detection and reverse DNS resolution
+    profile -- a host profile to adapt timing to, see timing
+    """
+    if not PORTS_RE.match(ports):
+        raise ValueError(f'invalid port specification: {ports}')
     # nnap requires a `-6` option if the target is IPv6
-    # TODO: ICMP Timestamp and Address Mask pings are only valid for IPv4.
-    v6_flag = '-6 ' if valid_ip.version == 6 else ''
-    ports = ','.join(str(i) for i in QUICK_PORTS)
-    nmap_command = f'sudo nmap {v6_flag}{valid_ip} --stats-every 60 -oX - ' \
-                   f'-n -sn -T4 --host-timeout 15m -PE -PP -PS{ports}'
-    completed_process = run_it(nmap_command)
-    xml_string = completed_process.stdout.decode()
-    data = bf.data(fromstring(xml_string))
-    return data
-
-
-@shared_task(autoretry_for=(Exception,),
-             retry_backoff=True,
-             retry_jitter=True,
-             retry_kwargs={'max_retries': 3})
-def port_scan(ip):
+    v6_flag = '-6 ' if ip.version == 6 else ''
+    # OS detection and name resolution only need to be done once per host
+    host_flags = '-R -O ' if os_detect else '-n '
+    return f'sudo nmap {v6_flag}{ip} --stats-every 60 -oX - ' \
+           f'{host_flags}-Pn {port_scan_options(profile)} ' \
+           f'--defeat-rst-ratelimit -sV -sS -p{ports}'
+
+
+def merge_host_records(records):
+    """Merge the host records from several scans of the same host.
+
+    Arguments:
+    records -- a list of compact host records, None entries are ignored
+
+    Returns a single compact host record, or None if there were no records.
+    """
+    records = [record for record in records if record]
+    if not records:
+        return None
+    merged = dict(records[0])
+    hostnames = []
+    ports = {}
+    for record in records:
+        for hostname in record.get('hostnames', []):
+            if hostname not in hostnames:
+                hostnames.append(hostname)
+        for port in record.get('ports', []):
+            ports[(port['protocol'], port['port'])] = port
+        if record.get('state') == 'up':
+            merged['state'] = 'up'
+            merged['reason'] = record.get('reason')
+        for key in ('os', 'times'):
+            if key in record and key not in merged:
+                merged[key] = record[key]
+    merged['hostnames'] = hostnames
+    merged['ports'] = [ports[key] for key in sorted(ports)]
+    return merged
+
+
+@shared_task(base=ScanTask, **SCAN_TASK_OPTIONS)
+def port_scan(self, ip, profile=None):
     """Run a scan to determine what services are responding.
 
-    Returns nmap output in JSON format.
+    Arguments:
+    ip -- the IP address to scan
+    profile -- a host profile to adapt timing to, see timing
+
+    Returns a compact host record, or None if nmap did not report the host.
     """
     # validate input
     valid_ip = ipaddress.ip_address(ip)
-    # nnap requires a `-6` option if the target is IPv6
-    v6_flag = '-6 ' if valid_ip.version == 6 else ''
-    nmap_command = f'sudo nmap {v6_flag}{valid_ip} --stats-every 60 -oX - ' \
-                   '-R -Pn -T4 --host-timeout 120m --max-scan-delay 5ms ' \
-                   '--max-retries 2 --min-parallelism 32 ' \
-                   '--defeat-rst-ratelimit -sV -O -sS -p1-65535'
-    completed_process = run_it(nmap_command)
-    xml_string = completed_process.stdout.decode()
-    data = bf.data(fromstring(xml_string))
-    return data
+    nmap_command = port_scan_command(valid_ip, profile=profile)
+    hosts = list(scan_it(nmap_command, self))
+    return hosts[0] if hosts else None
+
+
+@shared_task(base=ScanTask, **SCAN_TASK_OPTIONS)
+def port_scan_shard(self, ip, ports, os_detect=False, profile=None):
+    """Scan a range of a host's ports to determine what services respond.
+
+    Arguments:
+    ip -- the IP address to scan
+    ports -- an nmap port specification, see port_ranges()
+    os_detect -- also run OS detection and reverse DNS resolution
+    profile -- a host profile to adapt timing to, see timing
+
+    Returns a compact host record, or None if nmap did not report the host.
+    """
+    # validate input
+    valid_ip = ipaddress.ip_address(ip)
+    nmap_command = port_scan_command(valid_ip, ports, os_detect, profile)
+    hosts = list(scan_it(nmap_command, self))
+    return hosts[0] if hosts else None
+
+
+@shared_task
+def merge_port_scans(records):
+    """Merge the results of a host's port scan shards into one host record."""
+    return merge_host_records(records)
+
+
+def sharded_port_scan(ip, shards=DEFAULT_PORT_SHARDS, profile=None):
+    """Create a workflow that scans a host's ports in parallel shards.
+
+    OS detection is only run with the first shard.
+
+    Returns a celery chord that results in a single compact host record.
+    """
+    return chord(
+        (port_scan_shard.s(ip, ports, os_detect=(i == 0), profile=profile)
+         for i, ports in enumerate(port_ranges(shards))),
+        merge_port_scans.s())
+
+
+@shared_task(bind=True)
+def scan_live_hosts(self, discovery_results, shards=DEFAULT_PORT_SHARDS,
+                    profiles=None):
+    """Port scan every live host found by a discovery scan.
+
+    This task replaces itself with a sharded port scan of each host.
+
+    Arguments:
+    discovery_results -- a list of up_scan_batch results
+    shards -- the number of port range shards per host
+    profiles -- a dict mapping addresses to host profiles, see timing
+
+    Returns a list of compact host records, one for each live host.
+    """
+    addresses = sorted({address for hosts in discovery_results
+                        for address in hosts})
+    logger.info(f'Port scanning {len(addresses)} live hosts')
+    if not addresses:
+        return []
+    profiles = profiles or {}
+    return self.replace(group(
+        sharded_port_scan(address, shards, profiles.get(address))
+        for address in addresses))
+
+
+def discover_and_scan(targets, shards=DEFAULT_PORT_SHARDS,
+                      max_addresses=MAX_BATCH_ADDRESSES, profiles=None):
+    """Create a two-phase discovery and port scan workflow.
+
+    Targets are discovered in batches, and only the hosts that are up are
+    port scanned.  Each host's port space is split into shards that are
+    spread across the scanner workers, then merged back into one record.
+    Hosts with a profile are scanned with timing adapted to the profile.
+
+    Arguments:
+    targets -- a collection of IP address or CIDR block strings
+    shards -- the number of port range shards per host
+    max_addresses -- the maximum number of addresses per discovery task
+    profiles -- a dict mapping addresses to host profiles, see timing
+
+    Returns a celery signature, call apply_async() to start it.
+    """
+    return chain(up_scan_group(targets, max_addresses, profiles),
+                 scan_live_hosts.s(shards=shards, profiles=profiles))
@@ -0,0 +1,244 @@
+"""Adaptive nmap timing options based on what we know about a host.
+
+A host profile is a dict learned from earlier scan results (see
+admiral.model.scan.ScanProfile):
+
+    {
+        "srtt": 71000,             # smoothed round trip time (microseconds)
+        "rttvar": 2000,            # round trip time variance (microseconds)
+        "ping_reason": "syn-ack",  # how the host last answered discovery
+        "probe_ports": [22, 80],   # open tcp ports that will answer a ping
+        "misses": 0,               # consecutive scans without a response
+        "timeouts": 0,             # consecutive scans that hit the host timeout
+    }
+
+Hosts are discovered in batches, so hosts with similar profiles are put in
+the same discovery class (see discovery_class) and share one profile for
+their batch (see shared_profile).  A shared profile lists every ping reply
+type of its hosts as "ping_reasons" instead of a single "ping_reason".
+
+Hosts without a profile are scanned with conservative defaults.  Hosts we
+know well get tight round trip timeouts, fewer retries, and only the probes
+that worked last time.  Hosts that have stopped responding get a short
+host timeout instead of tying up a scanner for the full default.
+"""
+
+from collections import Counter
+
+from ..util.profile import TIMEOUT_LIMIT, UNRESPONSIVE_MISSES
+
+# fmt: off
+QUICK_PORTS = [443, 80, 1720, 22, 49152, 21, 53, 61001, 3479, 25, 62078, 3389,
+               8080, 8008, 8081, 9100, 8010, 4000, 1248, 248, 175, 8087, 9010,
+               9004, 8111, 4502, 10800, 7776, 2770, 9886]
+# fmt: on
+
+# the number of quick ports probed when a host has stopped responding
+UNRESPONSIVE_PORTS = 5
+# bounds on the round trip timeouts derived from a profile (milliseconds)
+MIN_RTT_TIMEOUT = 50
+MAX_RTT_TIMEOUT = 1250
+# upper bounds of the expected round trip time tiers that discovery batches
+# are grouped by (microseconds); slower hosts, and hosts with an unknown
+# round trip time, share one more tier
+RTT_TIERS = (20000, 100000, 400000)
+# the discovery class of hosts that have stopped responding
+UNRESPONSIVE_CLASS = "unresponsive"
+# the maximum number of tcp ping probes shared by a discovery batch
+MAX_SHARED_PROBE_PORTS = len(QUICK_PORTS)
+
+DEFAULT_DISCOVERY_TIMING = "-T4 --host-timeout 15m"
+KNOWN_DISCOVERY_TIMING = "-T4 --host-timeout 2m --max-retries 1"
+UNRESPONSIVE_DISCOVERY_TIMING = "-T4 --host-timeout 1m --max-retries 0"
+DEFAULT_PORT_SCAN_TIMING = (
+    "-T4 --host-timeout 120m --max-scan-delay 5ms --min-parallelism 32"
+)
+TIMED_OUT_PORT_SCAN_TIMING = (
+    "-T4 --host-timeout 30m --max-scan-delay 5ms --min-parallelism 32"
+)
+
+# discovery status reasons, and the probe that produces them
+ICMP_ECHO_REASONS = ("echo-reply",)
+ICMP_TIMESTAMP_REASONS = ("timestamp-reply",)
+TCP_REASONS = ("syn-ack", "reset")
+
+
+def quick_port_flag(ports):
+    """Build a TCP SYN ping option for ports."""
+    return "-PS" + ",".join(str(int(i)) for i in ports)
+
+
+def is_unresponsive(profile):
+    """Determine if a host has stopped answering scans."""
+    return bool(profile) and profile.get("misses", 0) >= UNRESPONSIVE_MISSES
+
+
+def expected_rtt(profile):
+    """Estimate the longest round trip time of a host (microseconds).
+
+    Returns None if the host's timing is unknown.
+    """
+    if not profile or not profile.get("srtt"):
+        return None
+    # nmap uses the same srtt + 4 * rttvar estimate internally
+    return int(profile["srtt"] + 4 * (profile.get("rttvar") or 0))
+
+
+def rtt_options(profile):
+    """Build round trip timeout options from a host's observed timing.
+
+    Returns an option string, empty if the host's timing is unknown.
+    """
+    if expected_rtt(profile) is None:
+        return ""
+    expected = expected_rtt(profile) // 1000
+    initial = min(max(expected, MIN_RTT_TIMEOUT), MAX_RTT_TIMEOUT)
+    maximum = min(max(2 * expected, MIN_RTT_TIMEOUT), MAX_RTT_TIMEOUT)
+    return f"--initial-rtt-timeout {initial}ms --max-rtt-timeout {maximum}ms"
+
+
+def discovery_options(profile=None):
+    """Build nmap host discovery timing and probe options for a host.
+
+    Arguments:
+    profile -- a host profile dict, or None for an unknown host
+
+    Returns an option string.
+    """
+    if is_unresponsive(profile):
+        return (
+            f"{UNRESPONSIVE_DISCOVERY_TIMING} -PE "
+            f"{quick_port_flag(QUICK_PORTS[:UNRESPONSIVE_PORTS])}"
+        )
+    probes = []
+    if profile:
+        reasons = set(profile.get("ping_reasons") or [profile.get("ping_reason")])
+        if reasons.intersection(ICMP_ECHO_REASONS):
+            probes.append("-PE")
+        if reasons.intersection(ICMP_TIMESTAMP_REASONS):
+            probes.append("-PP")
+        if profile.get("probe_ports"):
+            probes.append(quick_port_flag(profile["probe_ports"]))
+        elif reasons.intersection(TCP_REASONS):
+            # we don't know which port answered, so try the usual suspects
+            probes.append(quick_port_flag(QUICK_PORTS))
+    if not probes:
+        return f"{DEFAULT_DISCOVERY_TIMING} -PE -PP {quick_port_flag(QUICK_PORTS)}"
+    options = [KNOWN_DISCOVERY_TIMING, rtt_options(profile)] + probes
+    return " ".join(option for option in options if option)
+
+
+def is_icmp(profile):
+    """Determine if a host answered discovery with an ICMP reply."""
+    return profile.get("ping_reason") in ICMP_ECHO_REASONS + ICMP_TIMESTAMP_REASONS
+
+
+def discovery_class(profile):
+    """Classify a host so that similar hosts share a discovery batch.
+
+    Hosts are classed as unresponsive, or by the tier of their expected
+    round trip time.  Hosts that we don't know how to ping are not
+    classed, and get the default discovery options.
+
+    Arguments:
+    profile -- a host profile dict, or None for an unknown host
+
+    Returns UNRESPONSIVE_CLASS, a tier number, or None.
+    """
+    if is_unresponsive(profile):
+        return UNRESPONSIVE_CLASS
+    if not profile or not (is_icmp(profile) or profile.get("probe_ports")):
+        return None
+    expected = expected_rtt(profile)
+    if expected is None:
+        return len(RTT_TIERS)
+    for tier, bound in enumerate(RTT_TIERS):
+        if expected <= bound:
+            return tier
+    return len(RTT_TIERS)
+
+
+def shared_probe_ports(port_sets, limit=MAX_SHARED_PROBE_PORTS):
+    """Choose a few tcp ports so that each host has one open among them.
+
+    Ports are chosen greedily, the port open on the most hosts that are
+    not yet covered first.
+
+    Arguments:
+    port_sets -- an iterable of sets of the open ports of each host
+    limit -- the maximum number of ports to choose
+
+    Returns a sorted list of ports.
+    """
+    uncovered = [ports for ports in port_sets if ports]
+    chosen = []
+    while uncovered and len(chosen) < limit:
+        counts = Counter(port for ports in uncovered for port in ports)
+        port = min(counts, key=lambda p: (-counts[p], p))
+        chosen.append(port)
+        uncovered = [ports for ports in uncovered if port not in ports]
+    return sorted(chosen)
+
+
+def shared_profile(profiles):
+    """Combine the profiles of a discovery class into one batch profile.
+
+    The shared profile has the timing of the slowest host, every ICMP ping
+    that a host answered, and a few tcp probe ports covering the other
+    hosts.  Hosts that none of the shared probes would reach are left out,
+    and should be discovered with the default options.
+
+    Arguments:
+    profiles -- a dict mapping the addresses of a discovery class to their
+        profiles
+
+    Returns (profile, addresses):
+        profile: the shared profile
+        addresses: a sorted list of the addresses the profile covers
+    """
+    if any(is_unresponsive(profile) for profile in profiles.values()):
+        return {"misses": UNRESPONSIVE_MISSES}, sorted(profiles)
+    port_sets = {
+        address: set(profile.get("probe_ports") or ())
+        for address, profile in profiles.items()
+        if not is_icmp(profile)
+    }
+    probe_ports = shared_probe_ports(port_sets.values())
+    covered = sorted(
+        address
+        for address in profiles
+        if address not in port_sets or port_sets[address].intersection(probe_ports)
+    )
+    reasons = {profiles[address].get("ping_reason") for address in covered}
+    shared = {
+        "ping_reasons": sorted(reason for reason in reasons if reason),
+        "probe_ports": probe_ports,
+    }
+    expected = [expected_rtt(profiles[address]) for address in covered]
+    if expected and None not in expected:
+        shared.update(srtt=max(expected), rttvar=0)
+    return shared, covered
+
+
+def port_scan_options(profile=None):
+    """Build nmap port scan timing options for a host.
+
+    Arguments:
+    profile -- a host profile dict, or None for an unknown host
+
+    Returns an option string.
+    """
+    if not profile:
+        return f"{DEFAULT_PORT_SCAN_TIMING} --max-retries 2"
+    if profile.get("timeouts", 0) >= TIMEOUT_LIMIT:
+        timing = TIMED_OUT_PORT_SCAN_TIMING
+    else:
+        timing = DEFAULT_PORT_SCAN_TIMING
+    # a steady link rarely needs more than one retransmission
+    steady = profile.get("srtt") and profile.get("rttvar", 0) <= profile["srtt"] // 2
+    retries = 1 if steady else 2
+    return " ".join(
+        option
+        for option in (timing, f"--max-retries {retries}", rtt_options(profile))
+        if option
+    )
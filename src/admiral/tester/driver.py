@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""admiral-load: Measure the overhead of Celery for admiral's workloads.
+
+Load tasks (see admiral.tester.tasks) are sent to the test workers as
+single tasks, groups, or chords, and the following are reported:
+
+- dispatch: how fast tasks can be published to the broker
+- latency: percentiles of the time from publishing a task, group, or chord
+  until its result is available to the caller
+- backend: how fast the results can be read back from the result backend
+
+Comparing runs with no work (the default) to runs with the CPU time and
+payload sizes of real tasks shows how much of a workload is overhead.
+
+Usage:
+  admiral-load [options] [single] [group] [chord]
+  admiral-load (-h | --help)
+
+Options:
+  -n --count=<count>          Number of tasks, groups, or chords [default: 1000]
+  -g --group-size=<size>      Tasks in each group or chord [default: 10]
+  -p --payload=<bytes>        Size of each task's argument [default: 0]
+  -r --result=<bytes>         Size of each task's result [default: 0]
+  -u --cpu=<seconds>          CPU time used by each task [default: 0]
+  -w --sleep=<seconds>        Time each task waits [default: 0]
+  -f --failure-rate=<rate>    Probability that a task fails [default: 0]
+  -t --timeout=<seconds>      Time to wait for results [default: 600]
+  -c --config=<file>          Read configuration from file.
+  -s --section=<section>      Configuration file section to use.
+"""
+
+import math
+import time
+
+from celery import chord, group
+from celery.result import ResultSet
+
+from .tasks import collect, load, make_payload
+
+
+def percentile(values, p):
+    """Return the p-th percentile (0-100) of values, by nearest rank."""
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def rate(count, seconds):
+    """Return count per second, or nan if no time was measured."""
+    return count / seconds if seconds else float("nan")
+
+
+class Run(object):
+    """Timings of a run of tasks, groups, or chords."""
+
+    def __init__(self, kind, size):
+        """Create an empty run of kind, with size tasks per unit."""
+        self.kind = kind
+        self.size = size
+        self.sent = {}
+        self.latencies = []
+        self.failures = 0
+        self.dispatch_time = 0.0
+        self.elapsed = 0.0
+
+    def received(self, result_id, value=None, failed=False):
+        """Record the arrival of a result."""
+        self.latencies.append(time.perf_counter() - self.sent[result_id])
+        if failed or isinstance(value, Exception):
+            self.failures += 1
+
+    def report(self):
+        """Return a one line summary of the run."""
+        count = len(self.sent)
+        tasks = count * self.size
+        ms = [latency * 1000 for latency in self.latencies]
+        return (
+            f"{self.kind:>6}: {count} x {self.size} tasks, "
+            f"dispatch {rate(tasks, self.dispatch_time):.0f} tasks/s, "
+            f"throughput {rate(tasks, self.elapsed):.0f} tasks/s, "
+            f"latency p50 {percentile(ms, 50):.1f}ms "
+            f"p90 {percentile(ms, 90):.1f}ms "
+            f"p99 {percentile(ms, 99):.1f}ms "
+            f"max {max(ms, default=float('nan')):.1f}ms, "
+            f"{self.failures} failed"
+        )
+
+
+def wait_for(run, results, timeout, on_result=None):
+    """Wait for results, recording each as it arrives.
+
+    on_result is called with the id and value of each result, by default
+    recording it in run.
+    """
+    result_set = ResultSet(results)
+
+    def received(task_id, value):
+        run.received(task_id, value)
+
+    on_result = on_result or received
+    if result_set.supports_native_join:
+        # results arrive in the order they complete
+        result_set.join_native(callback=on_result, propagate=False, timeout=timeout)
+    else:
+        result_set.join(callback=on_result, propagate=False, timeout=timeout)
+
+
+def run_single(count, task_options, timeout):
+    """Send count single tasks and wait for their results."""
+    run = Run("single", 1)
+    results = []
+    start = time.perf_counter()
+    for _ in range(count):
+        sent = time.perf_counter()
+        result = load.apply_async(kwargs=task_options)
+        run.sent[result.id] = sent
+        results.append(result)
+    run.dispatch_time = time.perf_counter() - start
+    wait_for(run, results, timeout)
+    run.elapsed = time.perf_counter() - start
+    return run, results
+
+
+def wait_for_groups(run, group_results, timeout):
+    """Wait for groups, recording each when its last task's result arrives."""
+    group_of = {}
+    remaining = {}
+    failed = set()
+    for group_result in group_results:
+        remaining[group_result.id] = len(group_result.results)
+        for result in group_result.results:
+            group_of[result.id] = group_result.id
+
+    def on_result(task_id, value):
+        group_id = group_of[task_id]
+        if isinstance(value, Exception):
+            failed.add(group_id)
+        remaining[group_id] -= 1
+        if not remaining[group_id]:
+            run.received(group_id, failed=group_id in failed)
+
+    tasks = [
+        result for group_result in group_results for result in group_result.results
+    ]
+    wait_for(run, tasks, timeout, on_result)
+
+
+def run_group(count, size, task_options, timeout):
+    """Send count groups of size tasks and wait for each to finish."""
+    run = Run("group", size)
+    group_results = []
+    start = time.perf_counter()
+    for _ in range(count):
+        sent = time.perf_counter()
+        result = group(load.s(**task_options) for _ in range(size)).apply_async()
+        run.sent[result.id] = sent
+        group_results.append(result)
+    run.dispatch_time = time.perf_counter() - start
+    wait_for_groups(run, group_results, timeout)
+    run.elapsed = time.perf_counter() - start
+    return run, [r for g in group_results for r in g.results]
+
+
+def run_chord(count, size, task_options, timeout):
+    """Send count chords of size tasks and wait for their callbacks."""
+    run = Run("chord", size)
+    results = []
+    start = time.perf_counter()
+    for _ in range(count):
+        sent = time.perf_counter()
+        result = chord(load.s(**task_options) for _ in range(size))(collect.s())
+        run.sent[result.id] = sent
+        results.append(result)
+    run.dispatch_time = time.perf_counter() - start
+    wait_for(run, results, timeout)
+    run.elapsed = time.perf_counter() - start
+    return run, results
+
+
+def backend_throughput(app, task_ids, batch_size=100):
+    """Measure how fast results can be read from the result backend.
+
+    Results are read in batches with the backend's mget, bypassing the
+    caches of the backend and of AsyncResult.
+
+    Returns (results per second, bytes per second).
+    """
+    backend = app.backend
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    total_bytes = 0
+    start = time.perf_counter()
+    for i in range(0, len(keys), batch_size):
+        for value in backend.mget(keys[i : i + batch_size]):
+            if value is not None:
+                backend.decode(value)
+                total_bytes += len(value)
+    elapsed = time.perf_counter() - start
+    return len(keys) / elapsed, total_bytes / elapsed
+
+
+def main():
+    """Start of program."""
+    from docopt import docopt
+
+    from ..celery import configure_app
+
+    args = docopt(__doc__)
+    app = configure_app(args["--config"], args["--section"])
+    count = int(args["--count"])
+    size = int(args["--group-size"])
+    timeout = float(args["--timeout"])
+    task_options = {
+        "payload": make_payload(int(args["--payload"])),
+        "result_size": int(args["--result"]),
+        "cpu_time": float(args["--cpu"]),
+        "sleep_time": float(args["--sleep"]),
+        "failure_rate": float(args["--failure-rate"]),
+    }
+    kinds = [kind for kind in ("single", "group", "chord") if args[kind]]
+
+    for kind in kinds or ["single", "group", "chord"]:
+        if kind == "single":
+            run, results = run_single(count, task_options, timeout)
+        elif kind == "group":
+            run, results = run_group(count, size, task_options, timeout)
+        else:
+            run, results = run_chord(count, size, task_options, timeout)
+        print(run.report())
+        if hasattr(app.backend, "mget"):
+            rate, byte_rate = backend_throughput(app, [r.id for r in results])
+            print(
+                f"{'':>6}  backend read {rate:.0f} results/s, "
+                f"{byte_rate / 2 ** 20:.1f} MiB/s"
+            )
+        for result in results:
+            result.forget()
+
+
+if __name__ == "__main__":
+    main()
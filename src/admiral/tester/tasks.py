@@ -1,13 +1,40 @@
-"""Test Celery tasks."""
+"""Test Celery tasks.
+
+The load tasks generate synthetic work of a configurable size, so that the
+overhead of the broker, workers, and result backend can be measured apart
+from real work.  See admiral.tester.driver.
+"""
+
+import base64
+import os
+import random
+import time
 
 from celery import shared_task
 from celery.utils.log import get_task_logger
-import time
-import random
 
 logger = get_task_logger(__name__)
 
 
+class LoadFailure(Exception):
+    """A failure raised on purpose by a load task."""
+
+
+def make_payload(size):
+    """Create an incompressible string of size characters."""
+    if not size:
+        return ''
+    raw = os.urandom(size * 3 // 4 + 3)
+    return base64.b64encode(raw)[:size].decode()
+
+
+def burn_cpu(seconds):
+    """Keep the CPU busy for seconds of process time."""
+    deadline = time.process_time() + seconds
+    while time.process_time() < deadline:
+        pass
+
+
 @shared_task
 def add(x, y):
     """Add two numbers."""
@@ -56,3 +83,32 @@ def xsum(numbers):
     """Sum a list of numbers."""
     logger.info('Summing {0}'.format(numbers))
     return sum(numbers)
+
+
+@shared_task
+def load(payload=None, result_size=0, cpu_time=0, sleep_time=0,
+         failure_rate=0):
+    """Do a configurable amount of synthetic work.
+
+    Arguments:
+    payload -- an argument of any size, to load the broker; it is ignored
+    result_size -- the size of the string to return, to load the backend
+    cpu_time -- seconds of CPU time to use
+    sleep_time -- seconds to wait, like a task waiting on the network
+    failure_rate -- the probability of raising LoadFailure
+
+    Returns a string of result_size characters.
+    """
+    burn_cpu(cpu_time)
+    if sleep_time:
+        time.sleep(sleep_time)
+    if random.random() < failure_rate:
+        raise LoadFailure('Failing on purpose')
+    return make_payload(result_size)
+
+
+@shared_task
+def collect(results):
+    """Summarize the results of a chord of load tasks."""
+    return {'count': len(results),
+            'bytes': sum(len(r) for r in results if r)}
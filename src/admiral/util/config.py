@@ -1,11 +1,10 @@
 """Configuration utility functions."""
 
-import yaml
-from mongoengine import connect
-
 
 def load_config(filename="/run/secrets/config.yml"):
     """Load a configuration file."""
+    import yaml
+
     print(f"Reading configuration from {filename}")
     with open(filename, "r") as stream:
         config = yaml.load(stream, Loader=yaml.FullLoader)
@@ -14,6 +13,9 @@ def load_config(filename="/run/secrets/config.yml"):
 
 def connect_from_config(config=None):
     """Create connections from a confguration."""
+    # imported here so that importing admiral.util doesn't load mongoengine
+    from mongoengine import connect
+
     if not config:
         config = load_config()
     connections = config["connections"]
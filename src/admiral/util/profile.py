@@ -0,0 +1,10 @@
+"""Limits shared by host scan profiles and the scans they shape.
+
+The model (admiral.model.scan) counts misses and timeouts up to these
+limits, and the scan timing (admiral.port_scan.timing) acts on them.
+"""
+
+# consecutive misses before a host is considered unresponsive
+UNRESPONSIVE_MISSES = 3
+# consecutive host timeouts before a port scan is cut short
+TIMEOUT_LIMIT = 2
@@ -1,4 +1,5 @@
 """Setup environment for Celery task server."""
+
 from setuptools import setup, find_packages  # noqa
 
 install_requires = [
@@ -8,7 +9,6 @@ install_requires = [
     "PyYAML >= 3.12",
     "schedule >= 0.4.2",
     "requests >= 2.21.0",
-    "xmljson >= 0.2.0",
     "cryptography >= 2.4.2",
     "dnspython",
     "python-dateutil >= 2.7.5",
@@ -18,6 +18,13 @@ install_requires = [
 
 tests_require = ["pytest == 4.1.1", "mock == 2.0.0", "mongomock == 3.15.0"]
 
+extras_require = {
+    # optional columnar formats for admiral.export
+    "export": ["pyarrow >= 1.0.0"],
+}
+# everything needed to run all the tests, including the optional formats
+extras_require["dev"] = tests_require + extras_require["export"]
+
 setup(
     name="admiral",
     version="0.0.1",
@@ -26,10 +33,16 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
-    entry_points={"console_scripts": ["admiral=admiral.celery:main"]},
+    entry_points={
+        "console_scripts": [
+            "admiral=admiral.celery:main",
+            "admiral-load=admiral.tester.driver:main",
+        ]
+    },
     license="LICENSE.txt",
     description="The Admiral",
     # long_description=open('README.md').read(),
     install_requires=install_requires + tests_require,
+    extras_require=extras_require,
     # tests_require=tests_require  # TODO get pip install -e to pickup tests_require
 )
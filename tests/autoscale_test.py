@@ -0,0 +1,81 @@
+#!/usr/bin/env pytest -vs
+"""Tests for queue driven worker autoscaling."""
+
+import threading
+import time
+
+from celery import Celery
+
+from admiral.autoscale import QueueAutoscaler, desired_concurrency
+
+
+class FakeWorker(object):
+    """The parts of a worker used by the autoscaler."""
+
+    def __init__(self, **conf):
+        """Create a worker of an app with conf."""
+        self.app = Celery(set_as_current=False)
+        self.app.conf.update(conf)
+
+
+class RecordingAutoscaler(QueueAutoscaler):
+    """An autoscaler with a fixed queue depth, recording who reads it."""
+
+    def queue_depth(self):
+        """Return a fixed depth, noting the reading thread."""
+        self.readers = getattr(self, "readers", []) + [threading.current_thread()]
+        return 7
+
+
+class TestDesiredConcurrency:
+    """Test sizing the pool for the observed demand."""
+
+    def test_idle(self):
+        """Test that an idle worker shrinks to its minimum."""
+        assert desired_concurrency(0, 0, 0, 8, 2, 16) == 2
+
+    def test_reserved(self):
+        """Test Celery's policy when nothing is queued."""
+        assert desired_concurrency(0, 5, 0, 8, 2, 16) == 5
+
+    def test_queued_holds(self):
+        """Test that queued work within the target wait holds the pool."""
+        assert desired_concurrency(100, 1, 10, 8, 2, 16, target_wait=30) == 8
+
+    def test_queued_grows(self):
+        """Test that a long wait grows the pool in proportion."""
+        assert desired_concurrency(100, 4, 45, 4, 1, 16, target_wait=30) == 6
+
+    def test_growth_limited(self):
+        """Test that growth is limited per decision and by the maximum."""
+        assert desired_concurrency(100, 4, 600, 4, 1, 16, target_wait=30) == 8
+        assert desired_concurrency(100, 4, 600, 12, 1, 16, target_wait=30) == 16
+
+    def test_queued_from_zero(self):
+        """Test that a pool scaled to nothing starts when work arrives."""
+        assert desired_concurrency(3, 0, 0, 0, 0, 4) == 1
+        assert desired_concurrency(3, 0, 60, 1, 0, 4, target_wait=30) == 2
+
+
+class TestQueueAutoscaler:
+    """Test the autoscaler's use of the worker's settings."""
+
+    def test_scan_slots(self):
+        """Test that the pool never grows past the scan slots."""
+        worker = FakeWorker(admiral_scan_slots=8)
+        autoscaler = QueueAutoscaler(None, 16, 2, worker=worker)
+        assert autoscaler.max_concurrency == 8
+        assert autoscaler.min_concurrency == 2
+        autoscaler = QueueAutoscaler(None, 16, 2, worker=FakeWorker())
+        assert autoscaler.max_concurrency == 16
+
+    def test_depth_in_background(self):
+        """Test that the broker is not read on the calling thread."""
+        autoscaler = RecordingAutoscaler(None, 16, 2, worker=FakeWorker())
+        autoscaler.queued
+        deadline = time.monotonic() + 5
+        while autoscaler.queued != 7 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        autoscaler._monitor.stop()
+        assert autoscaler.queued == 7
+        assert threading.current_thread() not in autoscaler.readers
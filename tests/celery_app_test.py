@@ -0,0 +1,78 @@
+#!/usr/bin/env pytest -vs
+"""Tests for the Celery app configuration.
+
+These run in a separate interpreter so that the app they create does not
+become the current app of the test session.
+"""
+
+import os
+import subprocess
+import sys
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), "..", "secrets", "admiral.yml")
+
+
+def run_python(code, **env):
+    """Run python code in a new interpreter and return its stdout."""
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=dict(os.environ, **env),
+        check=True,
+    )
+    return completed.stdout.decode()
+
+
+class TestConfigureApp:
+    """Test lazy app configuration."""
+
+    def test_import_is_lazy(self):
+        """Test that importing the app doesn't read config or load tasks."""
+        output = run_python(
+            "import sys\n"
+            "import admiral.celery\n"
+            "print(sorted(m for m in ('admiral.certs.tasks', 'cryptography', "
+            "'mongoengine') if m in sys.modules))\n",
+            ADMIRAL_CONFIG_FILE="/nonexistent/admiral.yml",
+        )
+        assert output.strip().endswith("[]")
+        assert "Reading configuration" not in output
+
+    def test_import_keeps_current_app(self):
+        """Test that importing the app doesn't make it the current app."""
+        output = run_python(
+            "from celery import current_app\n"
+            "import admiral.celery\n"
+            "print(current_app.main)\n"
+            "admiral.celery.configure_app()\n"
+            "print(current_app.main)\n",
+            ADMIRAL_CONFIG_FILE="/nonexistent/admiral.yml",
+        )
+        assert output.split()[-2:] == ["default", "admiral"]
+
+    def test_config_on_use(self):
+        """Test that the configuration is applied when it is first used."""
+        output = run_python(
+            "from admiral.celery import configure_app\n"
+            "app = configure_app()\n"
+            "print(app.conf.task_default_queue)\n"
+            "assert configure_app() is app\n",
+            ADMIRAL_CONFIG_FILE=CONFIG_FILE,
+            ADMIRAL_CONFIG_SECTION="scanner-worker",
+        )
+        assert output.count("Reading configuration") == 1
+        assert output.strip().endswith("cyhy_scanner_work")
+
+    def test_autodiscovery_on_finalize(self):
+        """Test that only the configured task modules are imported."""
+        output = run_python(
+            "import sys\n"
+            "from admiral.celery import celery\n"
+            "celery.loader.import_default_modules()\n"
+            "print(sorted(m for m in sys.modules if m.endswith('.tasks') "
+            "and m.startswith('admiral')))\n",
+            ADMIRAL_CONFIG_FILE=CONFIG_FILE,
+            ADMIRAL_CONFIG_SECTION="scanner-worker",
+        )
+        assert output.strip().endswith("['admiral.port_scan.tasks']")
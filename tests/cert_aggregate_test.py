@@ -0,0 +1,100 @@
+#!/usr/bin/env pytest -vs
+"""Tests for certificate aggregate documents."""
+
+from datetime import datetime, timedelta
+
+from mongoengine import context_managers
+import pytest
+
+from admiral.model import Agency, Cert, CertAggregate, Domain
+
+NOW = datetime(2020, 6, 1, 12)
+ISSUER = "CN=Example CA 1.0,O=Example Inc."
+
+
+def make_cert(log_id, subjects, expires_in, issuer=ISSUER):
+    """Create a certificate document."""
+    cert = Cert(
+        log_id=log_id,
+        serial=f"{log_id:x}",
+        issuer=issuer,
+        not_before=NOW - timedelta(days=30),
+        not_after=NOW + timedelta(days=expires_in),
+        sct_or_not_before=NOW - timedelta(days=30),
+        sct_exists=True,
+        pem="-",
+    )
+    cert.subjects = subjects
+    return cert
+
+
+@pytest.fixture(scope="class", autouse=True)
+def connection():
+    """Create connections for tests to use."""
+    from mongoengine import connect
+
+    connect(host="mongomock://localhost", alias="default")
+    Domain(domain="aggregate.gov", agency=Agency(id="AGG", name="Aggregates")).save()
+    Domain(domain="other-aggregate.gov", agency=Agency(id="AGG")).save()
+
+
+class TestCertAggregates:
+    """Certificate aggregate tests."""
+
+    certs = [
+        (make_cert(9001, ["www.aggregate.gov", "aggregate.gov"], 10), False),
+        (make_cert(9002, ["mail.aggregate.gov"], 100), False),
+        (make_cert(9003, ["old.aggregate.gov"], -5, "CN=Old CA"), False),
+        (make_cert(9004, ["www.other-aggregate.gov"], 20), False),
+        (make_cert(9005, ["www.aggregate.gov"], 10), True),
+    ]
+
+    def check(self):
+        """Check the aggregates of the certificates above."""
+        domain = CertAggregate.for_domain("aggregate.gov").summary(now=NOW)
+        assert domain == {
+            "certs": 3,
+            "precerts": 1,
+            "valid": 2,
+            "expiring_soon": 1,
+            "issuers": {ISSUER: 2, "CN=Old CA": 1},
+        }
+        agency = CertAggregate.for_agency("AGG").summary(now=NOW)
+        assert agency["certs"] == 4
+        assert agency["expiring_soon"] == 2
+        assert agency["issuers"][ISSUER] == 3
+
+    def test_add_certs(self):
+        """Test that new certificates are counted."""
+        assert CertAggregate.add_certs(self.certs, now=NOW) == 3
+        self.check()
+        assert CertAggregate.for_domain("unknown.gov") is None
+
+    def test_rebuild(self):
+        """Test that rebuilding gives the same aggregates."""
+        for cert, is_precert in self.certs:
+            if is_precert:
+                with context_managers.switch_collection(Cert, "precerts"):
+                    cert.save()
+            else:
+                cert.save()
+        # aggregates from before the rebuild are replaced, not added to
+        CertAggregate.add_certs(self.certs, now=NOW)
+        CertAggregate.rebuild(now=NOW)
+        self.check()
+        collections = CertAggregate._get_db().list_collection_names()
+        assert "cert_aggregates_rebuild" not in collections
+
+    def test_past_days(self):
+        """Test that only days from now onward are kept."""
+        later = NOW + timedelta(days=50)
+        CertAggregate.add_certs(
+            [(make_cert(9006, ["www.past-aggregate.gov"], 10), False)], now=NOW
+        )
+        CertAggregate.add_certs(
+            [(make_cert(9007, ["past-aggregate.gov"], 60), False)], now=later
+        )
+        aggregate = CertAggregate.for_domain("past-aggregate.gov")
+        assert list(aggregate.expiring) == [(NOW + timedelta(60)).strftime("%Y-%m-%d")]
+        assert aggregate.summary(now=later)["certs"] == 2
+        assert aggregate.summary(now=later)["valid"] == 1
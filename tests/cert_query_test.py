@@ -0,0 +1,150 @@
+#!/usr/bin/env pytest -vs
+"""Tests for certificate window queries."""
+
+from datetime import datetime, timedelta
+import json
+import os
+
+from mongoengine import connect, context_managers
+import pytest
+
+from admiral.model import Agency, Cert, Domain
+from admiral.model.cert import DEFAULT_PAGE_SIZE, MIN_CURSOR_BATCH_SIZE
+
+NOW = datetime(2020, 6, 1, 12)
+
+
+def make_cert(log_id, subjects, expires_in, logged_ago=30):
+    """Create a certificate document."""
+    cert = Cert(
+        log_id=log_id,
+        serial=f"{log_id:x}",
+        issuer="CN=Query CA",
+        not_before=NOW - timedelta(days=logged_ago),
+        not_after=NOW + timedelta(days=expires_in),
+        sct_or_not_before=NOW - timedelta(days=logged_ago),
+        sct_exists=True,
+        pem="-",
+    )
+    cert.subjects = subjects
+    return cert
+
+
+@pytest.fixture(scope="module", autouse=True)
+def connection():
+    """Create connections and certificates for tests to use."""
+    connect(host="mongomock://localhost", alias="default")
+    Domain(domain="query.gov", agency=Agency(id="QRY", name="Queries")).save()
+    Domain(domain="other-query.gov", agency=Agency(id="QRY")).save()
+    Domain(domain="unrelated-query.gov", agency=Agency(id="UNR")).save()
+    make_cert(8001, ["www.query.gov"], 5).save()
+    make_cert(8002, ["mail.query.gov"], 5).save()
+    make_cert(8003, ["Query.gov"], 50, logged_ago=2).save()
+    make_cert(8004, ["www.other-query.gov"], 10, logged_ago=1).save()
+    make_cert(8005, ["www.unrelated-query.gov"], 5).save()
+    make_cert(8006, ["old.query.gov"], -1).save()
+    with context_managers.switch_collection(Cert, "precerts"):
+        make_cert(8007, ["www.query.gov"], 5).save()
+
+
+def log_ids(certs):
+    """Return the log ids of certificates."""
+    return [cert.log_id for cert in certs]
+
+
+class TestCertQueries:
+    """Certificate window query tests."""
+
+    def test_indexes(self):
+        """Test that date queries are covered by compound indexes."""
+        specs = [index["fields"] for index in Cert._meta["index_specs"]]
+        for field in ("not_after", "sct_or_not_before"):
+            assert [("trimmed_subjects", 1), (field, 1), ("_id", 1)] in specs
+
+    def test_expiring(self):
+        """Test finding certificates that expire in a window."""
+        certs = Cert.objects.for_domains("query.gov").expiring(NOW, NOW + timedelta(30))
+        assert sorted(log_ids(certs)) == [8001, 8002]
+
+    def test_issued_since(self):
+        """Test finding certificates logged since a time."""
+        since = NOW - timedelta(days=3)
+        certs = Cert.objects.for_domains("QUERY.GOV", "other-query.gov")
+        assert sorted(log_ids(certs.issued_since(since))) == [8003, 8004]
+        until = NOW - timedelta(days=1)
+        assert log_ids(certs.issued_since(since, until)) == [8003]
+
+    def test_for_agency(self):
+        """Test finding the certificates of an agency."""
+        certs = Cert.objects.for_agency("QRY").expiring(NOW, NOW + timedelta(30))
+        assert sorted(log_ids(certs)) == [8001, 8002, 8004]
+        assert Cert.objects.for_agency("NONE").count() == 0
+
+    def test_precerts(self):
+        """Test querying the precertificates collection."""
+        with context_managers.switch_collection(Cert, "precerts"):
+            certs = Cert.objects.for_agency("QRY").expiring(NOW, NOW + timedelta(30))
+            assert log_ids(certs) == [8007]
+
+    def test_page(self):
+        """Test paging through certificates in expiry order."""
+        queryset = Cert.objects.for_agency("QRY")
+        pages = []
+        cursor = None
+        while True:
+            certs, cursor = queryset.page(after=cursor, size=2)
+            pages.append(log_ids(certs))
+            if cursor is None:
+                break
+        # ties on not_after are ordered by log id
+        assert pages == [[8006, 8001], [8002, 8004], [8003]]
+
+    def test_page_issued(self):
+        """Test paging through certificates in the order they were logged."""
+        queryset = Cert.objects.for_domains("query.gov")
+        certs, cursor = queryset.page(size=10, field="sct_or_not_before")
+        assert log_ids(certs) == [8001, 8002, 8006, 8003]
+        assert cursor is None
+
+    def test_page_duplicates(self):
+        """Test that a certificate found for several domains is paged once."""
+        queryset = Cert.objects.for_domains("query.gov", "QUERY.GOV")
+        certs, cursor = queryset.page(size=3)
+        assert log_ids(certs) == [8006, 8001, 8002]
+        certs, cursor = queryset.page(after=cursor, size=3)
+        assert log_ids(certs) == [8003]
+        assert cursor is None
+
+    def test_page_queries(self):
+        """Test that each domain is paged with an equality on the index."""
+        queryset = Cert.objects.for_agency("QRY").expiring(NOW, NOW + timedelta(30))
+        queries = queryset.page_queries(after=(NOW, 8001), field="not_after")
+        assert len(queries) == 2
+        for query in queries:
+            assert isinstance(query._query["$and"][0]["trimmed_subjects"], str)
+            assert query._ordering == [("not_after", 1), ("_id", 1)]
+            assert query._batch_size == DEFAULT_PAGE_SIZE // 2
+
+    def test_page_fan_out(self):
+        """Test that a page of many domains fetches small batches."""
+        domains = [f"fan-out-{i}.gov" for i in range(500)]
+        queries = Cert.objects.for_domains(*domains).page_queries(size=100)
+        assert len(queries) == 500
+        assert {query._batch_size for query in queries} == {MIN_CURSOR_BATCH_SIZE}
+
+    def test_page_explain(self):
+        """Test that pages are read in index order, without a sort.
+
+        mongomock has no query planner, so this runs against the MongoDB
+        server at the URL in ADMIRAL_TEST_MONGODB.
+        """
+        url = os.environ.get("ADMIRAL_TEST_MONGODB")
+        if not url:
+            pytest.skip("needs a MongoDB server, set ADMIRAL_TEST_MONGODB")
+        connect(host=url, alias="explain")
+        with context_managers.switch_db(Cert, "explain"):
+            Cert.ensure_indexes()
+            queryset = Cert.objects.for_domains("query.gov", "other-query.gov")
+            for query in queryset.page_queries(after=(NOW, 8001)):
+                plan = query.explain()["queryPlanner"]["winningPlan"]
+                assert '"SORT"' not in json.dumps(plan, default=str)
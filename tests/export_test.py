@@ -0,0 +1,140 @@
+#!/usr/bin/env pytest -vs
+"""Tests for certificate exports."""
+
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+
+from mongoengine import context_managers
+import pytest
+
+from admiral.export import (
+    ArrowWriter,
+    FIELDS,
+    NDJSONWriter,
+    ParquetWriter,
+    PEM_FIELD,
+    export_collection,
+    last_exported,
+)
+from admiral.model import Cert
+
+NOW = datetime(2020, 6, 1, 12)
+
+
+def make_cert(log_id, logged_ago):
+    """Create a certificate document."""
+    cert = Cert(
+        log_id=log_id,
+        serial=f"{log_id:x}",
+        issuer="CN=Export CA",
+        not_before=NOW - timedelta(days=logged_ago),
+        not_after=NOW + timedelta(days=90),
+        sct_or_not_before=NOW - timedelta(days=logged_ago),
+        sct_exists=True,
+        pem="-----BEGIN CERTIFICATE-----",
+    )
+    cert.subjects = [f"www{log_id}.export.gov"]
+    return cert
+
+
+def drop_certs():
+    """Remove all certificates and precertificates."""
+    Cert.drop_collection()
+    with context_managers.switch_collection(Cert, "precerts"):
+        Cert.drop_collection()
+
+
+@pytest.fixture(scope="module")
+def database():
+    """Create a database of certificates to export."""
+    from mongoengine import connect
+
+    connect(host="mongomock://localhost", alias="default")
+    drop_certs()
+    for log_id in range(7001, 7006):
+        make_cert(log_id, logged_ago=7006 - log_id).save()
+    with context_managers.switch_collection(Cert, "precerts"):
+        make_cert(7101, logged_ago=1).save()
+    yield
+    drop_certs()
+
+
+def read_ndjson(paths):
+    """Return the rows in gzipped NDJSON files."""
+    rows = []
+    for path in paths:
+        with gzip.open(path, "rt") as f:
+            rows.extend(json.loads(line) for line in f)
+    return rows
+
+
+@pytest.mark.usefixtures("database")
+class TestExport:
+    """Certificate export tests."""
+
+    def test_ndjson(self, tmpdir):
+        """Test exporting in chunks without PEMs."""
+        paths = export_collection(
+            "certs", str(tmpdir), NDJSONWriter(), chunk_size=2, batch_size=1
+        )
+        assert [os.path.basename(p) for p in paths] == [
+            "certs-000000007001-000000007002.ndjson.gz",
+            "certs-000000007003-000000007004.ndjson.gz",
+            "certs-000000007005-000000007005.ndjson.gz",
+        ]
+        rows = read_ndjson(paths)
+        assert [row["log_id"] for row in rows] == [7001, 7002, 7003, 7004, 7005]
+        assert list(rows[0]) == list(FIELDS)
+        assert rows[0]["not_after"] == (NOW + timedelta(days=90)).isoformat()
+        assert rows[0]["trimmed_subjects"] == ["export.gov"]
+
+    def test_pem(self, tmpdir):
+        """Test exporting PEMs when asked for."""
+        writer = NDJSONWriter(FIELDS + (PEM_FIELD,))
+        paths = export_collection("precerts", str(tmpdir), writer)
+        rows = read_ndjson(paths)
+        assert [row["log_id"] for row in rows] == [7101]
+        assert rows[0]["pem"] == "-----BEGIN CERTIFICATE-----"
+
+    def test_incremental(self, tmpdir):
+        """Test exporting only new certificates."""
+        directory = str(tmpdir)
+        assert last_exported(directory, "certs") is None
+        export_collection("certs", directory, NDJSONWriter(), since_id=7002)
+        assert last_exported(directory, "certs") == 7005
+        assert last_exported(directory, "precerts") is None
+        assert export_collection("certs", directory, NDJSONWriter(), 7005) == []
+
+        paths = export_collection(
+            "certs", directory, NDJSONWriter(), since=NOW - timedelta(days=2)
+        )
+        assert [row["log_id"] for row in read_ndjson(paths)] == [7004, 7005]
+
+    def test_arrow(self, tmpdir):
+        """Test exporting memory-mappable Arrow files."""
+        pa = pytest.importorskip("pyarrow")
+
+        paths = export_collection(
+            "certs", str(tmpdir), ArrowWriter(), chunk_size=3, batch_size=2
+        )
+        assert len(paths) == 2
+        with pa.memory_map(paths[0]) as source:
+            reader = pa.ipc.open_file(source)
+            assert reader.num_record_batches == 2
+            table = reader.read_all()
+        assert table.column_names == list(FIELDS)
+        assert table.column("log_id").to_pylist() == [7001, 7002, 7003]
+
+    def test_parquet(self, tmpdir):
+        """Test exporting Parquet files."""
+        pytest.importorskip("pyarrow")
+        import pyarrow.parquet as pq
+
+        paths = export_collection("certs", str(tmpdir), ParquetWriter(), batch_size=2)
+        table = pq.read_table(paths[0])
+        assert table.num_rows == 5
+        # each batch is written as a row group
+        assert pq.ParquetFile(paths[0]).num_row_groups == 3
+        assert table.column("subjects").to_pylist()[0] == ["www7001.export.gov"]
@@ -0,0 +1,147 @@
+#!/usr/bin/env pytest -vs
+"""Tests for task deduplication."""
+
+from celery import Celery, states
+from celery.exceptions import Ignore
+import pytest
+
+from admiral.idempotent import LOCK_PREFIX, IdempotentTask
+from admiral.port_scan.tasks import DEFAULT_SCAN_SLOT_TIMEOUT, ScanTask, scan_settings
+
+
+class FakeRedis(object):
+    """The subset of a Redis client used for deduplication."""
+
+    def __init__(self):
+        """Create an empty store."""
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        """Set a key, only if it does not exist when nx is set."""
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def get(self, key):
+        """Get the value of a key."""
+        return self.data.get(key)
+
+    def delete(self, key):
+        """Delete a key."""
+        self.data.pop(key, None)
+
+
+@pytest.fixture
+def task():
+    """Create an idempotent task in an app that is not current."""
+    app = Celery(set_as_current=False, broker="memory://", backend="cache+memory://")
+
+    @app.task(base=IdempotentTask, bind=True, name="idempotent_test.fetch")
+    def fetch(self, id, source=None):
+        return f"cert {id}"
+
+    fetch._redis = FakeRedis()
+    return fetch
+
+
+class TestSubmission:
+    """Test that duplicate submissions attach to the first."""
+
+    def test_duplicate(self, task):
+        """Test that the same arguments give the same task."""
+        first = task.delay(1)
+        assert task.delay(1).id == first.id
+        assert task.apply_async(args=(2,)).id != first.id
+
+    def test_same_call(self, task):
+        """Test that the same call spelled differently is a duplicate."""
+        first = task.delay(1)
+        assert task.delay(1, source=None).id == first.id
+        assert task.delay(id=1).id == first.id
+        assert task.delay(1, "crt.sh").id != first.id
+
+    def test_callbacks(self, task):
+        """Test that a submission with callbacks is not a duplicate."""
+        first = task.delay(1)
+        callback = task.app.signature("idempotent_test.callback")
+        assert task.apply_async(args=(1,), link=callback).id != first.id
+        assert task.apply_async(args=(1,), link_error=callback).id != first.id
+        assert task.delay(1).id == first.id
+
+    def test_failed(self, task):
+        """Test that a failed submission is replaced."""
+        first = task.delay(1)
+        task.backend.mark_as_failure(first.id, ValueError("failed"))
+        second = task.delay(1)
+        assert second.id != first.id
+        assert task.delay(1).id == second.id
+
+
+class TestExecution:
+    """Test the execution lock."""
+
+    def run(self, task, task_id, *args):
+        """Run a task as a worker would."""
+        task.push_request(id=task_id, is_eager=False, args=args, kwargs={})
+        try:
+            return task(*args)
+        finally:
+            task.pop_request()
+
+    def test_lock_released(self, task):
+        """Test that the lock is only held while running."""
+        assert self.run(task, "a", 1) == "cert 1"
+        assert task.redis.data == {}
+
+    def test_locked(self, task):
+        """Test that a duplicate waits, without retrying, while locked."""
+        key = LOCK_PREFIX + task.idempotency_key((1,), {})
+        task.redis.set(key, "a")
+        sent = []
+        task.apply_async = lambda *args, **options: sent.append(options)
+        # held for longer than max_retries * lock_retry_countdown
+        for _ in range(task.max_retries + 2):
+            with pytest.raises(Ignore):
+                self.run(task, "b", 1)
+        assert len(sent) == task.max_retries + 2
+        assert {o["task_id"] for o in sent} == {"b"}
+        assert {o["retries"] for o in sent} == {0}
+        assert {o["countdown"] for o in sent} == {task.lock_retry_countdown}
+        # the task holding the lock can run, e.g. when redelivered
+        assert self.run(task, "a", 1) == "cert 1"
+
+    def test_already_succeeded(self, task):
+        """Test that a duplicate returns the result of an earlier run."""
+        first = task.delay(1)
+        task.backend.mark_as_done(first.id, "earlier cert 1")
+        assert self.run(task, "b", 1) == "earlier cert 1"
+        assert first.state == states.SUCCESS
+
+
+class TestScanLock:
+    """Test the execution lock of scan tasks."""
+
+    def test_lock_outlasts_scan(self):
+        """Test that a scan's lock is held longer than the scan may run."""
+        app = Celery(set_as_current=False)
+        app.conf.admiral_scan_timeout = 1800
+        app.conf.admiral_scan_slot_timeout = 600
+
+        @app.task(base=ScanTask, name="idempotent_test.scan")
+        def scan(ip, profile=None):
+            return ip
+
+        assert scan.execution_lock_ttl() > 1800 + 600
+
+    def test_default_slot_timeout(self):
+        """Test that waiting for a slot is limited when it isn't configured."""
+        app = Celery(set_as_current=False)
+        app.conf.admiral_scan_timeout = 1800
+
+        @app.task(base=ScanTask, name="idempotent_test.default_scan")
+        def scan(ip, profile=None):
+            return ip
+
+        assert scan_settings(app)["slot_timeout"] == DEFAULT_SCAN_SLOT_TIMEOUT
+        assert scan.execution_lock_ttl() > 1800 + DEFAULT_SCAN_SLOT_TIMEOUT
@@ -0,0 +1,88 @@
+#!/usr/bin/env pytest -vs
+"""Tests for task performance metrics."""
+
+import json
+import os
+
+from celery import Celery
+
+from admiral import metrics
+from admiral.metrics import REGISTRY, Registry, write_metrics
+
+
+class TestRegistry:
+    """Test collecting and rendering metrics."""
+
+    def test_histogram(self):
+        """Test that observations land in cumulative buckets."""
+        registry = Registry()
+        labels = {"task": "t", "queue": "q"}
+        for value in (0.003, 0.2, 7200):
+            registry.observe("admiral_nmap_runtime_seconds", value, labels)
+        histogram = registry.get("admiral_nmap_runtime_seconds", **labels)
+        assert histogram.count == 3
+        assert histogram.counts[0] == 1
+        assert histogram.counts[-2] == 2
+        assert histogram.counts[-1] == 3
+
+    def test_render(self):
+        """Test the Prometheus text format."""
+        registry = Registry()
+        registry.increment(
+            "admiral_http_requests_total", 2, {"task": 'a"b', "status": "200"}
+        )
+        registry.observe("admiral_http_ttfb_seconds", 0.1, {"task": "t"})
+        text = registry.render({"process": "p"})
+        assert (
+            'admiral_http_requests_total{process="p",status="200",task="a\\"b"} 2'
+            in text
+        )
+        assert (
+            'admiral_http_ttfb_seconds_bucket{le="0.1",process="p",task="t"} 1' in text
+        )
+        assert 'admiral_http_ttfb_seconds_count{process="p",task="t"} 1' in text
+        assert "# TYPE admiral_http_ttfb_seconds histogram" in text
+
+    def test_write(self, tmpdir):
+        """Test writing the metrics files."""
+        registry = Registry()
+        registry.increment("admiral_tasks_total", 1, {"state": "SUCCESS"})
+        write_metrics(str(tmpdir), registry)
+        names = sorted(os.listdir(tmpdir))
+        assert [os.path.splitext(name)[1] for name in names] == [".json", ".prom"]
+        with open(tmpdir.join(names[0])) as f:
+            dump = json.load(f)
+        assert dump["metrics"]["admiral_tasks_total"][0]["value"] == 1
+
+
+class TestSignals:
+    """Test metrics collected from task signals."""
+
+    def test_task(self):
+        """Test that runs and observations are labeled with the task."""
+        app = Celery(set_as_current=False)
+        app.conf.task_always_eager = True
+
+        @app.task(name="metrics_test.work")
+        def work():
+            metrics.observe("admiral_nmap_runtime_seconds", 1.5)
+
+        @app.task(name="metrics_test.fail")
+        def fail():
+            raise ValueError("failed")
+
+        work.apply()
+        fail.apply()
+        labels = {"task": "metrics_test.work", "queue": "none"}
+        assert REGISTRY.get("admiral_nmap_runtime_seconds", **labels).sum == 1.5
+        assert REGISTRY.get("admiral_task_runtime_seconds", **labels).count == 1
+        assert REGISTRY.get("admiral_tasks_total", state="SUCCESS", **labels) == 1
+        assert (
+            REGISTRY.get(
+                "admiral_tasks_total",
+                task="metrics_test.fail",
+                queue="none",
+                state="FAILURE",
+            )
+            == 1
+        )
@@ -0,0 +1,130 @@
+#!/usr/bin/env pytest -vs
+"""Tests for the nmap XML parser."""
+
+import io
+import subprocess
+
+import pytest
+
+from admiral.port_scan.parser import iter_hosts, iter_records
+from admiral.port_scan.tasks import scan_it
+
+DISCOVERY_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<nmaprun scanner="nmap" args="nmap -sn 192.0.2.0/30" version="7.70">
+<host><status state="up" reason="echo-reply" reason_ttl="54"/>
+<address addr="192.0.2.1" addrtype="ipv4"/>
+<hostnames></hostnames>
+<times srtt="4000" rttvar="5000" to="100000"/>
+</host>
+<host><status state="up" reason="syn-ack" reason_ttl="54"/>
+<address addr="00:00:5E:00:53:01" addrtype="mac"/>
+<address addr="192.0.2.2" addrtype="ipv4"/>
+<hostnames></hostnames>
+<times srtt="3000" rttvar="5000" to="100000"/>
+</host>
+<runstats><finished time="1549000000" elapsed="2.10" exit="success"/>
+<hosts up="2" down="2" total="4"/>
+</runstats>
+</nmaprun>
+"""
+
+PORT_SCAN_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<nmaprun scanner="nmap" args="nmap -sV -O -p1-65535 45.33.32.156" version="7.70">
+<scaninfo type="syn" protocol="tcp" numservices="65535" services="1-65535"/>
+<verbose level="0"/>
+<debugging level="0"/>
+<host starttime="1549000000" endtime="1549000600">
+<status state="up" reason="user-set" reason_ttl="0"/>
+<address addr="45.33.32.156" addrtype="ipv4"/>
+<hostnames>
+<hostname name="scanme.nmap.org" type="PTR"/>
+</hostnames>
+<ports><extraports state="closed" count="65531">
+<extrareasons reason="resets" count="65531"/>
+</extraports>
+<port protocol="tcp" portid="22"><state state="open" reason="syn-ack" reason_ttl="53"/>
+<service name="ssh" product="OpenSSH" version="6.6.1p1 Ubuntu 2ubuntu2.11"
+ extrainfo="Ubuntu Linux; protocol 2.0" ostype="Linux" method="probed" conf="10">
+<cpe>cpe:/a:openbsd:openssh:6.6.1p1</cpe><cpe>cpe:/o:linux:linux_kernel</cpe>
+</service></port>
+<port protocol="tcp" portid="80"><state state="open" reason="syn-ack" reason_ttl="53"/>
+<service name="http" product="Apache httpd" version="2.4.7" method="probed" conf="10"/>
+</port>
+<port protocol="tcp" portid="9929"><state state="filtered" reason="no-response" reason_ttl="0"/>
+<service name="nping-echo" method="table" conf="3"/></port>
+</ports>
+<os><portused state="open" proto="tcp" portid="22"/>
+<osmatch name="Linux 4.15" accuracy="95" line="1">
+<osclass type="general purpose" vendor="Linux" osfamily="Linux" accuracy="95"/>
+</osmatch>
+<osmatch name="Linux 3.10" accuracy="90" line="2"/>
+</os>
+<times srtt="71000" rttvar="2000" to="100000"/>
+</host>
+<runstats><finished time="1549000600" elapsed="600.00" exit="success"/>
+<hosts up="1" down="0" total="1"/>
+</runstats>
+</nmaprun>
+"""
+
+
+class TestParser:
+    """Test nmap XML parsing."""
+
+    def test_discovery(self):
+        """Test parsing a discovery scan into host records."""
+        hosts = list(iter_hosts(io.BytesIO(DISCOVERY_XML)))
+        assert [h["address"] for h in hosts] == ["192.0.2.1", "192.0.2.2"]
+        assert hosts[0]["state"] == "up"
+        assert hosts[0]["reason"] == "echo-reply"
+        assert hosts[0]["times"] == {"srtt": 4000, "rttvar": 5000, "to": 100000}
+        assert "ports" not in hosts[0]
+
+    def test_port_scan(self):
+        """Test parsing a service scan into a compact host record."""
+        (host,) = iter_hosts(io.BytesIO(PORT_SCAN_XML))
+        assert host["hostnames"] == ["scanme.nmap.org"]
+        assert [p["port"] for p in host["ports"]] == [22, 80, 9929]
+        ssh = host["ports"][0]
+        assert ssh["state"] == "open"
+        assert ssh["service"] == "ssh"
+        assert ssh["product"] == "OpenSSH"
+        assert ssh["cpe"] == [
+            "cpe:/a:openbsd:openssh:6.6.1p1",
+            "cpe:/o:linux:linux_kernel",
+        ]
+        assert "method" not in ssh
+        assert host["ports"][2]["state"] == "filtered"
+        assert host["os"] == [
+            {"name": "Linux 4.15", "accuracy": 95},
+            {"name": "Linux 3.10", "accuracy": 90},
+        ]
+
+    def test_runstats(self):
+        """Test that run statistics are reported after the hosts."""
+        kinds = [kind for kind, _ in iter_records(io.BytesIO(DISCOVERY_XML))]
+        assert kinds == ["host", "host", "runstats"]
+        _, summary = list(iter_records(io.BytesIO(DISCOVERY_XML)))[-1]
+        assert summary == {
+            "exit": "success",
+            "elapsed": 2.1,
+            "up": 2,
+            "down": 2,
+            "total": 4,
+        }
+
+
+class TestScanIt:
+    """Test streaming command execution."""
+
+    def test_streaming(self, tmp_path):
+        """Test parsing the output of a command."""
+        xml_file = tmp_path / "scan.xml"
+        xml_file.write_bytes(PORT_SCAN_XML)
+        hosts = list(scan_it(f"cat {xml_file}"))
+        assert hosts[0]["address"] == "45.33.32.156"
+
+    def test_failure(self):
+        """Test that a failing command raises an error."""
+        with pytest.raises(subprocess.CalledProcessError):
+            list(scan_it("echo oops >&2; exit 3"))
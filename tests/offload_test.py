@@ -0,0 +1,128 @@
+#!/usr/bin/env pytest -vs
+"""Tests for offloading large results."""
+
+from datetime import datetime, timedelta
+import os
+
+from celery import Celery, states
+from celery.backends.cache import CacheBackend
+import mongomock
+import mongomock.gridfs
+import pytest
+
+from admiral.offload import FileStore, GridFSStore, OffloadMixin, is_reference
+
+
+class OffloadCacheBackend(OffloadMixin, CacheBackend):
+    """In-memory result backend that offloads large results."""
+
+
+@pytest.fixture
+def backend(tmpdir):
+    """Create an offloading backend with a small threshold."""
+    app = Celery(set_as_current=False)
+    app.conf.admiral_offload_url = f"file://{tmpdir}"
+    app.conf.admiral_offload_threshold = 1024
+    return OffloadCacheBackend(app=app, backend="memory://")
+
+
+class TestOffload:
+    """Test storing and reading offloaded results."""
+
+    def test_small_result(self, backend, tmpdir):
+        """Test that small results stay in the result backend."""
+        backend.store_result("small", ["example.gov"], states.SUCCESS)
+        assert backend.get_task_meta("small")["result"] == ["example.gov"]
+        assert os.listdir(tmpdir) == []
+
+    def test_large_result(self, backend, tmpdir):
+        """Test that large results are replaced by a reference."""
+        domains = [f"host{i}.example.gov" for i in range(1000)]
+        backend.store_result("large", domains, states.SUCCESS)
+        stored = backend.decode(backend.get(backend.get_key_for_task("large")))
+        assert is_reference(stored["result"])
+        assert len(os.listdir(tmpdir)) == 1
+        assert backend.get_task_meta("large")["result"] == domains
+
+    def test_failure_not_offloaded(self, backend, tmpdir):
+        """Test that exceptions are stored as usual."""
+        backend.mark_as_failure("failed", ValueError("x" * 2000))
+        meta = backend.get_task_meta("failed")
+        assert isinstance(meta["result"], ValueError)
+        assert os.listdir(tmpdir) == []
+
+    def test_forget(self, backend, tmpdir):
+        """Test that forgetting a result removes its payload."""
+        backend.store_result("forgotten", ["x" * 2000], states.SUCCESS)
+        assert len(os.listdir(tmpdir)) == 1
+        backend.forget("forgotten")
+        assert os.listdir(tmpdir) == []
+        backend.forget("forgotten")
+
+    def test_disabled(self, backend, tmpdir):
+        """Test that no store is used without an offload url."""
+        backend.offload_url = None
+        result = "x" * 2000
+        assert backend.offload(result, states.SUCCESS) is result
+
+
+class TestFileStore:
+    """Test the file side store."""
+
+    def test_round_trip(self, tmpdir):
+        """Test storing, reading, and deleting a payload."""
+        store = FileStore(str(tmpdir))
+        store.put("key", b"payload")
+        assert store.get("key") == b"payload"
+        store.delete("key")
+        store.delete("key")
+        assert os.listdir(tmpdir) == []
+
+    def test_purge(self, tmpdir):
+        """Test that only old payloads are purged."""
+        store = FileStore(str(tmpdir))
+        store.put("old", b"old")
+        store.put("new", b"new")
+        os.utime(tmpdir.join("old"), (0, 0))
+        store.purge(3600)
+        assert os.listdir(tmpdir) == ["new"]
+
+
+class TestGridFSStore:
+    """Test the GridFS side store."""
+
+    @pytest.fixture
+    def store(self):
+        """Create a store in a mock mongo server, expiring after an hour."""
+        mongomock.gridfs.enable_gridfs_integration()
+        with mongomock.patch(servers=(("mongo", 27017),)):
+            yield GridFSStore("mongodb://mongo:27017/certs", expires=3600)
+
+    def test_round_trip(self, store):
+        """Test storing, reading, and deleting a payload."""
+        store.put("key", b"payload")
+        assert store.get("key") == b"payload"
+        store.delete("key")
+        assert store.files.count_documents({}) == 0
+        assert store.chunks.count_documents({}) == 0
+
+    def test_expires_changed(self, store):
+        """Test that a new TTL replaces the TTL indexes."""
+        GridFSStore("mongodb://mongo:27017/certs", expires=60)
+        for documents in (store.files, store.chunks):
+            ttls = {
+                name: index["expireAfterSeconds"]
+                for name, index in documents.index_information().items()
+                if "expireAfterSeconds" in index
+            }
+            assert ttls == {"expires_60": 60}
+
+    def test_expired(self, store):
+        """Test that expired payloads are removed by the TTL indexes."""
+        store.put("old", b"old")
+        store.put("new", b"new")
+        old = {"uploadDate": datetime.utcnow() - timedelta(hours=2)}
+        store.files.update_one({"_id": "old"}, {"$set": old})
+        store.chunks.update_many({"files_id": "old"}, {"$set": old})
+        assert [f["_id"] for f in store.files.find()] == ["new"]
+        assert [c["files_id"] for c in store.chunks.find()] == ["new"]
@@ -0,0 +1,161 @@
+#!/usr/bin/env pytest -vs
+"""Tests for scan result documents."""
+
+import pytest
+
+from admiral.model import Host, HostChange, ScanRun
+
+
+def host_record(address, ports, state="up"):
+    """Create a compact host record with open tcp ports."""
+    return {
+        "address": address,
+        "state": state,
+        "hostnames": [],
+        "ports": [
+            {"port": port, "protocol": "tcp", "state": "open", "service": service}
+            for port, service in ports
+        ],
+    }
+
+
+def first_scan():
+    """Store a port scan of a host running ssh and https."""
+    ScanRun(kind="port").save_results(
+        [host_record("192.0.2.1", [(22, "ssh"), (443, "https")])]
+    )
+
+
+@pytest.fixture(scope="class", autouse=True)
+def connection():
+    """Create connections for tests to use."""
+    from mongoengine import connect
+
+    connect(host="mongomock://localhost", alias="default")
+
+
+@pytest.fixture(autouse=True)
+def empty_database():
+    """Start each test without any scan results."""
+    for document in (Host, HostChange, ScanRun):
+        document.drop_collection()
+
+
+class TestScanResults:
+    """Scan result document tests."""
+
+    def test_first_scan(self):
+        """Test that everything about a new host is a change."""
+        scan_run = ScanRun(kind="port")
+        changes = scan_run.save_results(
+            [host_record("192.0.2.1", [(22, "ssh"), (443, "https")])]
+        )
+        assert [c.change for c in changes] == ["host_up", "port_opened", "port_opened"]
+        host = Host.objects.get(ip="192.0.2.1")
+        assert [s.port for s in host.services] == [22, 443]
+        assert scan_run.host_count == 1
+        assert scan_run.change_count == 3
+
+    def test_unchanged_scan(self):
+        """Test that a rescan with the same results stores nothing."""
+        first_scan()
+        scan_run = ScanRun(kind="port")
+        changes = scan_run.save_results(
+            [host_record("192.0.2.1", [(22, "ssh"), (443, "https")])]
+        )
+        assert changes == []
+        assert HostChange.objects(scan_run=scan_run.id).count() == 0
+        assert Host.objects.get(ip="192.0.2.1").last_scan != scan_run.id
+
+    def test_changed_scan(self):
+        """Test that only differences are recorded."""
+        first_scan()
+        scan_run = ScanRun(kind="port")
+        changes = scan_run.save_results(
+            [host_record("192.0.2.1", [(22, "openssh"), (80, "http")])]
+        )
+        summary = {(c.change, c.port) for c in changes}
+        assert summary == {
+            ("port_opened", 80),
+            ("port_closed", 443),
+            ("service_changed", 22),
+        }
+        changed = HostChange.objects.get(scan_run=scan_run.id, port=22)
+        assert changed.before["name"] == "ssh"
+        assert changed.after["name"] == "openssh"
+
+    def test_hostnames_and_os(self):
+        """Test that new hostnames and OS are stored without a change."""
+        record = host_record("192.0.2.1", [(22, "ssh")])
+        record.update(hostnames=["a.example"], os=[{"name": "Linux"}])
+        ScanRun(kind="port").save_results([record])
+        record.update(hostnames=["b.example"], os=[{"name": "Windows"}])
+        scan_run = ScanRun(kind="port")
+        assert scan_run.save_results([record]) == []
+        host = Host.objects.get(ip="192.0.2.1")
+        assert host.hostnames == ["b.example"]
+        assert host.os == "Windows"
+        assert host.last_scan == scan_run.id
+
+    def test_discovery_keeps_services(self):
+        """Test that discovery scans don't wipe out known services."""
+        first_scan()
+        scan_run = ScanRun(kind="discovery")
+        record = {"address": "192.0.2.1", "state": "up", "hostnames": []}
+        assert scan_run.save_results([record]) == []
+        assert len(Host.objects.get(ip="192.0.2.1").services) == 2
+
+    def test_host_down(self):
+        """Test that a known host that stops responding is recorded."""
+        first_scan()
+        scan_run = ScanRun(kind="discovery")
+        changes = scan_run.save_results([], down=["192.0.2.1", "192.0.2.99"])
+        assert [(c.ip, c.change) for c in changes] == [("192.0.2.1", "host_down")]
+        assert Host.objects.get(ip="192.0.2.1").state == "down"
+
+    def test_known_in(self):
+        """Test finding the known hosts within targets."""
+        first_scan()
+        assert [h.ip for h in Host.known_in(["192.0.2.0/24"])] == ["192.0.2.1"]
+        assert list(Host.known_in(["198.51.100.1"])) == []
+
+    def test_known_in_ranges(self):
+        """Test that known hosts are found by address range."""
+        ScanRun(kind="discovery").save_results(
+            [
+                {"address": address, "state": "up"}
+                for address in ("10.0.0.1", "10.255.0.1", "11.0.0.1", "2001:db8::1")
+            ]
+        )
+        targets = ["10.0.0.0/8", "10.0.0.0/24", "2001:db8::/32"]
+        found = sorted(host.ip for host in Host.known_in(targets))
+        assert found == ["10.0.0.1", "10.255.0.1", "2001:db8::1"]
+        assert Host.objects.get(ip="2001:db8::1").ip_key == "6:20010db8" + "0" * 23 + "1"
+
+    def test_profile(self):
+        """Test that scans teach a host's profile."""
+        first_scan()
+        record = host_record("192.0.2.2", [(22, "ssh"), (8443, "https")])
+        record["times"] = {"srtt": 71234, "rttvar": 2345, "to": 100000}
+        ScanRun(kind="port").save_results([record])
+        discovery = {"address": "192.0.2.2", "state": "up", "reason": "echo-reply"}
+        ScanRun(kind="discovery").save_results([discovery])
+        profile = Host.objects.get(ip="192.0.2.2").profile
+        assert profile.srtt == 71000
+        assert profile.rttvar == 2300
+        assert profile.ping_reason == "echo-reply"
+        assert profile.probe_ports == [22, 8443]
+        profiles = Host.profiles_for(["192.0.2.0/30"])
+        assert profiles["192.0.2.2"]["srtt"] == 71000
+        assert sorted(profiles) == ["192.0.2.1", "192.0.2.2"]
+
+    def test_profile_misses(self):
+        """Test that misses are counted until a host is unresponsive."""
+        ScanRun(kind="port").save_results([host_record("192.0.2.2", [(22, "ssh")])])
+        for _ in range(5):
+            ScanRun(kind="discovery").save_results([], down=["192.0.2.2"])
+        assert Host.objects.get(ip="192.0.2.2").profile.misses == 3
+        # once the count stops changing there is nothing left to write
+        scan_run = ScanRun(kind="discovery")
+        scan_run.save_results([], down=["192.0.2.2"])
+        assert Host.objects.get(ip="192.0.2.2").last_scan != scan_run.id
@@ -0,0 +1,135 @@
+#!/usr/bin/env pytest -vs
+"""Tests for scan process management."""
+
+import io
+import subprocess
+import time
+
+from celery import Celery
+import pytest
+
+from admiral.port_scan.parser import iter_records
+from admiral.port_scan.process import (
+    ScanProcess,
+    ScanTimeout,
+    SlotTimeout,
+    scan_slot,
+)
+from admiral.port_scan.tasks import SCAN_TASK_OPTIONS, NmapTask, scan_it
+
+PROGRESS_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<nmaprun scanner="nmap" args="nmap --stats-every 60 -p1-65535 192.0.2.1">
+<taskbegin task="SYN Stealth Scan" time="1549000000"/>
+<taskprogress task="SYN Stealth Scan" time="1549000060" percent="12.50"
+ remaining="420" etc="1549000480"/>
+<host><status state="up" reason="syn-ack"/>
+<address addr="192.0.2.1" addrtype="ipv4"/></host>
+<runstats><finished time="1549000480" elapsed="480.00" exit="success"/>
+<hosts up="1" down="0" total="1"/></runstats>
+</nmaprun>
+"""
+
+
+def run(command, timeout=None):
+    """Run a command to completion, returning the process and its stdout."""
+    with ScanProcess(command, timeout) as process:
+        stdout = process.stdout.read()
+    return process, stdout
+
+
+class TestScanProcess:
+    """Test the streaming process runner."""
+
+    def test_output(self):
+        """Test that stdout and stderr are both collected."""
+        process, stdout = run("echo out; echo err >&2")
+        assert stdout == b"out\n"
+        assert process.stderr == "err"
+        assert process.returncode == 0
+
+    def test_failure(self):
+        """Test that stderr is reported when a command fails."""
+        with pytest.raises(subprocess.CalledProcessError) as err:
+            run("echo broken >&2; exit 2")
+        assert err.value.returncode == 2
+        assert err.value.stderr == "broken"
+
+    def test_timeout(self):
+        """Test that a runaway command is killed."""
+        start = time.monotonic()
+        with pytest.raises(ScanTimeout):
+            run("sleep 30", timeout=0.5)
+        assert time.monotonic() - start < 10
+
+    def test_killed_on_error(self):
+        """Test that leaving the context with an exception kills the command."""
+        with pytest.raises(RuntimeError):
+            with ScanProcess("sleep 30") as process:
+                raise RuntimeError("time limit")
+        assert process.returncode is not None
+
+
+class TestScanSlots:
+    """Test limiting concurrent scans."""
+
+    def test_slots(self, tmp_path):
+        """Test that slots are exclusive until released."""
+        with scan_slot(2, str(tmp_path)) as first:
+            with scan_slot(2, str(tmp_path)) as second:
+                assert {first, second} == {0, 1}
+                with pytest.raises(SlotTimeout):
+                    with scan_slot(2, str(tmp_path), timeout=0):
+                        pass
+        with scan_slot(2, str(tmp_path), timeout=0) as slot:
+            assert slot == 0
+
+    def test_unlimited(self, tmp_path):
+        """Test that slots can be disabled."""
+        with scan_slot(0, str(tmp_path)) as slot:
+            assert slot is None
+
+
+class TestProgress:
+    """Test parsing nmap progress records."""
+
+    def test_progress(self):
+        """Test that progress is reported before the host completes."""
+        records = list(iter_records(io.BytesIO(PROGRESS_XML)))
+        assert [kind for kind, _ in records] == ["progress", "host", "runstats"]
+        assert records[0][1] == {
+            "task": "SYN Stealth Scan",
+            "percent": 12.5,
+            "remaining": 420,
+            "etc": 1549000480,
+        }
+
+
+class TestScanRetries:
+    """Test which scan failures are retried."""
+
+    @pytest.fixture
+    def task(self):
+        """Create a task with the scan task options, running a command."""
+        app = Celery(set_as_current=False)
+        app.conf.admiral_scan_slots = 0
+        app.conf.admiral_scan_timeout = 0.5
+
+        @app.task(name="scan_process_test.scan", base=NmapTask, **SCAN_TASK_OPTIONS)
+        def scan(self, command):
+            self.runs += 1
+            return list(scan_it(command, self))
+
+        scan.runs = 0
+        return scan
+
+    def test_failure_retried(self, task):
+        """Test that a failed scan is retried."""
+        result = task.apply(args=("exit 2",))
+        assert isinstance(result.result, subprocess.CalledProcessError)
+        assert task.runs == 4
+
+    def test_timeout_not_retried(self, task):
+        """Test that a scan killed for running too long is not retried."""
+        result = task.apply(args=("sleep 30",))
+        assert isinstance(result.result, ScanTimeout)
+        assert task.runs == 1
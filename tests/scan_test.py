@@ -2,11 +2,16 @@
 
 """Tests for port scan tasks."""
 
+import ipaddress
 import pprint
+import random
 
 import pytest
 
-from admiral.port_scan.tasks import up_scan, port_scan
+from admiral.port_scan.tasks import (
+    batch_targets, merge_host_records, port_ranges, port_scan, up_scan,
+    up_scan_group)
+from admiral.port_scan.timing import RTT_TIERS
 
 PP = pprint.PrettyPrinter(indent=4)
 
@@ -39,3 +44,94 @@ class TestPortScans:
         """Test port_scan task."""
         ns2 = port_scan.delay(host_ip)
         PP.pprint(ns2.get())
+
+
+class TestTargetBatching:
+    """Test splitting discovery targets into batches."""
+
+    def test_large_network_is_split(self):
+        """Test that a /16 becomes a handful of batches."""
+        batches = batch_targets(['10.1.0.0/16'], max_addresses=4096)
+        assert len(batches) == 16
+        assert batches[0] == ['10.1.0.0/20']
+
+    def test_small_targets_are_packed(self):
+        """Test that adjacent and small targets share a batch."""
+        batches = batch_targets(['10.0.0.1', '10.0.0.0/31', '192.0.2.0/24'])
+        assert batches == [['10.0.0.0/31', '192.0.2.0/24']]
+
+    def test_versions_are_not_mixed(self):
+        """Test that IPv4 and IPv6 targets are never batched together."""
+        batches = batch_targets(['192.0.2.1', '2001:db8::1'])
+        assert batches == [['192.0.2.1/32'], ['2001:db8::1/128']]
+
+    def test_invalid_target(self):
+        """Test that invalid targets are rejected."""
+        with pytest.raises(ValueError):
+            batch_targets(['not-an-ip'])
+        with pytest.raises(ValueError):
+            batch_targets(['10.0.0.0/8'])
+
+    def test_profiled_hosts_share_batches(self):
+        """Test that profiled hosts don't each get their own batch."""
+        rng = random.Random(31)
+        network = ipaddress.ip_network('10.1.0.0/16')
+        profiles = {}
+        for address in rng.sample(list(network.hosts()), 2000):
+            profiles[str(address)] = {
+                'srtt': rng.randrange(500, 500000),
+                'rttvar': rng.randrange(0, 50000),
+                'ping_reason': rng.choice(['echo-reply', 'syn-ack', None]),
+                'probe_ports': sorted(rng.sample([22, 25, 80, 443, 3389,
+                                                  8080, 8443], 2)),
+                'misses': rng.choice([0, 0, 0, 3]),
+            }
+        signatures = up_scan_group([str(network)], profiles=profiles).tasks
+        # the default batches, plus one per discovery class
+        assert len(signatures) <= 16 + len(RTT_TIERS) + 2
+        # every profiled host is in one class batch and excluded elsewhere
+        profiled = sum(ipaddress.ip_network(n).num_addresses
+                       for sig in signatures if len(sig.args) > 1
+                       for n in sig.args[0])
+        excluded = [address for sig in signatures
+                    for address in sig.kwargs.get('exclude', [])]
+        assert profiled == len(excluded) == 2000
+
+
+class TestPortSharding:
+    """Test splitting port scans into shards and merging the results."""
+
+    def test_port_ranges(self):
+        """Test that shards cover the whole port space without overlap."""
+        ranges = port_ranges(7)
+        assert len(ranges) == 7
+        ports = []
+        for port_range in ranges:
+            start, end = (int(i) for i in port_range.split('-'))
+            ports.extend(range(start, end + 1))
+        assert ports == list(range(1, 65536))
+
+    def test_more_shards_than_ports(self):
+        """Test that a shard is never empty."""
+        assert port_ranges(5, first=1, last=3) == ['1-1', '2-2', '3-3']
+
+    def test_merge(self):
+        """Test merging shard results into one host record."""
+        shards = [
+            {'address': '192.0.2.1', 'state': 'up', 'reason': 'user-set',
+             'hostnames': ['www.example.gov'],
+             'os': [{'name': 'Linux 4.15', 'accuracy': 95}],
+             'ports': [{'port': 443, 'protocol': 'tcp', 'state': 'open'}]},
+            None,
+            {'address': '192.0.2.1', 'state': 'up', 'reason': 'user-set',
+             'hostnames': [],
+             'ports': [{'port': 22, 'protocol': 'tcp', 'state': 'open'}]},
+        ]
+        merged = merge_host_records(shards)
+        assert [p['port'] for p in merged['ports']] == [22, 443]
+        assert merged['hostnames'] == ['www.example.gov']
+        assert merged['os'][0]['name'] == 'Linux 4.15'
+
+    def test_merge_nothing(self):
+        """Test merging when no shard reported the host."""
+        assert merge_host_records([None, None]) is None
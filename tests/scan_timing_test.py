@@ -0,0 +1,96 @@
+#!/usr/bin/env pytest -vs
+"""Tests for adaptive scan timing."""
+
+from admiral.port_scan.timing import (
+    UNRESPONSIVE_CLASS,
+    discovery_class,
+    discovery_options,
+    port_scan_options,
+    shared_profile,
+)
+
+KNOWN_HOST = {
+    "srtt": 30000,
+    "rttvar": 5000,
+    "ping_reason": "echo-reply",
+    "probe_ports": [22, 443],
+    "misses": 0,
+    "timeouts": 0,
+}
+
+
+class TestTiming:
+    """Test generating nmap options from host profiles."""
+
+    def test_unknown_host(self):
+        """Test that unknown hosts get the conservative defaults."""
+        options = discovery_options(None)
+        assert "--host-timeout 15m" in options
+        assert "-PE -PP -PS443,80,1720" in options
+        assert port_scan_options(None).endswith("--max-retries 2")
+
+    def test_known_host(self):
+        """Test that known hosts only get the probes that worked."""
+        options = discovery_options(KNOWN_HOST)
+        assert "--host-timeout 2m" in options
+        assert "-PE -PS22,443" in options
+        assert "-PP" not in options
+        # (30ms + 4 * 5ms) clamped to the minimum, and double that
+        assert "--initial-rtt-timeout 50ms --max-rtt-timeout 100ms" in options
+
+    def test_known_host_port_scan(self):
+        """Test that a steady host gets fewer retries and tighter timeouts."""
+        options = port_scan_options(KNOWN_HOST)
+        assert "--max-retries 1" in options
+        assert "--host-timeout 120m" in options
+        assert "--max-rtt-timeout 100ms" in options
+
+    def test_unresponsive_host(self):
+        """Test that unresponsive hosts don't use the full host timeout."""
+        options = discovery_options(dict(KNOWN_HOST, misses=3))
+        assert "--host-timeout 1m --max-retries 0" in options
+        assert options.endswith("-PE -PS443,80,1720,22,49152")
+
+    def test_timed_out_host(self):
+        """Test that hosts that keep timing out get a shorter host timeout."""
+        options = port_scan_options(dict(KNOWN_HOST, timeouts=2))
+        assert "--host-timeout 30m" in options
+
+
+class TestDiscoveryClasses:
+    """Test batching hosts with similar profiles."""
+
+    def test_classes(self):
+        """Test that hosts are classed by round trip time tier."""
+        assert discovery_class(None) is None
+        assert discovery_class({"srtt": 30000, "ping_reason": "syn-ack"}) is None
+        assert discovery_class(dict(KNOWN_HOST, misses=3)) == UNRESPONSIVE_CLASS
+        assert discovery_class(KNOWN_HOST) == 1
+        assert discovery_class(dict(KNOWN_HOST, srtt=5000, rttvar=0)) == 0
+        assert discovery_class(dict(KNOWN_HOST, srtt=None)) == 3
+
+    def test_shared_profile(self):
+        """Test that a shared profile reaches every host it covers."""
+        profiles = {
+            "192.0.2.1": KNOWN_HOST,
+            "192.0.2.2": dict(KNOWN_HOST, srtt=60000, ping_reason=None),
+            "192.0.2.3": dict(KNOWN_HOST, ping_reason="reset", probe_ports=[80]),
+            "192.0.2.4": dict(KNOWN_HOST, ping_reason=None, probe_ports=[22, 80]),
+        }
+        profile, covered = shared_profile(profiles)
+        assert covered == sorted(profiles)
+        assert profile["probe_ports"] == [22, 80]
+        assert profile["ping_reasons"] == ["echo-reply", "reset"]
+        options = discovery_options(profile)
+        assert "-PE -PS22,80" in options
+        # the slowest host's 60ms + 4 * 5ms
+        assert "--initial-rtt-timeout 80ms" in options
+
+    def test_shared_probe_limit(self):
+        """Test that hosts the shared probes miss are left out."""
+        profiles = {
+            f"192.0.2.{port}": dict(KNOWN_HOST, ping_reason=None, probe_ports=[port])
+            for port in range(1, 41)
+        }
+        profile, covered = shared_profile(profiles)
+        assert len(profile["probe_ports"]) == len(covered) == 30
@@ -0,0 +1,79 @@
+#!/usr/bin/env pytest -vs
+"""Tests for the load generation tasks and driver."""
+
+from celery import Celery
+from celery.result import GroupResult
+import pytest
+
+from admiral.tester.driver import Run, percentile, wait_for_groups
+from admiral.tester.tasks import LoadFailure, collect, load
+
+
+class TestLoadTasks:
+    """Test the synthetic work tasks."""
+
+    def test_result_size(self):
+        """Test that results are the requested size."""
+        assert load(payload="ignored") == ""
+        assert len(load(result_size=1000)) == 1000
+
+    def test_failure(self):
+        """Test that failures happen at the requested rate."""
+        with pytest.raises(LoadFailure):
+            load(failure_rate=1)
+
+    def test_collect(self):
+        """Test summarizing a chord's results."""
+        assert collect(["ab", "cde", ""]) == {"count": 3, "bytes": 5}
+
+
+class TestDriver:
+    """Test the driver's statistics."""
+
+    def test_percentile(self):
+        """Test nearest rank percentiles."""
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile(values, 100) == 100
+        assert percentile([7], 90) == 7
+
+    def test_report(self):
+        """Test the run summary."""
+        run = Run("group", 10)
+        run.sent = {"a": 0.0, "b": 0.0}
+        run.latencies = [0.010, 0.020]
+        run.failures = 1
+        run.dispatch_time = 0.5
+        run.elapsed = 2.0
+        report = run.report()
+        assert "2 x 10 tasks" in report
+        assert "dispatch 40 tasks/s" in report
+        assert "throughput 10 tasks/s" in report
+        assert "p50 10.0ms" in report
+        assert "1 failed" in report
+
+    def test_empty_report(self):
+        """Test the summary of a run with no tasks."""
+        report = Run("chord", 10).report()
+        assert "0 x 10 tasks" in report
+        assert "dispatch nan tasks/s" in report
+
+    def test_wait_for_groups(self):
+        """Test that each group is recorded once, when all its tasks finish."""
+        app = Celery(set_as_current=False)
+
+        @app.task(name="tester_test.work")
+        def work(fail=False):
+            if fail:
+                raise LoadFailure()
+
+        groups = [
+            GroupResult("ok", [work.apply(), work.apply()], app=app),
+            GroupResult("failed", [work.apply(), work.apply((True,))], app=app),
+        ]
+        run = Run("group", 2)
+        run.sent = {"ok": 0.0, "failed": 0.0}
+        wait_for_groups(run, groups, timeout=1)
+        assert len(run.latencies) == 2
+        assert run.failures == 1